@@ -0,0 +1,225 @@
+import time
+from typing import Dict, Optional
+
+import torch
+from transformers import LogitsProcessorList, RepetitionPenaltyLogitsProcessor
+from transformers.generation.beam_search import BeamHypotheses
+
+from indextts.gpt.kv_cache import StaticKVCache, static_gpt2_forward
+
+
+class MelBeamSearch:
+    """
+    Beam search over mel codes for a ``UnifiedVoice``, replacing ``generate(num_beams > 1)``.
+
+    It follows the ``_beam_search`` / ``BeamSearchScorer`` of transformers step for step (same candidate
+    selection, length penalty, stopping heuristic and output layout, so the codes are the same for the same
+    seed), but keeps every per-step buffer preallocated:
+
+    * the ``batch * num_beams`` rows live in the static KV cache; the prompt is prefilled once per batch row
+      and copied to the other beams, and after each step only the rows whose parent beam changed are
+      rewritten in place, instead of an ``index_select`` of every layer's past into new tensors;
+    * the codes are written into a preallocated ``(rows, max_length)`` buffer instead of growing ``input_ids``;
+    * the repetition penalty is fused into the scoring through a per-row mask of the codes already seen,
+      reordered with the beams, instead of gathering and scattering the whole history every step.
+
+    Generation stops as soon as every row is done, i.e. holds ``num_beams`` finished hypotheses that no
+    running beam can beat anymore. ``supports`` tells ``inference_speech`` when to fall back to ``generate()``.
+    """
+
+    SUPPORTED_KWARGS = {"do_sample", "top_k", "top_p", "temperature", "repetition_penalty", "length_penalty",
+                        "num_beams", "num_return_sequences", "min_length", "min_new_tokens", "early_stopping"}
+
+    def __init__(self, gpt):
+        self.gpt = gpt
+        self.last_stats: Optional[Dict] = None
+
+    def supports(self, generate_kwargs) -> bool:
+        num_beams = generate_kwargs.get("num_beams", 1)
+        return (num_beams > 1 and generate_kwargs.get("num_return_sequences", 1) <= num_beams
+                and set(generate_kwargs) <= self.SUPPORTED_KWARGS)
+
+    @staticmethod
+    def _reorder_rows(cache: StaticKVCache, moves: Dict[int, int]):
+        """
+        Apply ``row <- parent`` for every item of ``moves`` to the filled positions of the cache, in place.
+
+        A row is overwritten only once no pending move still reads it, so plain row copies suffice; a cycle
+        (beams that swapped places) parks one row in a scratch copy first.
+        """
+        n = cache.length
+        buffers = (cache.key[:, :, :, :n], cache.value[:, :, :, :n], cache.valid[:, :n])
+
+        def row(buf, index):
+            return buf[index] if buf.dim() == 2 else buf[:, index]
+
+        moves = dict(moves)
+        parked = None
+        while moves:
+            sources = set(moves.values())
+            free = [dest for dest in moves if dest not in sources]
+            if not free:
+                dest = next(iter(moves))
+                parked = [row(buf, dest).clone() for buf in buffers]
+                moves = {d: (-1 if s == dest else s) for d, s in moves.items()}
+                continue
+            for dest in free:
+                src = moves.pop(dest)
+                for i, buf in enumerate(buffers):
+                    row(buf, dest).copy_(parked[i] if src == -1 else row(buf, src))
+
+    @torch.no_grad()
+    def generate(self, inputs, attention_mask, max_length, logits_processor=None, **generate_kwargs):
+        """
+        Same contract as ``GPT2InferenceModel.generate(inputs, num_beams=...)``: returns, for every row of
+        ``inputs``, the ``num_return_sequences`` best hypotheses as prompt ids followed by the codes, padded
+        with ``stop_mel_token``.
+        """
+        gpt = self.gpt
+        model = gpt.inference_model
+        start_time = time.perf_counter()
+        device = inputs.device
+        eos = gpt.stop_mel_token
+        generation_config, model_kwargs = model._prepare_generation_config(
+            None, bos_token_id=gpt.start_mel_token, pad_token_id=eos, eos_token_id=eos, max_length=max_length,
+            **generate_kwargs)
+        model._prepare_special_tokens(generation_config, True, device=device)
+        processors = model._get_logits_processor(
+            generation_config=generation_config, input_ids_seq_length=inputs.shape[1], encoder_input_ids=inputs,
+            prefix_allowed_tokens_fn=None, logits_processor=logits_processor or LogitsProcessorList(),
+            device=device, model_kwargs=model_kwargs)
+        # the repetition penalty is always the first processor for these kwargs: apply it fused, up front
+        penalty = 1.0
+        for processor in processors:
+            if isinstance(processor, RepetitionPenaltyLogitsProcessor):
+                penalty = processor.penalty
+        processors = LogitsProcessorList(p for p in processors if not isinstance(p, RepetitionPenaltyLogitsProcessor))
+        do_sample = generation_config.do_sample
+        num_beams = generation_config.num_beams
+        num_return = generation_config.num_return_sequences
+        batch_size, prompt_len = inputs.shape
+        rows = batch_size * num_beams
+        mel_len = model.cached_mel_emb.shape[1]
+
+        # prefill the first beam of every batch row in place, then copy its prompt keys/values to the others
+        cache = model._new_static_cache(rows, model.transformer.wte.weight.dtype, device)
+        first_beams = StaticKVCache.__new__(StaticKVCache)
+        first_beams.key = cache.key[:, ::num_beams]
+        first_beams.value = cache.value[:, ::num_beams]
+        first_beams.valid = cache.valid[::num_beams]
+        first_beams.length = 0
+        out = model(input_ids=inputs, attention_mask=attention_mask, past_key_values=first_beams, use_cache=True,
+                    return_dict=True)
+        n = cache.length = first_beams.length
+        for beam in range(1, num_beams):
+            cache.key[:, beam::num_beams, :, :n] = cache.key[:, ::num_beams, :, :n]
+            cache.value[:, beam::num_beams, :, :n] = cache.value[:, ::num_beams, :, :n]
+            cache.valid[beam::num_beams, :n] = cache.valid[::num_beams, :n]
+        logits = out.logits[:, -1].float().repeat_interleave(num_beams, dim=0)
+        vocab_size = logits.shape[-1]
+
+        tokens = inputs.new_full((rows, max_length), eos)
+        tokens[:, :prompt_len] = inputs.repeat_interleave(num_beams, dim=0)
+        seen = torch.zeros((rows, vocab_size), dtype=torch.bool, device=device)
+        if penalty != 1.0:
+            seen.scatter_(1, tokens[:, :prompt_len], True)
+        beam_scores = torch.zeros((batch_size, num_beams), dtype=torch.float, device=device)
+        beam_scores[:, 1:] = -1e9
+        beam_scores = beam_scores.view(-1)
+        identity = torch.arange(rows, device=device)
+        hyps = [BeamHypotheses(num_beams, generation_config.length_penalty, generation_config.early_stopping,
+                               max_length) for _ in range(batch_size)]
+        done = [False] * batch_size
+        n_keep = 2 * num_beams
+        stats = {"steps": 0, "rows_reordered": 0}
+        cur_len = prompt_len
+
+        while True:
+            scores = torch.log_softmax(logits, dim=-1)
+            if penalty != 1.0:
+                penalized = torch.where(scores < 0, scores * penalty, scores / penalty)
+                scores = torch.where(seen, penalized, scores)
+            scores = processors(tokens[:, :cur_len], scores)
+            scores = (scores + beam_scores[:, None]).view(batch_size, num_beams * vocab_size)
+            if do_sample:
+                candidates = torch.multinomial(torch.softmax(scores, dim=-1), num_samples=n_keep)
+                candidate_scores = torch.gather(scores, -1, candidates)
+                candidate_scores, order = torch.sort(candidate_scores, descending=True, dim=1)
+                candidates = torch.gather(candidates, -1, order)
+            else:
+                candidate_scores, candidates = torch.topk(scores, n_keep, dim=1, largest=True, sorted=True)
+            stats["steps"] += 1
+
+            # hypothesis bookkeeping on the host, as BeamSearchScorer.process does
+            next_scores, next_tokens, parents = [], [], []
+            for b, (row_scores, row_tokens) in enumerate(zip(candidate_scores.tolist(), candidates.tolist())):
+                if done[b]:
+                    next_scores += [0.0] * num_beams
+                    next_tokens += [eos] * num_beams
+                    parents += range(b * num_beams, (b + 1) * num_beams)
+                    continue
+                kept = 0
+                for rank, (score, token) in enumerate(zip(row_scores, row_tokens)):
+                    parent = b * num_beams + token // vocab_size
+                    token %= vocab_size
+                    if token == eos:
+                        if rank < num_beams:
+                            hyps[b].add(tokens[parent, :cur_len].clone(), score,
+                                        generated_len=cur_len + 1 - prompt_len)
+                    else:
+                        next_scores.append(score)
+                        next_tokens.append(token)
+                        parents.append(parent)
+                        kept += 1
+                        if kept == num_beams:
+                            break
+                done[b] = hyps[b].is_done(max(row_scores), cur_len + 1, prompt_len)
+
+            moves = {row: parent for row, parent in enumerate(parents) if parent != row}
+            if moves:
+                self._reorder_rows(cache, moves)
+                parents = torch.tensor(parents, device=device)
+                tokens[:, :cur_len] = tokens[parents, :cur_len]
+                if penalty != 1.0:
+                    seen.copy_(seen[parents])
+                stats["rows_reordered"] += len(moves)
+            new_tokens = torch.tensor(next_tokens, dtype=tokens.dtype, device=device)
+            tokens[:, cur_len] = new_tokens
+            if penalty != 1.0:
+                seen[identity, new_tokens] = True
+            beam_scores = torch.tensor(next_scores, dtype=torch.float, device=device)
+            cur_len += 1
+            if all(done) or cur_len >= max_length:
+                break
+
+            # the k-th generated code sits at mel position k + 1, like GPT2InferenceModel.forward
+            emb = model.embeddings(new_tokens[:, None])
+            emb = emb + model.text_pos_embedding.get_fixed_embedding(cur_len - mel_len, device)
+            hidden = static_gpt2_forward(model.transformer, emb, cache, filled_only=True)
+            logits = model.lm_head(hidden)[:, -1].float()
+
+        # unfinished rows: every running beam competes with the finished hypotheses
+        final_scores = beam_scores.tolist()
+        for b in range(batch_size):
+            if not done[b]:
+                for row in range(b * num_beams, (b + 1) * num_beams):
+                    hyps[b].add(tokens[row, :cur_len].clone(), final_scores[row], generated_len=cur_len - prompt_len)
+        best = []
+        for hyp in hyps:
+            ranked = sorted(hyp.beams, key=lambda beam: beam[0])
+            best += [ranked.pop()[1] for _ in range(num_return)]
+        width = min(max(len(seq) for seq in best) + 1, max_length)
+        output = inputs.new_full((len(best), width), eos)
+        for i, seq in enumerate(best):
+            output[i, :len(seq)] = seq
+
+        generated = cur_len - prompt_len
+        stats.update({
+            "tokens": generated,
+            "rows": rows,
+            # share of the beam rows whose KV had to be copied per step (HF copies all of them)
+            "reorder_fraction": stats["rows_reordered"] / (stats["steps"] * rows),
+            "total_time": time.perf_counter() - start_time,
+        })
+        self.last_stats = stats
+        return output
@@ -0,0 +1,163 @@
+import time
+from collections import deque
+from typing import Dict, List, Optional, Sequence
+
+import torch
+
+from indextts.gpt.kv_cache import StaticKVCache, static_gpt2_decode, static_gpt2_forward
+from indextts.gpt.sampling import MelTokenSampler
+
+
+class ContinuousBatchScheduler:
+    """
+    Iteration-level (in-flight) batching of mel-code generation for a ``UnifiedVoice``.
+
+    Instead of running a fixed batch until its longest row stops, the scheduler keeps ``max_batch_size``
+    slots in one static KV cache. Every step decodes one token for all slots; a row that emits
+    ``stop_mel_token`` (or reaches its length limit) is retired right away and the next pending segment is
+    admitted into the freed slot with its own prefill. Rows sit at different positions, so each one writes
+    its keys and values at its own offset.
+
+    Rows need not share a speaker. Sampling follows ``generate()`` for ``num_beams=1``: repetition penalty,
+    then temperature, top-k and top-p. Beam search cannot be scheduled per iteration and is not supported.
+    """
+
+    def __init__(self, gpt, max_batch_size=8, do_sample=True, top_k=30, top_p=0.8, temperature=0.8,
+                 repetition_penalty=10.0, max_generate_length=None):
+        self.gpt = gpt
+        self.model = gpt.inference_model
+        self.max_batch_size = max_batch_size
+        self.max_generate_length = max_generate_length or gpt.max_mel_tokens - 1
+        self.sampler = MelTokenSampler(do_sample=do_sample, top_k=top_k, top_p=top_p, temperature=temperature,
+                                       repetition_penalty=repetition_penalty)
+        self.last_metrics: Optional[Dict] = None
+
+    # ---- prompts ---------------------------------------------------------------
+    def _prompt(self, conds_latent, text_tokens):
+        """Prompt embeddings (1, S + 1, dim) of one segment: [cond][text][start_mel]."""
+        gpt = self.gpt
+        _, inputs_embeds, attention_mask = gpt.prepare_gpt_inputs(conds_latent, text_tokens.view(1, -1))
+        # a single row is only left padded when start/stop text tokens were filtered out; drop the padding
+        inputs_embeds = inputs_embeds[:, int((attention_mask[0] == 0).sum()):]
+        start = torch.tensor([[gpt.start_mel_token]], device=inputs_embeds.device)
+        start_emb = gpt.mel_embedding(start) + gpt.mel_pos_embedding.get_fixed_embedding(0, start.device)
+        return torch.cat([inputs_embeds, start_emb.to(inputs_embeds.dtype)], dim=1)
+
+    def _prefill(self, cache: StaticKVCache, slot: int, conds_latent, text_tokens):
+        """Prefill ``slot`` with one segment in place; returns the logits of its first mel code and its length."""
+        emb = self._prompt(conds_latent, text_tokens)
+        view = cache.slot(slot)
+        prefix_cache = self.model.prefix_cache
+        if prefix_cache is not None:
+            prefix_len = conds_latent.shape[1]
+            key, value = prefix_cache.get(conds_latent[0].to(emb.dtype), self.model._prefix_kv)
+            view.key[:, 0, :, :prefix_len] = key
+            view.value[:, 0, :, :prefix_len] = value
+            view.valid[:, :prefix_len] = True
+            view.length = prefix_len
+            emb = emb[:, prefix_len:]
+        hidden = static_gpt2_forward(self.model.transformer, emb, view)
+        return self.model.lm_head(hidden[:, -1]), view.length
+
+    # ---- sampling --------------------------------------------------------------
+    def _next_tokens(self, logits, seen):
+        return self.sampler(logits, seen)
+
+    # ---- scheduling ------------------------------------------------------------
+    @torch.no_grad()
+    def generate(self, prompts: Sequence[Dict]) -> List[Dict]:
+        """
+        Generate mel codes for ``prompts``, each a dict with ``conds_latent`` (1, P, dim) from
+        ``UnifiedVoice.build_conds_latent``, ``text_tokens`` (L,) and an optional ``max_generate_length``.
+        Returns, in prompt order, ``{"codes": (n,) LongTensor without the stop token, "stopped": bool}``.
+        Throughput and slot utilization of the run are kept in ``last_metrics``.
+        """
+        gpt, model = self.gpt, self.model
+        start_time = time.perf_counter()
+        device = prompts[0]["conds_latent"].device
+        dtype = next(model.transformer.parameters()).dtype
+        slots = min(self.max_batch_size, len(prompts))
+        limits = [p.get("max_generate_length") or self.max_generate_length for p in prompts]
+        max_prompt = max(p["conds_latent"].shape[1] + len(p["text_tokens"]) + 3 for p in prompts)
+        config = model.config
+        cache = StaticKVCache(config.n_layer, slots, config.n_head, max_prompt + max(limits),
+                              config.n_embd // config.n_head, dtype=dtype, device=device)
+        vocab = gpt.number_mel_codes
+        seen = torch.zeros((slots, vocab), dtype=torch.bool, device=device)
+        positions = torch.zeros(slots, dtype=torch.long, device=device)
+        last_tokens = torch.full((slots,), gpt.stop_mel_token, dtype=torch.long, device=device)
+
+        pending = deque(range(len(prompts)))
+        owner: List[Optional[int]] = [None] * slots
+        codes: List[List[int]] = [[] for _ in prompts]
+        stopped = [False] * len(prompts)
+        steps = active_slot_steps = prefills = 0
+        prefill_time = 0.0
+
+        def admit(slot):
+            nonlocal prefills, prefill_time
+            while pending:
+                idx = pending.popleft()
+                t0 = time.perf_counter()
+                prompt = prompts[idx]
+                logits, length = self._prefill(cache, slot, prompt["conds_latent"], prompt["text_tokens"])
+                prefill_time += time.perf_counter() - t0
+                prefills += 1
+                positions[slot] = length
+                # generate() starts from fake prompt ids (ones) and start_mel_token, which the penalty sees too
+                seen[slot].zero_()
+                seen[slot, 1] = True
+                seen[slot, gpt.start_mel_token] = True
+                token = self._next_tokens(logits, seen[slot:slot + 1])
+                if accept(slot, idx, int(token)):
+                    return
+            owner[slot] = None
+
+        def accept(slot, idx, token):
+            """Record a sampled code; returns whether the row keeps its slot."""
+            if token == gpt.stop_mel_token:
+                stopped[idx] = True
+                return False
+            codes[idx].append(token)
+            if len(codes[idx]) >= limits[idx]:
+                return False
+            owner[slot] = idx
+            last_tokens[slot] = token
+            seen[slot, token] = True
+            return True
+
+        for slot in range(slots):
+            admit(slot)
+        while any(o is not None for o in owner):
+            active = [s for s in range(slots) if owner[s] is not None]
+            steps += 1
+            active_slot_steps += len(active)
+            # the k-th generated code is embedded at mel position k + 1, as in GPT2InferenceModel.forward
+            generated = torch.tensor([len(codes[owner[s]]) if owner[s] is not None else 0 for s in range(slots)],
+                                     device=device)
+            emb = gpt.mel_embedding(last_tokens) + gpt.mel_pos_embedding.emb(generated + 1)
+            hidden = static_gpt2_decode(model.transformer, emb.unsqueeze(1).to(dtype), cache, positions)
+            rows = torch.tensor(active, device=device)
+            # idle slots keep rewriting their last position and never attend to anything else
+            positions[rows] += 1
+            logits = model.lm_head(hidden[rows, 0])
+            tokens = self._next_tokens(logits, seen[rows]).tolist()
+            for slot, token in zip(active, tokens):
+                if not accept(slot, owner[slot], token):
+                    admit(slot)
+
+        elapsed = time.perf_counter() - start_time
+        total = sum(len(c) for c in codes)
+        self.last_metrics = {
+            "segments": len(prompts),
+            "slots": slots,
+            "tokens": total,
+            "steps": steps,
+            "prefills": prefills,
+            "prefill_time": prefill_time,
+            "total_time": elapsed,
+            "tokens_per_s": total / elapsed if elapsed > 0 else 0.0,
+            "slot_utilization": active_slot_steps / (steps * slots) if steps else 0.0,
+        }
+        return [{"codes": torch.tensor(c, dtype=torch.long, device=device), "stopped": s}
+                for c, s in zip(codes, stopped)]
@@ -0,0 +1,212 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+import torch
+import torch.nn.functional as F
+
+
+class StaticKVCache:
+    """
+    Preallocated key/value cache for GPT-2 decoding.
+
+    Keys and values of all layers live in two buffers of shape ``(layers, batch, heads, max_length, head_dim)``
+    that are allocated once and written in place, so a decoding step never reallocates or copies the past.
+    ``valid`` marks the slots a query may attend to: filled positions that are not left padding. Decoding
+    attends over the whole buffer and masks the rest, which keeps the cost of a step independent of how far
+    the generation has got.
+    """
+
+    def __init__(self, layers, batch_size, heads, max_length, head_dim, dtype=torch.float32, device=None):
+        shape = (layers, batch_size, heads, max_length, head_dim)
+        self.key = torch.zeros(shape, dtype=dtype, device=device)
+        self.value = torch.zeros(shape, dtype=dtype, device=device)
+        self.valid = torch.zeros((batch_size, max_length), dtype=torch.bool, device=device)
+        self.length = 0
+
+    @property
+    def batch_size(self) -> int:
+        return self.key.shape[1]
+
+    @property
+    def max_length(self) -> int:
+        return self.key.shape[3]
+
+    def __len__(self):
+        # number of filled positions; an empty cache is falsy like a missing one
+        return self.length
+
+    def get_seq_length(self, layer_idx=0) -> int:
+        return self.length
+
+    def matches(self, batch_size, max_length, dtype, device) -> bool:
+        return (self.batch_size == batch_size and self.max_length == max_length
+                and self.key.dtype == dtype and self.key.device == torch.device(device))
+
+    def reset(self):
+        self.valid.zero_()
+        self.length = 0
+
+    def truncate(self, length: int):
+        """Drop every position from ``length`` on, e.g. the rejected draft tokens of speculative decoding."""
+        self.valid[:, length:] = False
+        self.length = length
+
+    def slot(self, index: int) -> "StaticKVCache":
+        """Empty single-row cache sharing the buffers of row ``index``, to prefill one slot in place."""
+        view = StaticKVCache.__new__(StaticKVCache)
+        view.key = self.key[:, index:index + 1]
+        view.value = self.value[:, index:index + 1]
+        view.valid = self.valid[index:index + 1]
+        view.reset()
+        return view
+
+    def reorder_cache(self, beam_idx: torch.LongTensor):
+        """Reorder the batch rows to follow the selected beams (called by beam search)."""
+        n = self.length
+        beam_idx = beam_idx.to(self.key.device)
+        for buf in (self.key, self.value):
+            buf[:, :, :, :n].copy_(buf[:, :, :, :n].index_select(1, beam_idx))
+        self.valid[:, :n].copy_(self.valid[:, :n].index_select(0, beam_idx))
+        return self
+
+    def attention_mask(self, start, end) -> torch.Tensor:
+        """Boolean mask (batch, 1, queries, keys) for the queries at positions ``start:end``."""
+        if end - start == 1:
+            # one new token: everything filled so far, over the whole buffer
+            return self.valid[:, None, None, :]
+        q_pos = torch.arange(start, end, device=self.valid.device)
+        k_pos = torch.arange(end, device=self.valid.device)
+        causal = k_pos[None, :] <= q_pos[:, None]
+        mask = self.valid[:, None, None, :end] & causal
+        # padded query rows would otherwise attend to nothing and turn into NaN; their output is never used
+        return mask | (k_pos[None, :] == q_pos[:, None])
+
+
+def _run_blocks(transformer, hidden_states, cache, write_kv, kv_end, mask, num_layers=None):
+    batch, new_tokens, _ = hidden_states.shape
+    h = hidden_states
+    for i, block in enumerate(transformer.h[:num_layers]):
+        attn = block.attn
+        x = block.ln_1(h)
+        q, k, v = attn.c_attn(x).split(attn.split_size, dim=2)
+        q = q.view(batch, new_tokens, attn.num_heads, attn.head_dim).transpose(1, 2)
+        k = k.view(batch, new_tokens, attn.num_heads, attn.head_dim).transpose(1, 2)
+        v = v.view(batch, new_tokens, attn.num_heads, attn.head_dim).transpose(1, 2)
+        write_kv(i, k, v)
+        out = F.scaled_dot_product_attention(q, cache.key[i, :, :, :kv_end], cache.value[i, :, :, :kv_end],
+                                             attn_mask=mask)
+        out = out.transpose(1, 2).reshape(batch, new_tokens, attn.embed_dim)
+        h = h + attn.c_proj(out)
+        h = h + block.mlp(block.ln_2(h))
+    return transformer.ln_f(h)
+
+
+def static_gpt2_forward(transformer, hidden_states: torch.Tensor, cache: StaticKVCache,
+                        attention_mask: Optional[torch.Tensor] = None, num_layers: Optional[int] = None,
+                        filled_only: bool = False) -> torch.Tensor:
+    """
+    Run the blocks of a HuggingFace ``GPT2Model`` on ``hidden_states`` (batch, new_tokens, dim), appending
+    their keys and values to ``cache`` in place. ``attention_mask`` is the usual 2D generation mask covering
+    the cached and new positions. Returns the final hidden states after ``ln_f``.
+
+    With ``num_layers`` only the first blocks run (a layer-truncated draft); the deeper layers of the new
+    positions are left unwritten.
+
+    A single new token attends over the whole buffer so that the cost of a step stays flat; ``filled_only``
+    restricts it to the filled positions instead, which is cheaper when the buffer is far from full.
+
+    Position embeddings are not added: UnifiedVoice disables the GPT-2 ones and adds its own to the inputs.
+    """
+    new_tokens = hidden_states.shape[1]
+    start = cache.length
+    end = start + new_tokens
+    if end > cache.max_length:
+        raise ValueError(f"Static KV cache overflow: {end} positions, capacity {cache.max_length}")
+    if attention_mask is None:
+        cache.valid[:, start:end] = True
+    else:
+        cache.valid[:, start:end] = attention_mask[:, start:end].bool()
+    mask = cache.attention_mask(start, end)
+    kv_end = cache.max_length if new_tokens == 1 and not filled_only else end
+    if kv_end < mask.shape[-1]:
+        mask = mask[..., :kv_end]
+
+    def write_kv(i, k, v):
+        cache.key[i, :, :, start:end] = k
+        cache.value[i, :, :, start:end] = v
+
+    hidden_states = _run_blocks(transformer, hidden_states, cache, write_kv, kv_end, mask, num_layers)
+    cache.length = end
+    return hidden_states
+
+
+def static_gpt2_decode(transformer, hidden_states: torch.Tensor, cache: StaticKVCache,
+                       positions: torch.LongTensor) -> torch.Tensor:
+    """
+    One decoding step where every row sits at its own position (continuous batching): the new token of row
+    ``b`` (``hidden_states[b]``, shape (batch, 1, dim)) is written to slot ``positions[b]`` and attends to the
+    valid slots of its row. ``cache.length`` is not used.
+    """
+    rows = torch.arange(hidden_states.shape[0], device=positions.device)
+    cache.valid[rows, positions] = True
+    mask = cache.valid[:, None, None, :]
+
+    def write_kv(i, k, v):
+        cache.key[i, rows, :, positions] = k[:, :, 0]
+        cache.value[i, rows, :, positions] = v[:, :, 0]
+
+    return _run_blocks(transformer, hidden_states, cache, write_kv, cache.max_length, mask)
+
+
+def prefix_key(latent: torch.Tensor) -> str:
+    """Content hash of a conditioning prefix (positions, dim), i.e. of speaker latents + emotion + speed tokens."""
+    data = latent.detach().to("cpu", torch.float32).contiguous().numpy()
+    return f"{hashlib.sha1(data.tobytes()).hexdigest()}:{tuple(latent.shape)}"
+
+
+class PrefixKVCache:
+    """
+    LRU cache of the GPT keys/values of conditioning prefixes.
+
+    Every segment of a speaker starts with the same conditioning latents (speaker perceiver latents + emotion
+    vector + speed tokens). GPT-2 blocks here have no position embeddings and the prefix only attends to
+    itself, so its keys and values do not depend on where it is placed or on what follows; they are computed
+    once per prefix and copied into the KV cache of every later segment.
+    """
+
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, Tuple[torch.Tensor, torch.Tensor]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, latent: torch.Tensor,
+            compute: Callable[[torch.Tensor], Tuple[torch.Tensor, torch.Tensor]]) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Keys and values (layers, heads, positions, head_dim) of ``latent``, computed with ``compute`` on a miss."""
+        key = (prefix_key(latent), latent.dtype, latent.device)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        entry = compute(latent)
+        with self._lock:
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
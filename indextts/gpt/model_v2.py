@@ -14,7 +14,11 @@ from transformers.utils.model_parallel_utils import (assert_device_map,
                                                      get_device_map)
 
 from indextts.gpt.conformer_encoder import ConformerEncoder
+from indextts.gpt.kv_cache import PrefixKVCache, StaticKVCache, static_gpt2_forward
 from indextts.gpt.perceiver import PerceiverResampler
+from indextts.gpt.sampling import MelSamplingDecoder
+from indextts.gpt.beam_search import MelBeamSearch
+from indextts.gpt.speculative import SpeculativeDecoder
 from indextts.utils.arch_util import AttentionBlock
 from indextts.utils.typical_sampling import TypicalLogitsWarper
 
@@ -43,7 +47,10 @@ class ResBlock(nn.Module):
 
 
 class GPT2InferenceModel(GPT2PreTrainedModel):
-    def __init__(self, config, gpt, text_pos_emb, embeddings, norm, linear, kv_cache=False):
+    # static KV cache capacities are rounded up to this, so segments of similar length reuse the buffers
+    STATIC_CACHE_GRANULARITY = 256
+
+    def __init__(self, config, gpt, text_pos_emb, embeddings, norm, linear, kv_cache=False, static_kv_cache=False):
         super().__init__(config)
         # Note: the argument named `text_pos_emb` here actually represents the mel position embedding
         self.transformer = gpt
@@ -52,6 +59,14 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
         self.final_norm = norm
         self.lm_head = nn.Sequential(norm, linear)
         self.kv_cache = kv_cache
+        # decode with a preallocated, in-place KV cache instead of growing the past every step
+        self.static_kv_cache = static_kv_cache
+        self.static_cache = None
+        # prompt length + max_generate_length of the next generate() call, set by UnifiedVoice.inference_speech
+        self.static_cache_length = None
+        # keys/values of conditioning prefixes shared by the segments of a speaker (static KV cache only)
+        self.prefix_cache = None
+        self.cached_prefix = None
 
         # Model parallel
         self.model_parallel = False
@@ -87,6 +102,57 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
     def store_mel_emb(self, mel_emb):
         self.cached_mel_emb = mel_emb
 
+    def store_prefix(self, conds_latent):
+        """Conditioning latents (b, P, dim) at the start of the stored mel embedding, for prefix KV reuse."""
+        self.cached_prefix = conds_latent
+
+    def _prefix_kv(self, latent):
+        prefix = StaticKVCache(self.config.n_layer, 1, self.config.n_head, latent.shape[0],
+                               self.config.n_embd // self.config.n_head, dtype=latent.dtype, device=latent.device)
+        static_gpt2_forward(self.transformer, latent.unsqueeze(0), prefix)
+        return prefix.key[:, 0], prefix.value[:, 0]
+
+    def _prefill_prefix(self, cache, emb, attention_mask):
+        """
+        Copy the cached KV of the conditioning prefix into slots [0, P) of every row and return the rest of the
+        prompt, [pad][text][start_mel], with its attention mask.
+
+        The prompt is laid out as [pad][cond][text] and the cache as [cond][pad][text]: padding is masked and
+        the blocks carry no positions, so moving the prefix in front of the padding changes nothing.
+        """
+        prefix = self.cached_prefix
+        batch, total = emb.shape[:2]
+        prefix_len = prefix.shape[1]
+        rows = torch.arange(batch, device=emb.device).view(prefix.shape[0], -1)
+        for i in range(prefix.shape[0]):
+            key, value = self.prefix_cache.get(prefix[i], self._prefix_kv)
+            cache.key[:, rows[i], :, :prefix_len] = key.unsqueeze(1)
+            cache.value[:, rows[i], :, :prefix_len] = value.unsqueeze(1)
+        cache.valid[:, :prefix_len] = True
+        cache.length = prefix_len
+
+        pad = (attention_mask == 0).sum(1, keepdim=True)
+        pos = torch.arange(total - prefix_len, device=emb.device).unsqueeze(0)
+        src = torch.where(pos >= pad, pos + prefix_len, pos)
+        rest = emb.gather(1, src.unsqueeze(-1).expand(-1, -1, emb.shape[-1]))
+        mask = torch.cat([attention_mask.new_ones(batch, prefix_len), attention_mask[:, :total - prefix_len]], 1)
+        return rest, mask
+
+    def _new_static_cache(self, batch_size, dtype, device):
+        """Reset the static cache for a new generation, reallocating only when the batch or capacity changes."""
+        granularity = self.STATIC_CACHE_GRANULARITY
+        max_length = self.static_cache_length or self.config.n_positions
+        max_length = -(-max_length // granularity) * granularity
+        cache = self.static_cache
+        if cache is not None and cache.matches(batch_size, max_length, dtype, device):
+            cache.reset()
+            return cache
+        self.static_cache = None  # free the old buffers before allocating the new ones
+        head_dim = self.config.n_embd // self.config.n_head
+        self.static_cache = StaticKVCache(self.config.n_layer, batch_size, self.config.n_head, max_length,
+                                          head_dim, dtype=dtype, device=device)
+        return self.static_cache
+
     def prepare_inputs_for_generation(self, input_ids, past_key_values=None, **kwargs):
         token_type_ids = kwargs.get("token_type_ids", None)  # usually None
         if not self.kv_cache:
@@ -158,6 +224,18 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
             emb = emb + self.text_pos_embedding.get_fixed_embedding(
                 attention_mask.shape[1] - mel_len, attention_mask.device
             )
+        if self.kv_cache and self.static_kv_cache and not self.model_parallel:
+            if not isinstance(past_key_values, StaticKVCache) or (input_ids.shape[1] != 1 and len(past_key_values)):
+                past_key_values = self._new_static_cache(emb.shape[0], emb.dtype, emb.device)
+            if not len(past_key_values):
+                # prefill, into a new cache or an empty one handed in by the caller (e.g. the beam rows of MelBeamSearch)
+                if self.prefix_cache is not None and self.cached_prefix is not None and attention_mask is not None:
+                    emb, attention_mask = self._prefill_prefix(past_key_values, emb, attention_mask)
+            hidden_states = static_gpt2_forward(self.transformer, emb, past_key_values, attention_mask)
+            lm_logits = self.lm_head(hidden_states)
+            if not return_dict:
+                return lm_logits, past_key_values
+            return CausalLMOutputWithCrossAttentions(loss=None, logits=lm_logits, past_key_values=past_key_values)
         transformer_outputs = self.transformer(
             inputs_embeds=emb,
             past_key_values=past_key_values,
@@ -203,6 +281,8 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
         :meth:`~transformers.PreTrainedModel.beam_search` or :meth:`~transformers.PreTrainedModel.beam_sample` is
         called. This is required to match :obj:`past_key_values` with the correct beam_idx at every generation step.
         """
+        if isinstance(past, StaticKVCache):
+            return past.reorder_cache(beam_idx)
         return tuple(
             tuple(
                 past_state.index_select(0, beam_idx.to(past_state.device))
@@ -408,8 +488,13 @@ class UnifiedVoice(nn.Module):
             embeddings.append(self.mel_embedding)
         for module in embeddings:
             module.weight.data.normal_(mean=0.0, std=.02)
+        self.speculative_decoder = None
+        self.beam_search = None
+        self.sampling_decoder = None
+        # (input rows, prompt length) of the last inference_speech whose prompt KV is left in the static cache
+        self.last_generation = None
 
-    def post_init_gpt2_config(self, use_deepspeed=False, kv_cache=False, half=False):
+    def post_init_gpt2_config(self, use_deepspeed=False, kv_cache=False, half=False, static_kv_cache=False):
         seq_length = self.max_mel_tokens + self.max_text_tokens + 2
         gpt_config = GPT2Config(
             vocab_size=self.number_mel_codes,
@@ -429,6 +514,7 @@ class UnifiedVoice(nn.Module):
             self.final_norm,
             self.mel_head,
             kv_cache=kv_cache,
+            static_kv_cache=static_kv_cache and not use_deepspeed,
         )
         if use_deepspeed and half and torch.cuda.is_available():
             import deepspeed
@@ -450,6 +536,70 @@ class UnifiedVoice(nn.Module):
         # self.inference_model = PrunedGPT2InferenceModel(gpt_config, self.gpt, self.mel_pos_embedding, self.mel_embedding, self.final_norm, self.mel_head)
         self.gpt.wte = self.mel_embedding
 
+    def enable_static_kv_cache(self, enabled=True):
+        """Switch GPT decoding to the preallocated static KV cache; returns whether it is now in use."""
+        if enabled and getattr(self, "ds_engine", None) is not None:
+            print(">> Static KV cache is not supported with DeepSpeed kernel injection, keeping the dynamic cache")
+            return False
+        self.inference_model.static_kv_cache = enabled
+        if not enabled:
+            self.inference_model.static_cache = None
+            self.inference_model.prefix_cache = None
+            self.speculative_decoder = None
+            self.beam_search = None
+            self.sampling_decoder = None
+        return enabled
+
+    def enable_prefix_kv_cache(self, max_entries=32):
+        """
+        Reuse the GPT keys/values of the conditioning prefix (speaker latents + emotion + speed) across segments,
+        so only the text and mel part of each segment is prefilled. Needs, and turns on, the static KV cache.
+        """
+        if max_entries <= 0 or not self.enable_static_kv_cache():
+            self.inference_model.prefix_cache = None
+            return False
+        self.inference_model.prefix_cache = PrefixKVCache(max_entries)
+        return True
+
+    def enable_speculative_decoding(self, draft_layers=None, speculate_k=4):
+        """
+        Generate single-row, single-beam segments with self-speculative decoding: the first ``draft_layers``
+        blocks (default: a quarter of them) propose ``speculate_k`` codes that the full GPT verifies in one pass.
+        Needs, and turns on, the static KV cache. ``draft_layers=0`` switches it off.
+        """
+        if draft_layers is None:
+            draft_layers = max(1, self.layers // 4)
+        if draft_layers <= 0 or speculate_k <= 0 or not self.enable_static_kv_cache():
+            self.speculative_decoder = None
+            return False
+        self.speculative_decoder = SpeculativeDecoder(self, draft_layers, speculate_k)
+        return True
+
+    def enable_lean_beam_search(self, enabled=True):
+        """
+        Run ``num_beams > 1`` generation with ``MelBeamSearch`` instead of ``generate()``: beams are reordered in
+        place in the static KV cache and the repetition penalty is fused into the scoring. Needs, and turns on,
+        the static KV cache.
+        """
+        if not enabled or not self.enable_static_kv_cache():
+            self.beam_search = None
+            return False
+        self.beam_search = MelBeamSearch(self)
+        return True
+
+    def enable_fused_sampling(self, enabled=True, sync_interval=8):
+        """
+        Run ``num_beams=1`` generation with ``MelSamplingDecoder`` instead of ``generate()``: repetition penalty,
+        temperature, top-k and top-p are fused into one ``MelTokenSampler`` step with a per-row presence bitmap,
+        and the host checks for finished rows every ``sync_interval`` steps. Needs, and turns on, the static
+        KV cache.
+        """
+        if not enabled or not self.enable_static_kv_cache():
+            self.sampling_decoder = None
+            return False
+        self.sampling_decoder = MelSamplingDecoder(self, sync_interval)
+        return True
+
     def build_aligned_inputs_and_targets(self, input, start_token, stop_token):
         inp = F.pad(input, (1, 0), value=start_token)
         tar = F.pad(input, (0, 1), value=stop_token)
@@ -616,38 +766,35 @@ class UnifiedVoice(nn.Module):
         single_cond = conditional_latents.ndim == 3 and conditional_latents.shape[0] == 1
         if not single_cond:
             assert conditional_latents.shape[0] == b, f"batch size mismatch: {conditional_latents.shape[0]} vs {b}"
-        batched_mel_emb = []
-        attention_masks = []
-        target_len = conditional_latents.shape[1] + L + 2
-        for i in range(b):
-            valid_mask = (text_inputs[i] != self.stop_text_token) & (text_inputs[i] != self.start_text_token)
-            text_input = text_inputs[i][valid_mask]
-            text_input = F.pad(text_input, (1, 0), value=self.start_text_token)
-            text_input = F.pad(text_input, (0, 1), value=self.stop_text_token)
-            text_input_pos = torch.arange(0, text_input.size(-1), device=device)
-            text_emb = self.text_embedding(text_input) + self.text_pos_embedding.emb(text_input_pos)
-            # concatenate [conditional latents][text embeddings]
-            conds_text_emb = [
-                conditional_latents.squeeze(0) if single_cond else conditional_latents[i],
-                text_emb,
-            ]
-            # +1 for the start_mel_token
-            attention_mask = torch.ones(target_len+1, dtype=torch.long, device=device)
-            # check this text input is padded
-            padding: int = L + 2 - text_input.size(-1)
-            # pad left of [cond][text] -> [pad][cond][text]
-            if padding > 0:
-                pad = torch.zeros((padding, conditional_latents.size(-1)), dtype=text_emb.dtype, device=device) # [p, dim]
-                conds_text_emb.insert(0, pad)
-                attention_mask[:padding] = 0
-            mel_emb = torch.cat(conds_text_emb) #[s, dim]
-            assert mel_emb.shape[0] == target_len, f"mel_emb.shape: {mel_emb.shape}, target_len: {target_len}"
-            batched_mel_emb.append(mel_emb)
-            attention_masks.append(attention_mask)
-        # [b, s, dim]
-        batched_mel_emb = torch.stack(batched_mel_emb, dim=0)
-        # [b, s+1]
-        attention_mask = torch.stack(attention_masks, dim=0)
+        cond_len = conditional_latents.shape[1]
+        target_len = cond_len + L + 2
+        valid_mask = (text_inputs != self.stop_text_token) & (text_inputs != self.start_text_token)
+        n_valid = valid_mask.sum(dim=1, keepdim=True)  # [b, 1]
+        padding = L - n_valid  # [b, 1]
+        # valid tokens moved to the front of each row, in order (a stable sort of the invalid flags)
+        order = torch.sort((~valid_mask).to(torch.uint8), dim=1, stable=True).indices
+        compacted = text_inputs.gather(1, order)
+        compacted = torch.where(torch.arange(L, device=device).unsqueeze(0) < n_valid, compacted, self.stop_text_token)
+        text_input = torch.cat([
+            torch.full((b, 1), self.start_text_token, dtype=text_inputs.dtype, device=device),
+            compacted,
+            torch.full((b, 1), self.stop_text_token, dtype=text_inputs.dtype, device=device),
+        ], dim=1)
+        k = torch.arange(L + 2, device=device).unsqueeze(0)
+        text_emb = self.text_embedding(text_input)
+        text_emb += self.text_pos_embedding.emb(k)  # [b, L+2, dim], left aligned
+        text_emb.masked_fill_((k > n_valid + 1).unsqueeze(-1), 0)  # zero filler behind the stop token
+
+        # [pad][cond][text] is [cond][text][filler] rotated right by the padding: write both parts to their
+        # rotated positions, the zero filler lands exactly on the padding
+        dtype = torch.promote_types(conditional_latents.dtype, text_emb.dtype)
+        batched_mel_emb = torch.empty((b, target_len, text_emb.size(-1)), dtype=dtype, device=device)
+        rows = torch.arange(b, device=device).unsqueeze(1)
+        batched_mel_emb[rows, (cond_len + padding + k) % target_len] = text_emb.to(dtype)
+        conds = conditional_latents.expand(b, -1, -1) if single_cond else conditional_latents
+        batched_mel_emb[rows, padding + torch.arange(cond_len, device=device)] = conds.to(dtype)
+        # [b, s+1], +1 for the start_mel_token
+        attention_mask = (torch.arange(target_len + 1, device=device).unsqueeze(0) >= padding).long()
         # [b, s+1]
         fake_inputs = torch.ones(
             (
@@ -660,6 +807,13 @@ class UnifiedVoice(nn.Module):
         fake_inputs[:, -1] = self.start_mel_token
         return fake_inputs, batched_mel_emb, attention_mask
 
+    def build_conds_latent(self, speech_conditioning_latent, emo_vec, batch_size):
+        """GPT conditioning prefix (b, 34, dim): speaker latents + emotion vector, then the two speed tokens."""
+        tmp = torch.zeros(batch_size).to(speech_conditioning_latent.device)
+        duration_emb =  self.speed_emb(torch.zeros_like(tmp).long())
+        duration_emb_half = self.speed_emb(torch.ones_like(tmp).long())
+        return torch.cat((speech_conditioning_latent + emo_vec.unsqueeze(1), duration_emb_half.unsqueeze(1), duration_emb.unsqueeze(1)), 1)
+
     def inference_speech(self, speech_condition, text_inputs, emo_speech_condition=None, cond_lengths=None, emo_cond_lengths=None, emo_vec=None, use_speed=False, input_tokens=None, num_return_sequences=1,
                          max_generate_length=None, typical_sampling=False, typical_mass=.9, **hf_generate_kwargs):
         """
@@ -690,12 +844,10 @@ class UnifiedVoice(nn.Module):
         else:
             print('Use the specified emotion vector')
 
-        tmp = torch.zeros(text_inputs.size(0)).to(text_inputs.device)
-        duration_emb =  self.speed_emb(torch.zeros_like(tmp).long())
-        duration_emb_half = self.speed_emb(torch.ones_like(tmp).long())
-        conds_latent = torch.cat((speech_conditioning_latent + emo_vec.unsqueeze(1), duration_emb_half.unsqueeze(1), duration_emb.unsqueeze(1)), 1)
+        conds_latent = self.build_conds_latent(speech_conditioning_latent, emo_vec, text_inputs.size(0))
         input_ids, inputs_embeds, attention_mask = self.prepare_gpt_inputs(conds_latent, text_inputs)
         self.inference_model.store_mel_emb(inputs_embeds)
+        self.inference_model.store_prefix(conds_latent)
         if input_tokens is None:
             inputs = input_ids
         else:
@@ -721,6 +873,25 @@ class UnifiedVoice(nn.Module):
             min_tokens_to_keep = 2 if hf_generate_kwargs.get("num_beams", 1) > 1 else 1
             logits_processor.append(TypicalLogitsWarper(mass=typical_mass, min_tokens_to_keep=min_tokens_to_keep))
         max_length = (trunc_index + self.max_mel_tokens - 1) if max_generate_length is None else trunc_index + max_generate_length
+        self.inference_model.static_cache_length = max_length
+        static = self.inference_model.kv_cache and self.inference_model.static_kv_cache
+        self.last_generation = (inputs.shape[0], trunc_index) if static and input_tokens is None else None
+        speculative = self.speculative_decoder
+        if speculative is not None and input_tokens is None and speculative.supports(inputs.shape[0], hf_generate_kwargs):
+            output = speculative.generate(inputs, attention_mask, max_length, logits_processor=logits_processor,
+                                          **hf_generate_kwargs)
+            return output[:, trunc_index:], speech_conditioning_latent
+        beam_search = self.beam_search
+        generate_kwargs = dict(hf_generate_kwargs, num_return_sequences=num_return_sequences)
+        if beam_search is not None and input_tokens is None and beam_search.supports(generate_kwargs):
+            output = beam_search.generate(inputs, attention_mask, max_length, logits_processor=logits_processor,
+                                          **generate_kwargs)
+            return output[:, trunc_index:], speech_conditioning_latent
+        sampling_decoder = self.sampling_decoder
+        if (sampling_decoder is not None and input_tokens is None
+                and sampling_decoder.supports(inputs, max_length, generate_kwargs, logits_processor)):
+            output = sampling_decoder.generate(inputs, attention_mask, max_length, **generate_kwargs)
+            return output[:, trunc_index:], speech_conditioning_latent
         output = self.inference_model.generate(inputs, 
                                             bos_token_id=self.start_mel_token, pad_token_id=self.stop_mel_token,
                                             eos_token_id=self.stop_mel_token, attention_mask=attention_mask,
@@ -733,6 +904,44 @@ class UnifiedVoice(nn.Module):
         output.sequences = output.sequences[:, trunc_index:]
         return output, speech_conditioning_latent
 
+    @torch.no_grad()
+    def latents_from_generation(self, codes):
+        """
+        GPT latents of ``codes`` for the s2mel stage, the same as ``forward()`` returns for the segment, but
+        computed from the conditioning + text keys/values that the last ``inference_speech`` left in the
+        static KV cache: only the mel codes go through the GPT, not the whole prompt again.
+
+        The hidden states of the decoding steps themselves cannot be reused: generation feeds the k-th code
+        at mel position k + 1 while ``forward()`` (and the s2mel training) uses position k.
+
+        Args:
+            codes: (rows, T) codes of the rows returned by that call, cut at the stop token and/or compacted
+                by ``remove_long_silence``; positions past a row's length only produce ignored latents
+        Returns:
+            (rows, T, dim) latents, or None if the prompt keys/values are not available (dynamic KV cache,
+            ``input_tokens``); call ``forward()`` then.
+        """
+        cache = self.inference_model.static_cache
+        if self.last_generation is None or cache is None:
+            return None
+        batch, prompt_len = self.last_generation
+        rows = codes.shape[0]
+        if rows % batch or cache.batch_size % batch or cache.length < prompt_len:
+            return None
+        # the rows of one prompt are consecutive, in the output (num_return_sequences) and in the cache (beams)
+        src = torch.arange(rows, device=codes.device) // (rows // batch) * (cache.batch_size // batch)
+        # the start_mel token closes the prompt; it is fed again as the first mel input below
+        n = prompt_len - 1
+        kv = StaticKVCache(self.layers, rows, self.heads, n + codes.shape[1], self.model_dim // self.heads,
+                           dtype=cache.key.dtype, device=codes.device)
+        kv.key[:, :, :, :n] = cache.key[:, :, :, :n].index_select(1, src)
+        kv.value[:, :, :, :n] = cache.value[:, :, :, :n].index_select(1, src)
+        kv.valid[:, :n] = cache.valid[:, :n].index_select(0, src)
+        kv.length = n
+        mel_inputs = F.pad(codes, (1, 0), value=self.start_mel_token)[:, :codes.shape[1]]
+        emb = self.mel_embedding(mel_inputs) + self.mel_pos_embedding(mel_inputs)
+        return self.final_norm(static_gpt2_forward(self.gpt, emb, kv))
+
     def get_emovec(self, emo_speech_conditioning_latent, emo_cond_lengths):
         emo_vec_syn_ori = self.get_emo_conditioning(emo_speech_conditioning_latent.transpose(1,2), emo_cond_lengths)
         emo_vec_syn = self.emovec_layer(emo_vec_syn_ori)
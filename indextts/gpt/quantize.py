@@ -0,0 +1,285 @@
+"""
+Weight-only int8 / int4 quantization of the UnifiedVoice GPT blocks.
+
+Only the four projections of every GPT-2 block are quantized (``attn.c_attn``, ``attn.c_proj``, ``mlp.c_fc``,
+``mlp.c_proj``); they hold almost all of the decoder weights, and decoding one code at a time is bound by
+reading them. Activations stay in floating point. The schemes follow ``s2mel/modules/gpt_fast/quantize.py``:
+
+- ``int8``: symmetric per-output-channel scales;
+- ``int4``: asymmetric groups of ``groupsize`` input features with bf16 scales and zeros.
+
+On CPU both run through the packed ATen kernels (``_weight_int8pack_mm``, ``_weight_int4pack_mm_for_cpu``),
+so the weights are never expanded back to floats. These kernels are only fast with bf16 activations (fp32 and
+fp16 inputs take a slow generic path), so the projections compute in bf16 on CPU and cast the result back.
+
+Usage::
+
+    python -m indextts.gpt.quantize --model_dir checkpoints --mode int8
+    python webui.py --gpt_quant int8
+"""
+import os
+import time
+from typing import Dict, Optional
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from transformers.pytorch_utils import Conv1D
+
+QUANT_FORMAT_VERSION = 1
+QUANT_MODES = ("int8", "int4")
+BLOCK_PROJECTIONS = ("attn.c_attn", "attn.c_proj", "mlp.c_fc", "mlp.c_proj")
+
+
+def _linear_weight(module) -> torch.Tensor:
+    """(out_features, in_features) weight of a ``Conv1D`` or ``nn.Linear``."""
+    if isinstance(module, Conv1D):
+        return module.weight.t()
+    return module.weight
+
+
+def quantize_per_channel_int8(weight: torch.Tensor):
+    """Symmetric int8 quantization of ``weight`` (out, in) with one scale per output channel."""
+    weight = weight.float().contiguous()
+    max_abs = weight.abs().amax(dim=1).clamp(min=torch.finfo(torch.float32).eps)
+    scales = max_abs / 127.5
+    int8_weight = torch.clamp(torch.round(weight / scales.unsqueeze(1)), -128, 127).to(torch.int8)
+    return int8_weight, scales
+
+
+def quantize_groupwise_int4(weight: torch.Tensor, groupsize: int = 128):
+    """
+    Asymmetric 4-bit quantization of ``weight`` (out, in) in groups of ``groupsize`` input features.
+    Returns the codes (out, in) as uint8 in [0, 15] and ``scales_and_zeros`` (in / groupsize, out, 2) in bf16,
+    the layout of the ATen int4 kernels: ``w = (q - 8) * scale + zero``.
+    """
+    weight = weight.float().contiguous()
+    out_features, in_features = weight.shape
+    groups = weight.reshape(out_features, in_features // groupsize, groupsize)
+    max_val = groups.amax(dim=2, keepdim=True)
+    min_val = groups.amin(dim=2, keepdim=True)
+    scales = ((max_val - min_val).clamp(min=1e-6) / 15).to(torch.bfloat16).float()
+    zeros = (min_val + scales * 8).to(torch.bfloat16).float()
+    q = torch.clamp(torch.round((groups - min_val) / scales), 0, 15).to(torch.uint8).reshape(out_features, in_features)
+    scales_and_zeros = torch.stack([scales.squeeze(-1), zeros.squeeze(-1)], dim=-1)  # (out, groups, 2)
+    return q, scales_and_zeros.transpose(0, 1).contiguous().to(torch.bfloat16)
+
+
+class WeightOnlyInt8Linear(nn.Module):
+    """Linear layer with int8 weights and per-channel scales, replacing a ``Conv1D``/``nn.Linear``."""
+
+    def __init__(self, in_features, out_features, bias=True, device=None):
+        super().__init__()
+        self.in_features = in_features
+        self.out_features = out_features
+        self.register_buffer("weight", torch.empty((out_features, in_features), dtype=torch.int8, device=device))
+        self.register_buffer("scales", torch.ones(out_features, device=device))
+        self.register_buffer("bias", torch.zeros(out_features, device=device) if bias else None)
+
+    @classmethod
+    def from_float(cls, module) -> "WeightOnlyInt8Linear":
+        weight = _linear_weight(module)
+        layer = cls(weight.shape[1], weight.shape[0], module.bias is not None, device=weight.device)
+        layer.weight, scales = quantize_per_channel_int8(weight)
+        layer.scales = scales.to(weight.dtype)
+        if module.bias is not None:
+            layer.bias = module.bias.detach().clone()
+        return layer
+
+    def forward(self, x):
+        shape = x.shape[:-1] + (self.out_features,)
+        x = x.reshape(-1, self.in_features)
+        if x.device.type == "cpu":
+            out = torch.ops.aten._weight_int8pack_mm(x.to(torch.bfloat16), self.weight,
+                                                     self.scales.to(torch.bfloat16)).to(x.dtype)
+        else:
+            out = F.linear(x, self.weight.to(x.dtype)) * self.scales.to(x.dtype)
+        if self.bias is not None:
+            out = out + self.bias.to(x.dtype)
+        return out.reshape(shape)
+
+    def extra_repr(self):
+        return f"in_features={self.in_features}, out_features={self.out_features}, bias={self.bias is not None}"
+
+
+class WeightOnlyInt4Linear(nn.Module):
+    """
+    Linear layer with group-wise int4 weights. The state dict keeps the codes two per byte (``weight``). The first
+    forward packs them for the kernel of the current device (``packed``, not saved) and releases ``weight`` so
+    the codes are held once; save the layer before running it.
+    """
+
+    def __init__(self, in_features, out_features, bias=True, groupsize=128, inner_k_tiles=8, device=None):
+        super().__init__()
+        if in_features % groupsize or in_features % (inner_k_tiles * 16) or out_features % 8:
+            raise ValueError(f"int4 needs in_features divisible by {groupsize} and {inner_k_tiles * 16} "
+                             f"and out_features by 8, got {in_features}x{out_features}")
+        self.in_features = in_features
+        self.out_features = out_features
+        self.groupsize = groupsize
+        self.inner_k_tiles = inner_k_tiles
+        self.register_buffer("weight", torch.empty((out_features, in_features // 2), dtype=torch.uint8, device=device))
+        self.register_buffer("scales_and_zeros",
+                             torch.empty((in_features // groupsize, out_features, 2), dtype=torch.bfloat16,
+                                         device=device))
+        self.register_buffer("bias", torch.zeros(out_features, device=device) if bias else None)
+        self.register_buffer("packed", None, persistent=False)
+
+    @classmethod
+    def from_float(cls, module, groupsize=128, inner_k_tiles=8) -> "WeightOnlyInt4Linear":
+        weight = _linear_weight(module)
+        layer = cls(weight.shape[1], weight.shape[0], module.bias is not None, groupsize, inner_k_tiles,
+                    device=weight.device)
+        q, layer.scales_and_zeros = quantize_groupwise_int4(weight, groupsize)
+        layer.weight = (q[:, ::2] << 4) | q[:, 1::2]
+        if module.bias is not None:
+            layer.bias = module.bias.detach().clone()
+        return layer
+
+    def _pack(self):
+        if self.weight.device.type == "cpu":
+            q = torch.stack([self.weight >> 4, self.weight & 0xF], dim=-1).reshape(self.out_features, -1)
+            return torch.ops.aten._convert_weight_to_int4pack_for_cpu(q.to(torch.int32), self.inner_k_tiles)
+        # the CUDA kernel takes the codes two per byte, as stored
+        return torch.ops.aten._convert_weight_to_int4pack(self.weight, self.inner_k_tiles)
+
+    def forward(self, x):
+        if self.packed is None:
+            self.packed = self._pack()
+            self.weight = self.weight.new_empty(0)
+        elif self.packed.device != x.device:
+            raise RuntimeError("int4 weights were packed for another device; load the quantized GPT again")
+        shape = x.shape[:-1] + (self.out_features,)
+        x = x.reshape(-1, self.in_features)
+        if x.device.type == "cpu":
+            out = torch.ops.aten._weight_int4pack_mm_for_cpu(x.to(torch.bfloat16), self.packed, self.groupsize,
+                                                              self.scales_and_zeros.to(torch.bfloat16)).to(x.dtype)
+        else:
+            out = torch.ops.aten._weight_int4pack_mm(x.to(torch.bfloat16), self.packed, self.groupsize,
+                                                     self.scales_and_zeros.to(torch.bfloat16)).to(x.dtype)
+        if self.bias is not None:
+            out = out + self.bias.to(x.dtype)
+        return out.reshape(shape)
+
+    def extra_repr(self):
+        return (f"in_features={self.in_features}, out_features={self.out_features}, "
+                f"groupsize={self.groupsize}, bias={self.bias is not None}")
+
+
+def _block_projections(gpt):
+    for block in gpt.gpt.h:
+        for path in BLOCK_PROJECTIONS:
+            parent_name, name = path.split(".")
+            yield getattr(block, parent_name), name
+
+
+def quantize_gpt(gpt, mode="int8", groupsize=128):
+    """Quantize the block projections of a ``UnifiedVoice`` in place; returns the number of replaced layers."""
+    if mode not in QUANT_MODES:
+        raise ValueError(f"Unknown GPT quantization mode {mode!r}, expected one of {QUANT_MODES}")
+    count = 0
+    with torch.no_grad():
+        for parent, name in _block_projections(gpt):
+            module = getattr(parent, name)
+            if mode == "int8":
+                setattr(parent, name, WeightOnlyInt8Linear.from_float(module))
+            else:
+                setattr(parent, name, WeightOnlyInt4Linear.from_float(module, groupsize))
+            count += 1
+    gpt.gpt_quantization = {"mode": mode, "groupsize": groupsize}
+    return count
+
+
+def _empty_quantized(gpt, mode, groupsize):
+    """Swap the block projections for empty quantized layers of the right shapes, ready for ``load_state_dict``."""
+    for parent, name in _block_projections(gpt):
+        module = getattr(parent, name)
+        weight = _linear_weight(module)
+        out_features, in_features = weight.shape
+        bias = module.bias is not None
+        if mode == "int8":
+            layer = WeightOnlyInt8Linear(in_features, out_features, bias, device=weight.device)
+        else:
+            layer = WeightOnlyInt4Linear(in_features, out_features, bias, groupsize, device=weight.device)
+        setattr(parent, name, layer)
+
+
+def save_quantized_gpt(gpt, path):
+    """Save the quantized GPT blocks (``gpt.gpt.h``) with their quantization settings."""
+    info = getattr(gpt, "gpt_quantization", None)
+    if info is None:
+        raise ValueError("GPT is not quantized, call quantize_gpt() first")
+    for module in gpt.gpt.modules():
+        if isinstance(module, WeightOnlyInt4Linear) and module.packed is not None:
+            raise ValueError("int4 GPT weights are already packed for inference, save right after quantize_gpt()")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    torch.save({"version": QUANT_FORMAT_VERSION, **info, "state_dict": gpt.gpt.h.state_dict()}, path)
+
+
+def load_quantized_gpt(gpt, path, map_location=None) -> Dict:
+    """Replace the blocks of a loaded ``UnifiedVoice`` with the quantized ones saved by ``save_quantized_gpt``."""
+    checkpoint = torch.load(path, map_location=map_location or "cpu")
+    if checkpoint.get("version") != QUANT_FORMAT_VERSION:
+        raise ValueError(f"Unsupported quantized GPT format {checkpoint.get('version')} in {path}")
+    _empty_quantized(gpt, checkpoint["mode"], checkpoint["groupsize"])
+    gpt.gpt.h.load_state_dict(checkpoint["state_dict"], strict=True)
+    gpt.gpt_quantization = {"mode": checkpoint["mode"], "groupsize": checkpoint["groupsize"]}
+    return gpt.gpt_quantization
+
+
+def quantized_gpt_path(model_dir, mode):
+    # a subdirectory: the snapshot source fingerprint covers the checkpoint files directly under model_dir
+    return os.path.join(model_dir, "quantized", f"gpt_{mode}.pth")
+
+
+def apply_gpt_quantization(gpt, mode, model_dir=None, groupsize=128) -> Optional[Dict]:
+    """
+    Quantize the GPT of a loaded engine: reuse ``<model_dir>/quantized/gpt_<mode>.pth`` when it exists, otherwise
+    quantize the loaded weights in memory.
+    """
+    if not mode:
+        return None
+    if getattr(gpt, "ds_engine", None) is not None:
+        print(">> GPT quantization is not supported with DeepSpeed kernel injection, keeping the original weights")
+        return None
+    start = time.perf_counter()
+    device = next(gpt.parameters()).device
+    path = quantized_gpt_path(model_dir, mode) if model_dir else None
+    if path and os.path.exists(path):
+        load_quantized_gpt(gpt, path, map_location=device)
+        print(f">> GPT {mode} weights loaded from: {path}")
+    else:
+        quantize_gpt(gpt, mode, groupsize)
+        print(f">> GPT quantized to {mode} in memory")
+    print(f">> GPT quantization took {time.perf_counter() - start:.2f}s")
+    return gpt.gpt_quantization
+
+
+def main():
+    import argparse
+
+    from omegaconf import OmegaConf
+
+    from indextts.gpt.model_v2 import UnifiedVoice
+    from indextts.utils.checkpoint import load_checkpoint
+
+    parser = argparse.ArgumentParser(description="Quantize the IndexTTS2 GPT to weight-only int8/int4 and save it")
+    parser.add_argument("--model_dir", type=str, default="checkpoints", help="Model checkpoints directory")
+    parser.add_argument("--mode", type=str, default="int8", choices=QUANT_MODES, help="Weight format")
+    parser.add_argument("--groupsize", type=int, default=128, help="Input features per int4 group")
+    parser.add_argument("--output", type=str, default=None, help="Output file (default: <model_dir>/quantized/gpt_<mode>.pth)")
+    args = parser.parse_args()
+
+    cfg = OmegaConf.load(os.path.join(args.model_dir, "config.yaml"))
+    gpt = UnifiedVoice(**cfg.gpt)
+    load_checkpoint(gpt, os.path.join(args.model_dir, cfg.gpt_checkpoint))
+    gpt.eval()
+    count = quantize_gpt(gpt, args.mode, args.groupsize)
+    output = args.output or quantized_gpt_path(args.model_dir, args.mode)
+    save_quantized_gpt(gpt, output)
+    print(f">> {count} GPT block projections quantized to {args.mode}, saved to: {output} "
+          f"({os.path.getsize(output) / 1024 ** 2:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
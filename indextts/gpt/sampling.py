@@ -0,0 +1,199 @@
+import time
+from typing import Dict, Optional
+
+import torch
+from transformers import (LogitsProcessorList, RepetitionPenaltyLogitsProcessor, TemperatureLogitsWarper,
+                          TopKLogitsWarper, TopPLogitsWarper)
+
+from indextts.gpt.kv_cache import static_gpt2_forward
+
+
+class MelTokenSampler:
+    """
+    Repetition penalty, temperature, top-k and top-p of ``generate()`` fused into one per-step operation.
+
+    * The repetition penalty reads a per-row presence bitmap ``seen`` (rows, vocab) that the caller updates
+      with every sampled code, instead of gathering and scattering the scores of the whole history.
+    * Top-k runs before the softmax: top-p and the draw only see the ``top_k`` best scores, already sorted,
+      instead of sorting and normalizing the full 8194-entry mel vocabulary.
+    * Nothing is read back to the host: the sampled codes stay on the device.
+
+    The distribution is the one of the HF processors (``RepetitionPenaltyLogitsProcessor`` followed by the
+    temperature, top-k and top-p warpers); only the random draws differ.
+    """
+
+    def __init__(self, do_sample=True, top_k=None, top_p=None, temperature=None, repetition_penalty=None):
+        self.do_sample = do_sample
+        self.repetition_penalty = repetition_penalty if repetition_penalty is not None else 1.0
+        self.temperature = temperature if temperature is not None else 1.0
+        self.top_k = top_k or 0
+        self.top_p = top_p if top_p is not None else 1.0
+
+    @classmethod
+    def from_processors(cls, processors: LogitsProcessorList, do_sample: bool) -> "MelTokenSampler":
+        """The sampler equivalent to the processors ``generate()`` built; raises on any it cannot fuse."""
+        kwargs = {}
+        for processor in processors:
+            if isinstance(processor, RepetitionPenaltyLogitsProcessor):
+                kwargs["repetition_penalty"] = processor.penalty
+            elif isinstance(processor, TemperatureLogitsWarper):
+                kwargs["temperature"] = processor.temperature
+            elif isinstance(processor, TopKLogitsWarper):
+                kwargs["top_k"] = processor.top_k
+            elif isinstance(processor, TopPLogitsWarper):
+                kwargs["top_p"] = processor.top_p
+            else:
+                raise ValueError(f"{type(processor).__name__} cannot be fused into MelTokenSampler")
+        return cls(do_sample=do_sample, **kwargs)
+
+    def penalize(self, logits: torch.Tensor, seen: Optional[torch.Tensor]) -> torch.Tensor:
+        """Float scores with the repetition penalty applied to the codes marked in ``seen``."""
+        scores = logits.float()
+        if self.repetition_penalty != 1.0 and seen is not None:
+            penalized = torch.where(scores < 0, scores * self.repetition_penalty, scores / self.repetition_penalty)
+            scores = torch.where(seen, penalized, scores)
+        return scores
+
+    def candidates(self, logits: torch.Tensor, seen: Optional[torch.Tensor]):
+        """
+        The codes that can be drawn: ``(scores, indices)`` of shape (rows, k), best first, with the codes
+        removed by top-p set to ``-inf``.
+        """
+        scores = self.penalize(logits, seen)
+        if self.temperature != 1.0:
+            scores = scores / self.temperature
+        k = scores.shape[-1] if self.top_k <= 0 else min(self.top_k, scores.shape[-1])
+        scores, indices = scores.topk(k, dim=-1)
+        if self.top_p < 1.0:
+            probs = scores.softmax(dim=-1)
+            # TopPLogitsWarper drops a code when the codes ranked above it already hold top_p of the mass
+            drop = probs.cumsum(dim=-1) - probs >= self.top_p
+            drop[:, 0] = False
+            scores = scores.masked_fill(drop, float("-inf"))
+        return scores, indices
+
+    def probs(self, logits: torch.Tensor, seen: Optional[torch.Tensor] = None) -> torch.Tensor:
+        """The full (rows, vocab) sampling distribution, e.g. to compare with the HF processors."""
+        scores, indices = self.candidates(logits, seen)
+        return torch.zeros_like(logits, dtype=torch.float).scatter_(1, indices, scores.softmax(dim=-1))
+
+    def __call__(self, logits: torch.Tensor, seen: Optional[torch.Tensor] = None) -> torch.Tensor:
+        """Next code of every row (rows,), sampled or greedy, without a host sync."""
+        if not self.do_sample:
+            return self.penalize(logits, seen).argmax(dim=-1)
+        scores, indices = self.candidates(logits, seen)
+        choice = torch.multinomial(scores.softmax(dim=-1), num_samples=1)
+        return indices.gather(1, choice).squeeze(1)
+
+
+class MelSamplingDecoder:
+    """
+    Sampling / greedy generation of mel codes for a ``UnifiedVoice`` (``num_beams=1``), replacing
+    ``generate()`` and its ``LogitsProcessorList`` with a ``MelTokenSampler`` over the static KV cache.
+
+    The codes go into a preallocated ``(rows, max_length)`` buffer and the presence bitmap of the repetition
+    penalty is updated in place. Whether every row has stopped is only read back every ``sync_interval``
+    steps; the extra steps of finished rows produce ``stop_mel_token`` and are cut off, so the output is laid
+    out exactly like ``generate()``'s. ``supports`` tells ``inference_speech`` when to fall back to ``generate()``.
+    """
+
+    SUPPORTED_KWARGS = {"do_sample", "top_k", "top_p", "temperature", "repetition_penalty", "length_penalty",
+                        "num_beams", "num_return_sequences"}
+
+    def __init__(self, gpt, sync_interval=8):
+        self.gpt = gpt
+        self.sync_interval = max(1, sync_interval)
+        self.last_stats: Optional[Dict] = None
+
+    def supports(self, inputs, max_length, generate_kwargs, logits_processor=None) -> bool:
+        if (generate_kwargs.get("num_beams", 1) != 1 or logits_processor
+                or not set(generate_kwargs) <= self.SUPPORTED_KWARGS):
+            return False
+        # the model's generation config can add processors of its own (e.g. ``no_repeat_ngram_size``)
+        try:
+            self._sampler(inputs, max_length, generate_kwargs)
+        except ValueError:
+            return False
+        return True
+
+    def _sampler(self, inputs, max_length, generate_kwargs):
+        """The generation config ``generate()`` would use and the ``MelTokenSampler`` of its processors."""
+        model = self.gpt.inference_model
+        eos = self.gpt.stop_mel_token
+        generation_config, model_kwargs = model._prepare_generation_config(
+            None, bos_token_id=self.gpt.start_mel_token, pad_token_id=eos, eos_token_id=eos, max_length=max_length,
+            **generate_kwargs)
+        model._prepare_special_tokens(generation_config, True, device=inputs.device)
+        processors = model._get_logits_processor(
+            generation_config=generation_config, input_ids_seq_length=inputs.shape[1], encoder_input_ids=inputs,
+            prefix_allowed_tokens_fn=None, logits_processor=LogitsProcessorList(), device=inputs.device,
+            model_kwargs=model_kwargs)
+        return generation_config, MelTokenSampler.from_processors(processors, generation_config.do_sample)
+
+    @torch.no_grad()
+    def generate(self, inputs, attention_mask, max_length, **generate_kwargs):
+        """
+        Same contract as ``GPT2InferenceModel.generate(inputs, num_beams=1, ...)``: prompt ids followed by
+        the codes, rows that stopped early padded with ``stop_mel_token``.
+        """
+        gpt = self.gpt
+        model = gpt.inference_model
+        start_time = time.perf_counter()
+        device = inputs.device
+        eos = gpt.stop_mel_token
+        generation_config, sampler = self._sampler(inputs, max_length, generate_kwargs)
+        num_return = generation_config.num_return_sequences
+        if num_return > 1:
+            inputs = inputs.repeat_interleave(num_return, dim=0)
+            attention_mask = attention_mask.repeat_interleave(num_return, dim=0)
+        rows, prompt_len = inputs.shape
+        mel_len = model.cached_mel_emb.shape[1]
+
+        cache = model._new_static_cache(rows, model.transformer.wte.weight.dtype, device)
+        out = model(input_ids=inputs, attention_mask=attention_mask, past_key_values=cache, use_cache=True,
+                    return_dict=True)
+        logits = out.logits[:, -1]
+        vocab_size = logits.shape[-1]
+
+        tokens = inputs.new_full((rows, max_length), eos)
+        tokens[:, :prompt_len] = inputs
+        seen = None
+        if sampler.repetition_penalty != 1.0:
+            seen = torch.zeros((rows, vocab_size), dtype=torch.bool, device=device)
+            seen.scatter_(1, inputs, True)
+        done = torch.zeros(rows, dtype=torch.bool, device=device)
+        identity = torch.arange(rows, device=device)
+        cur_len = prompt_len
+        steps = syncs = 0
+        while True:
+            steps += 1
+            next_tokens = sampler(logits, seen).masked_fill_(done, eos)
+            tokens[:, cur_len] = next_tokens
+            if seen is not None:
+                seen[identity, next_tokens] = True
+            done |= next_tokens == eos
+            cur_len += 1
+            if cur_len >= max_length:
+                break
+            if (cur_len - prompt_len) % self.sync_interval == 0:
+                syncs += 1
+                if bool(done.all()):
+                    break
+            # the k-th generated code sits at mel position k + 1, like GPT2InferenceModel.forward
+            emb = model.embeddings(next_tokens[:, None])
+            emb = emb + model.text_pos_embedding.get_fixed_embedding(cur_len - mel_len, device)
+            hidden = static_gpt2_forward(model.transformer, emb, cache, filled_only=True)
+            logits = model.lm_head(hidden)[:, -1]
+
+        # generate() stops at the step where the last row emitted the stop token
+        is_stop = tokens[:, prompt_len:cur_len] == eos
+        if bool(is_stop.any(dim=1).all()):
+            cur_len = prompt_len + int(is_stop.int().argmax(dim=1).max()) + 1
+        self.last_stats = {
+            "steps": steps,
+            "tokens": cur_len - prompt_len,
+            "rows": rows,
+            "syncs": syncs + 1,
+            "total_time": time.perf_counter() - start_time,
+        }
+        return tokens[:, :cur_len]
@@ -0,0 +1,161 @@
+import time
+from typing import Dict, Optional
+
+import torch
+from transformers import LogitsProcessorList
+
+from indextts.gpt.kv_cache import StaticKVCache, static_gpt2_forward
+
+
+class SpeculativeDecoder:
+    """
+    Self-speculative decoding of mel codes for a ``UnifiedVoice``.
+
+    The draft is the same GPT cut after its first ``draft_layers`` blocks, read out through the shared
+    ``ln_f``/``final_norm``/``mel_head``. It proposes ``speculate_k`` codes one at a time, then the full model
+    scores all of them in a single forward pass and keeps the longest prefix that passes the usual
+    speculative-sampling test (accept with probability min(1, p_target / p_draft), resample the first rejected
+    position from the normalized residual). The accepted codes therefore follow exactly the distribution of
+    plain sampling with the same logits processors; greedy decoding accepts a draft code only when it is the
+    target argmax.
+
+    Draft and target share one static KV cache: the draft blocks are the first blocks of the target, so the
+    verification pass rewrites the draft's keys/values with identical ones for every accepted position, and
+    the positions of rejected codes are dropped with ``StaticKVCache.truncate``.
+
+    Only single-row, single-beam generation is supported; ``supports`` tells ``inference_speech`` when to fall
+    back to ``generate()``.
+    """
+
+    SUPPORTED_KWARGS = {"do_sample", "top_k", "top_p", "temperature", "repetition_penalty", "length_penalty",
+                        "num_beams", "num_return_sequences", "min_length", "min_new_tokens"}
+
+    def __init__(self, gpt, draft_layers, speculate_k=4):
+        if not 0 < draft_layers < gpt.layers:
+            raise ValueError(f"draft_layers must be in [1, {gpt.layers - 1}], got {draft_layers}")
+        self.gpt = gpt
+        self.draft_layers = draft_layers
+        self.speculate_k = speculate_k
+        self.last_stats: Optional[Dict] = None
+
+    def supports(self, batch_size, generate_kwargs) -> bool:
+        return (batch_size == 1 and generate_kwargs.get("num_beams", 1) == 1
+                and generate_kwargs.get("num_return_sequences", 1) == 1
+                and set(generate_kwargs) <= self.SUPPORTED_KWARGS)
+
+    # ---- model pieces ----------------------------------------------------------
+    def _embed(self, tokens, first_position):
+        model = self.gpt.inference_model
+        positions = torch.arange(first_position, first_position + tokens.shape[1], device=tokens.device)
+        return model.embeddings(tokens) + model.text_pos_embedding.emb(positions).unsqueeze(0)
+
+    def _logits(self, tokens, first_position, cache: StaticKVCache, num_layers=None):
+        model = self.gpt.inference_model
+        hidden = static_gpt2_forward(model.transformer, self._embed(tokens, first_position), cache,
+                                     num_layers=num_layers)
+        return model.lm_head(hidden)[0].float()
+
+    def _pick(self, scores, do_sample):
+        if do_sample:
+            return int(torch.multinomial(torch.softmax(scores, dim=-1), num_samples=1))
+        return int(scores.argmax())
+
+    # ---- generation ------------------------------------------------------------
+    @torch.no_grad()
+    def generate(self, inputs, attention_mask, max_length, logits_processor=None, **generate_kwargs):
+        """
+        Same contract as ``GPT2InferenceModel.generate(inputs, ...)`` for one row: returns the prompt ids
+        followed by the generated codes, ending with ``stop_mel_token`` if the row stopped.
+        """
+        gpt = self.gpt
+        model = gpt.inference_model
+        start_time = time.perf_counter()
+        device = inputs.device
+        eos = gpt.stop_mel_token
+        generation_config, model_kwargs = model._prepare_generation_config(
+            None, bos_token_id=gpt.start_mel_token, pad_token_id=eos, eos_token_id=eos, max_length=max_length,
+            **generate_kwargs)
+        model._prepare_special_tokens(generation_config, True, device=device)
+        processors = model._get_logits_processor(
+            generation_config=generation_config, input_ids_seq_length=inputs.shape[1], encoder_input_ids=inputs,
+            prefix_allowed_tokens_fn=None, logits_processor=logits_processor or LogitsProcessorList(),
+            device=device, model_kwargs=model_kwargs)
+        do_sample = generation_config.do_sample
+        mel_len = model.cached_mel_emb.shape[1]
+
+        # prefill through the regular static-cache forward (left padding, prefix KV reuse), with room for drafts
+        model.static_cache_length = max_length + self.speculate_k
+        out = model(input_ids=inputs, attention_mask=attention_mask, use_cache=True, return_dict=True)
+        cache = out.past_key_values
+        ids = inputs[0].tolist()
+        ids.append(self._pick(processors(inputs, out.logits[:, -1].float()), do_sample))
+        stats = {"draft_tokens": 0, "accepted": 0, "draft_forwards": 0, "target_forwards": 1}
+
+        while ids[-1] != eos and len(ids) < max_length:
+            # the last code is not in the cache yet; it sits at cache position `base`
+            base = cache.length
+            position = len(ids) - mel_len
+            k = min(self.speculate_k, max_length - len(ids) - 1)
+            drafts, draft_scores = [], []
+            token = ids[-1]
+            for i in range(k):
+                logits = self._logits(torch.tensor([[token]], device=device), position + i, cache,
+                                      num_layers=self.draft_layers)
+                scores = processors(torch.tensor([ids + drafts], device=device), logits[-1:])
+                token = self._pick(scores[0], do_sample)
+                drafts.append(token)
+                draft_scores.append(scores[0])
+                if token == eos:
+                    break
+            stats["draft_forwards"] += len(drafts)
+            stats["draft_tokens"] += len(drafts)
+
+            cache.truncate(base)
+            logits = self._logits(torch.tensor([ids[-1:] + drafts], device=device), position, cache)
+            stats["target_forwards"] += 1
+            target_scores = [processors(torch.tensor([ids + drafts[:i]], device=device), logits[i:i + 1])[0]
+                             for i in range(len(drafts) + 1)]
+            accepted = 0
+            next_token = None
+            for i, draft in enumerate(drafts):
+                if do_sample:
+                    p_target = torch.softmax(target_scores[i], dim=-1)
+                    p_draft = torch.softmax(draft_scores[i], dim=-1)
+                    if float(torch.rand(())) < float(p_target[draft] / p_draft[draft]):
+                        accepted += 1
+                        continue
+                    residual = (p_target - p_draft).clamp_(min=0)
+                    if float(residual.sum()) <= 0:
+                        residual = p_target
+                    next_token = int(torch.multinomial(residual / residual.sum(), num_samples=1))
+                elif int(target_scores[i].argmax()) == draft:
+                    accepted += 1
+                    continue
+                else:
+                    next_token = int(target_scores[i].argmax())
+                break
+            stats["accepted"] += accepted
+            ids.extend(drafts[:accepted])
+            # keep the cache up to the accepted codes; the new code is fed in the next round
+            cache.truncate(base + 1 + accepted)
+            if accepted and ids[-1] == eos:
+                break
+            if next_token is None:
+                next_token = self._pick(target_scores[accepted], do_sample)
+            ids.append(next_token)
+
+        generated = len(ids) - inputs.shape[1]
+        draft_cost = stats["draft_forwards"] * self.draft_layers / gpt.layers
+        stats.update({
+            "tokens": generated,
+            "acceptance_rate": stats["accepted"] / stats["draft_tokens"] if stats["draft_tokens"] else 0.0,
+            "tokens_per_target_forward": generated / stats["target_forwards"],
+            # plain decoding needs one full forward per code; drafts are charged by their share of the layers
+            "estimated_speedup": generated / (stats["target_forwards"] + draft_cost),
+            "total_time": time.perf_counter() - start_time,
+        })
+        self.last_stats = stats
+        print(f">> speculative decoding: {stats['accepted']}/{stats['draft_tokens']} draft codes accepted "
+              f"({stats['acceptance_rate']:.1%}), {stats['tokens_per_target_forward']:.2f} codes per full forward, "
+              f"estimated speedup {stats['estimated_speedup']:.2f}x")
+        return torch.tensor([ids], dtype=inputs.dtype, device=device)
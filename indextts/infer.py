@@ -19,6 +19,7 @@ warnings.filterwarnings("ignore", category=UserWarning)
 from indextts.BigVGAN.models import BigVGAN as Generator
 from indextts.gpt.model_v2 import UnifiedVoice
 from indextts.utils.checkpoint import load_checkpoint
+from indextts.utils.common import remove_long_silence
 from indextts.utils.feature_extractors import MelSpectrogramFeatures
 
 from indextts.utils.front import TextNormalizer, TextTokenizer
@@ -134,57 +135,8 @@ class IndexTTS:
         Shrink special tokens (silent_token and stop_mel_token) in codes
         codes: [B, T]
         """
-        code_lens = []
-        codes_list = []
-        device = codes.device
-        dtype = codes.dtype
-        isfix = False
-        for i in range(0, codes.shape[0]):
-            code = codes[i]
-            if not torch.any(code == self.stop_mel_token).item():
-                len_ = code.size(0)
-            else:
-                stop_mel_idx = (code == self.stop_mel_token).nonzero(as_tuple=False)
-                len_ = stop_mel_idx[0].item() if len(stop_mel_idx) > 0 else code.size(0)
-
-            count = torch.sum(code == silent_token).item()
-            if count > max_consecutive:
-                # code = code.cpu().tolist()
-                ncode_idx = []
-                n = 0
-                for k in range(len_):
-                    assert code[
-                               k] != self.stop_mel_token, f"stop_mel_token {self.stop_mel_token} should be shrinked here"
-                    if code[k] != silent_token:
-                        ncode_idx.append(k)
-                        n = 0
-                    elif code[k] == silent_token and n < 10:
-                        ncode_idx.append(k)
-                        n += 1
-                    # if (k == 0 and code[k] == 52) or (code[k] == 52 and code[k-1] == 52):
-                    #    n += 1
-                # new code
-                len_ = len(ncode_idx)
-                codes_list.append(code[ncode_idx])
-                isfix = True
-            else:
-                # shrink to len_
-                codes_list.append(code[:len_])
-            code_lens.append(len_)
-        if isfix:
-            if len(codes_list) > 1:
-                codes = pad_sequence(codes_list, batch_first=True, padding_value=self.stop_mel_token)
-            else:
-                codes = codes_list[0].unsqueeze(0)
-        else:
-            # unchanged
-            pass
-        # clip codes to max length
-        max_len = max(code_lens)
-        if max_len < codes.shape[1]:
-            codes = codes[:, :max_len]
-        code_lens = torch.tensor(code_lens, dtype=torch.long, device=device)
-        return codes, code_lens
+        return remove_long_silence(codes, self.stop_mel_token, silent_token=silent_token,
+                                   max_consecutive=max_consecutive)
 
     def bucket_sentences(self, sentences, bucket_max_size=4) -> List[List[Dict]]:
         """
@@ -288,6 +240,9 @@ class IndexTTS:
             ``sentences_bucket_max_size``: 分句分桶的最大容量，默认``4``，可以根据GPU内存调整
                 - 越大，bucket数量越少，batch越多，推理速度越*快*，占用内存更多，可能影响质量
                 - 越小，bucket数量越多，batch越少，推理速度越*慢*，占用内存和质量更接近于非快速推理
+            ``reuse_prompt_kv``: 生成后直接用静态 KV cache 中的条件+文本 KV 计算 GPT latent，默认``False``
+                - 省去对条件+文本的第二次 GPT 前向（以及条件编码器），结果与原 latent 前向一致
+                - 需要 ``gpt.enable_static_kv_cache()``，否则回退到原 latent 前向
         """
         print(">> start fast inference...")
 
@@ -340,6 +295,7 @@ class IndexTTS:
         num_beams = generation_kwargs.pop("num_beams", 3)
         repetition_penalty = generation_kwargs.pop("repetition_penalty", 10.0)
         max_mel_tokens = generation_kwargs.pop("max_mel_tokens", 600)
+        reuse_prompt_kv = generation_kwargs.pop("reuse_prompt_kv", False)
         sampling_rate = 24000
         # lang = "EN"
         # lang = "ZH"
@@ -376,6 +332,7 @@ class IndexTTS:
         # Sequential processing of bucketing data
         all_batch_num = sum(len(s) for s in all_sentences)
         all_batch_codes = []
+        all_batch_latents = []
         processed_num = 0
         for item_tokens in all_text_tokens:
             batch_num = len(item_tokens)
@@ -406,13 +363,25 @@ class IndexTTS:
                                                            **generation_kwargs)
                     all_batch_codes.append(temp_codes)
             gpt_gen_time += time.perf_counter() - m_start_time
+            batch_latents = None
+            if reuse_prompt_kv:
+                # latents of the compacted codes from the prompt KV of this batch, before the next one overwrites it
+                m_start_time = time.perf_counter()
+                with torch.no_grad():
+                    with torch.amp.autocast(batch_text_tokens.device.type, enabled=self.dtype is not None,
+                                            dtype=self.dtype):
+                        fixed_codes, _ = self.remove_long_silence(temp_codes, silent_token=52, max_consecutive=30)
+                        batch_latents = self.gpt.latents_from_generation(fixed_codes)
+                gpt_forward_time += time.perf_counter() - m_start_time
+            all_batch_latents.append(batch_latents)
 
         # gpt latent
         self._set_gr_progress(0.5, "gpt inference latents...")
         all_idxs = []
         all_latents = []
         has_warned = False
-        for batch_codes, batch_tokens, batch_sentences in zip(all_batch_codes, all_text_tokens, all_sentences):
+        for batch_codes, batch_latents, batch_tokens, batch_sentences in zip(all_batch_codes, all_batch_latents,
+                                                                             all_text_tokens, all_sentences):
             for i in range(batch_codes.shape[0]):
                 codes = batch_codes[i]  # [x]
                 if not has_warned and codes[-1] != self.stop_mel_token:
@@ -433,6 +402,9 @@ class IndexTTS:
                     print("code_lens:", code_lens)
                 text_tokens = batch_tokens[i].unsqueeze(0)
                 all_idxs.append(batch_sentences[i]["idx"])
+                if batch_latents is not None:
+                    all_latents.append(batch_latents[i:i + 1, :codes.shape[-1]])
+                    continue
                 m_start_time = time.perf_counter()
                 with torch.no_grad():
                     with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
@@ -448,7 +420,7 @@ class IndexTTS:
                                      do_spk_cond=True)
                         gpt_forward_time += time.perf_counter() - m_start_time
                         all_latents.append(latent)
-        del all_batch_codes, all_text_tokens, all_sentences
+        del all_batch_codes, all_batch_latents, all_text_tokens, all_sentences
         # bigvgan chunk
         chunk_size = 2
         all_latents = [all_latents[all_idxs.index(i)] for i in range(len(all_latents))]
@@ -0,0 +1,642 @@
+import os
+import random
+import sys
+import time
+import warnings
+from typing import Dict, List, Sequence
+
+import torch
+import torchaudio
+
+from indextts.gpt.continuous_batching import ContinuousBatchScheduler
+from indextts.utils.common import code_lengths
+from indextts.utils.segment_cache import segment_cache_key
+from indextts.utils.voice_profile import compute_voice_profile, hash_audio_file
+
+SAMPLING_RATE = 22050
+INTERVAL_SILENCE_MS = 200
+DIFFUSION_STEPS = 25
+INFERENCE_CFG_RATE = 0.7
+# s2mel frames per GPT mel code
+CODE_TO_MEL_RATIO = 1.72
+
+
+def pop_sampling_kwargs(generation_kwargs: Dict) -> Dict:
+    """Split the sampling settings out of ``generation_kwargs`` with the defaults used by ``IndexTTS2.infer``."""
+    return {
+        "do_sample": generation_kwargs.pop("do_sample", True),
+        "top_p": generation_kwargs.pop("top_p", 0.8),
+        "top_k": generation_kwargs.pop("top_k", 30),
+        "temperature": generation_kwargs.pop("temperature", 0.8),
+        "length_penalty": generation_kwargs.pop("length_penalty", 0.0),
+        "num_beams": generation_kwargs.pop("num_beams", 3),
+        "repetition_penalty": generation_kwargs.pop("repetition_penalty", 10.0),
+        "max_mel_tokens": generation_kwargs.pop("max_mel_tokens", 1500),
+    }
+
+
+class IndexTTS2Pipeline:
+    """
+    Python implementation of the IndexTTS2 segment pipeline (conditioning -> GPT codes -> GPT latent ->
+    s2mel -> BigVGAN), built on the components of a loaded ``IndexTTS2``.
+
+    Unlike ``IndexTTS2.infer`` the stages are exposed separately, so segments of several requests that
+    share a speaker can be generated in one GPT batch (``infer_batch``). With a ``segment_cache``,
+    segments that were already synthesized with the same inputs are read back instead of generated,
+    so re-rendering an edited script only synthesizes the changed lines. With ``continuous_batching``,
+    ``infer_batch`` schedules the segments of all speakers through one in-flight GPT batch instead of
+    fixed per-speaker batches (sampling without beam search only). With ``reuse_prompt_kv``, the GPT latent
+    of each segment is computed right after generation from the prompt keys/values still in the static KV
+    cache, instead of a second GPT pass over conditioning + text + codes in ``decode``. ``diffusion_steps`` is
+    the number of s2mel ODE steps; the solver, time schedule and CFG schedule are the ones set on the CFM
+    (``set_solver``, ``set_cfg_schedule``). The stages here do not move sub-models in and out of the device, so with
+    a ``low_vram`` engine ``infer``, ``infer_batch`` and ``infer_stream`` run ``IndexTTS2.infer`` per request instead,
+    which does. With ``s2mel_batch_size`` > 1, ``infer_batch`` pads the segments of
+    one speaker prompt to a common length and solves up to that many of them in one CFM call.
+    """
+
+    def __init__(self, tts, voice_store=None, emo_cache=None, segment_cache=None, continuous_batching=False,
+                 reuse_prompt_kv=False, diffusion_steps=DIFFUSION_STEPS, s2mel_batch_size=1):
+        self.tts = tts
+        self.voice_store = voice_store
+        self.emo_cache = emo_cache
+        self.segment_cache = segment_cache
+        self.continuous_batching = continuous_batching
+        self.reuse_prompt_kv = reuse_prompt_kv
+        self.diffusion_steps = diffusion_steps
+        self.s2mel_batch_size = s2mel_batch_size
+        self.last_batch_metrics = None
+        self.last_s2mel_metrics = None
+        self.stop_mel_token = tts.stop_mel_token
+        # without a voice store, keep the last speaker so its segments can still share GPT batches
+        self._last_profile = None
+        self.last_stream_metrics = None
+
+    @property
+    def low_vram(self):
+        return bool(getattr(self.tts, "low_vram", False))
+
+    def _engine_infer(self, request: Dict):
+        """One request through ``IndexTTS2.infer``, which onloads/offloads its sub-models in ``low_vram`` mode."""
+        request = dict(request)
+        seed = request.pop("seed", None)
+        if seed is not None:
+            torch.manual_seed(seed)
+        request.setdefault("output_path", None)
+        return self.tts.infer(**request)
+
+    @property
+    def device(self):
+        return torch.device(self.tts.device)
+
+    def _autocast(self, enabled=True):
+        dtype = getattr(self.tts, "dtype", None)
+        return torch.amp.autocast(self.device.type, enabled=enabled and dtype is not None, dtype=dtype)
+
+    # ---- conditioning ------------------------------------------------------
+    def _speaker(self, spk_audio_prompt, verbose=False):
+        if self.voice_store is not None:
+            key, profile = self.voice_store.load_or_compute(self.tts, spk_audio_prompt, verbose=verbose)
+            if self.emo_cache is not None:
+                self.emo_cache.register(profile["spk_cond_emb"], f"spk:{key}")
+                self.emo_cache.register(profile["style"], f"style:{key}")
+            return profile
+        if self._last_profile is None or self._last_profile[0] != spk_audio_prompt:
+            self._last_profile = (spk_audio_prompt, compute_voice_profile(self.tts, spk_audio_prompt, verbose=verbose))
+        return self._last_profile[1]
+
+    @torch.no_grad()
+    def _emo_cond(self, emo_audio_prompt, verbose=False):
+        tts = self.tts
+        if self.emo_cache is not None:
+            self.emo_cache.install(tts)
+            self.emo_cache.attach(tts, emo_audio_prompt, verbose=verbose)
+            return tts.cache_emo_cond
+        emo_audio, _ = tts._load_and_cut_audio(emo_audio_prompt, getattr(tts, "max_ref_audio_duration", 15), verbose, sr=16000)
+        emo_inputs = tts.extract_features(emo_audio, sampling_rate=16000, return_tensors="pt")
+        return tts.get_emb(emo_inputs["input_features"].to(tts.device), emo_inputs["attention_mask"].to(tts.device))
+
+    @torch.no_grad()
+    def _emo_blend(self, style, emo_vector, use_random=False):
+        tts = self.tts
+        if self.emo_cache is not None and not use_random:
+            return self.emo_cache.emo_blend(tts, style, emo_vector)
+        find = getattr(sys.modules[type(tts).__module__], "find_most_similar_cosine")
+        weight_vector = torch.tensor(list(emo_vector), device=tts.device)
+        if use_random:
+            random_index = [random.randint(0, x - 1) for x in tts.emo_num]
+        else:
+            random_index = [find(style, tmp) for tmp in tts.spk_matrix]
+        emo_matrix = torch.cat([tmp[index].unsqueeze(0) for index, tmp in zip(random_index, tts.emo_matrix)], 0)
+        return torch.sum(weight_vector.unsqueeze(1) * emo_matrix, 0).unsqueeze(0)
+
+    @torch.no_grad()
+    def prepare_conditioning(self, spk_audio_prompt, emo_audio_prompt=None, emo_alpha=1.0, emo_vector=None,
+                             use_emo_text=False, emo_text=None, text=None, use_random=False, verbose=False) -> Dict:
+        """
+        Speaker and emotion conditioning of one request, following the emotion rules of ``IndexTTS2.infer``:
+        text- or vector-driven emotion ignores the emotion reference audio, and without an emotion
+        reference the speaker prompt is used with ``emo_alpha`` = 1.0.
+        """
+        tts = self.tts
+        if use_emo_text or emo_vector is not None:
+            emo_audio_prompt = None
+        if use_emo_text:
+            if emo_text is None:
+                emo_text = text
+            emo_dict = tts.qwen_emo.inference(emo_text)
+            print(f">> detected emotion vectors from text: {emo_dict}")
+            emo_vector = list(emo_dict.values())
+        if emo_vector is not None:
+            emo_vector_scale = max(0.0, min(1.0, emo_alpha))
+            if emo_vector_scale != 1.0:
+                emo_vector = [int(x * emo_vector_scale * 10000) / 10000 for x in emo_vector]
+        if emo_audio_prompt is None:
+            emo_audio_prompt = spk_audio_prompt
+            emo_alpha = 1.0
+
+        profile = self._speaker(spk_audio_prompt, verbose=verbose)
+        spk_cond_emb = profile["spk_cond_emb"]
+        emo_cond_emb = self._emo_cond(emo_audio_prompt, verbose=verbose)
+        with self._autocast():
+            emovec = tts.gpt.merge_emovec(spk_cond_emb, emo_cond_emb,
+                                          torch.tensor([spk_cond_emb.shape[-1]], device=self.device),
+                                          torch.tensor([emo_cond_emb.shape[-1]], device=self.device),
+                                          alpha=emo_alpha)
+            if emo_vector is not None:
+                emovec_mat = self._emo_blend(profile["style"], emo_vector, use_random=use_random)
+                weight_sum = float(sum(emo_vector))
+                emovec = emovec_mat + (1 - weight_sum) * emovec
+        cond = dict(profile)
+        cond["emo_cond_emb"] = emo_cond_emb
+        cond["emovec"] = emovec
+        cond["spk_audio_prompt"] = spk_audio_prompt
+        return cond
+
+    # ---- text ----------------------------------------------------------------
+    def split_segments(self, text, max_text_tokens_per_segment=120) -> List[List[int]]:
+        tokenizer = self.tts.tokenizer
+        text_tokens_list = tokenizer.tokenize(text)
+        segments = tokenizer.split_sentences(text_tokens_list, max_text_tokens_per_segment)
+        return [tokenizer.convert_tokens_to_ids(sent) for sent in segments]
+
+    # ---- GPT -------------------------------------------------------------------
+    @torch.no_grad()
+    def generate_codes(self, conds: Sequence[Dict], segments: Sequence[List[int]], sampling: Dict,
+                       **generation_kwargs) -> List[Dict]:
+        """
+        Generate mel codes for ``segments[i]`` conditioned on ``conds[i]`` in one GPT batch.
+        All rows must share the speaker conditioning; their emotion vectors may differ.
+        Text rows are right padded with ``stop_text_token`` and left aligned by ``prepare_gpt_inputs``.
+        """
+        tts = self.tts
+        gpt = tts.gpt
+        spk_cond_emb = conds[0]["spk_cond_emb"]
+        for cond in conds[1:]:
+            assert cond["spk_cond_emb"] is spk_cond_emb, "a GPT batch must share one speaker"
+        device = self.device
+        max_len = max(len(seg) for seg in segments)
+        text_tokens = torch.full((len(segments), max_len), gpt.stop_text_token, dtype=torch.int32, device=device)
+        for i, seg in enumerate(segments):
+            text_tokens[i, :len(seg)] = torch.tensor(seg, dtype=torch.int32, device=device)
+        emovec = torch.cat([cond["emovec"] for cond in conds], dim=0)
+        emo_cond_emb = conds[0]["emo_cond_emb"]
+        with self._autocast():
+            codes, speech_conditioning_latent = gpt.inference_speech(
+                spk_cond_emb, text_tokens, emo_cond_emb,
+                cond_lengths=torch.tensor([spk_cond_emb.shape[-1]], device=device),
+                emo_cond_lengths=torch.tensor([emo_cond_emb.shape[-1]], device=device),
+                emo_vec=emovec,
+                do_sample=sampling["do_sample"],
+                top_p=sampling["top_p"],
+                top_k=sampling["top_k"],
+                temperature=sampling["temperature"],
+                num_return_sequences=1,
+                length_penalty=sampling["length_penalty"],
+                num_beams=sampling["num_beams"],
+                repetition_penalty=sampling["repetition_penalty"],
+                max_generate_length=sampling["max_mel_tokens"],
+                **generation_kwargs)
+            # cut every row at its first stop token, with one host round-trip for the whole batch
+            code_lens = code_lengths(codes, self.stop_mel_token).tolist()
+            latents = None
+            if self.reuse_prompt_kv:
+                # None when the prompt keys/values are not kept (dynamic KV cache): decode runs the GPT pass
+                latents = gpt.latents_from_generation(codes[:, :max(code_lens)])
+        results = []
+        for i, seg in enumerate(segments):
+            row_codes = codes[i, :code_lens[i]]
+            if row_codes.size(0) == codes.size(1):
+                warnings.warn(
+                    f"WARN: generation stopped due to exceeding `max_mel_tokens` ({sampling['max_mel_tokens']}). "
+                    f"Input text tokens: {len(seg)}.",
+                    category=RuntimeWarning)
+            results.append({
+                "codes": row_codes.unsqueeze(0),
+                "text_tokens": text_tokens[i:i + 1, :len(seg)],
+                "speech_conditioning_latent": speech_conditioning_latent,
+                "latent": latents[i:i + 1, :code_lens[i]] if latents is not None else None,
+            })
+        return results
+
+    @torch.no_grad()
+    def generate_codes_continuous(self, conds: Sequence[Dict], segments: Sequence[List[int]], sampling: Dict,
+                                  max_batch_size=8) -> List[Dict]:
+        """
+        Generate mel codes for ``segments[i]`` conditioned on ``conds[i]`` with a ``ContinuousBatchScheduler``:
+        finished rows hand their slot to the next segment, and rows may belong to different speakers.
+        """
+        gpt = self.tts.gpt
+        device = self.device
+        speaker_latents = {}
+        prompts = []
+        with self._autocast():
+            for cond, seg in zip(conds, segments):
+                spk_cond_emb = cond["spk_cond_emb"]
+                latent = speaker_latents.get(id(spk_cond_emb))
+                if latent is None:
+                    latent = gpt.get_conditioning(spk_cond_emb.transpose(1, 2),
+                                                  torch.tensor([spk_cond_emb.shape[-1]], device=device))
+                    speaker_latents[id(spk_cond_emb)] = latent
+                prompts.append({
+                    "conds_latent": gpt.build_conds_latent(latent, cond["emovec"], 1),
+                    "text_tokens": torch.tensor(seg, dtype=torch.int32, device=device),
+                    "speech_conditioning_latent": latent,
+                })
+            scheduler = ContinuousBatchScheduler(gpt, max_batch_size=max_batch_size, do_sample=sampling["do_sample"],
+                                                 top_k=sampling["top_k"], top_p=sampling["top_p"],
+                                                 temperature=sampling["temperature"],
+                                                 repetition_penalty=sampling["repetition_penalty"],
+                                                 max_generate_length=sampling["max_mel_tokens"])
+            generated = scheduler.generate(prompts)
+        self.last_batch_metrics = scheduler.last_metrics
+        results = []
+        for prompt, seg, gen in zip(prompts, segments, generated):
+            if not gen["stopped"]:
+                warnings.warn(
+                    f"WARN: generation stopped due to exceeding `max_mel_tokens` ({sampling['max_mel_tokens']}). "
+                    f"Input text tokens: {len(seg)}.",
+                    category=RuntimeWarning)
+            results.append({
+                "codes": gen["codes"].unsqueeze(0),
+                "text_tokens": prompt["text_tokens"].unsqueeze(0),
+                "speech_conditioning_latent": prompt["speech_conditioning_latent"],
+            })
+        return results
+
+    # ---- GPT latent + s2mel + vocoder ------------------------------------------
+    def _gpt_latent(self, cond: Dict, generated: Dict):
+        """GPT latent of the codes of one segment, from generation (``reuse_prompt_kv``) or a second GPT pass."""
+        latent = generated.get("latent")
+        if latent is not None:
+            return latent
+        tts = self.tts
+        device = self.device
+        codes = generated["codes"]
+        text_tokens = generated["text_tokens"]
+        spk_cond_emb = cond["spk_cond_emb"]
+        emo_cond_emb = cond["emo_cond_emb"]
+        with self._autocast():
+            use_speed = torch.zeros(spk_cond_emb.size(0), device=device).long()
+            return tts.gpt(generated["speech_conditioning_latent"], text_tokens,
+                           torch.tensor([text_tokens.shape[-1]], device=device), codes,
+                           torch.tensor([codes.shape[-1]], device=device),
+                           emo_cond_emb,
+                           cond_mel_lengths=torch.tensor([spk_cond_emb.shape[-1]], device=device),
+                           emo_cond_mel_lengths=torch.tensor([emo_cond_emb.shape[-1]], device=device),
+                           emo_vec=cond["emovec"],
+                           use_speed=use_speed)
+
+    @torch.no_grad()
+    def decode(self, cond: Dict, generated: Dict, speaking_speed=1.0) -> torch.Tensor:
+        """Turn the codes of one segment into a clamped waveform (1, samples) on the CPU."""
+        return self.decode_batch([(cond, generated, speaking_speed)])[0]
+
+    @torch.no_grad()
+    def decode_batch(self, items: Sequence, s2mel_batch_size=None) -> List[torch.Tensor]:
+        """
+        ``decode`` of several segments, given as ``(cond, generated, speaking_speed)`` tuples. Segments that share
+        a speaker prompt are solved by the CFM ``s2mel_batch_size`` at a time, longest first, so that each batch
+        pads its rows to similar lengths. Padding ratio and s2mel throughput are kept in ``last_s2mel_metrics``.
+        """
+        tts = self.tts
+        batch_size = max(1, s2mel_batch_size or self.s2mel_batch_size)
+        start_time = time.perf_counter()
+        conditions = []
+        for cond, generated, speed in items:
+            latent = self._gpt_latent(cond, generated)
+            codes = generated["codes"]
+            code_lens = torch.tensor([codes.shape[-1]], dtype=torch.long, device=self.device)
+            with self._autocast(enabled=False):
+                conditions.append(self.s2mel_condition(cond, latent, codes, code_lens, speed))
+        s2mel_start = time.perf_counter()
+        # segments of one speaker prompt share the CFM prompt mel and style
+        groups: Dict[tuple, List[int]] = {}
+        for i in sorted(range(len(items)), key=lambda i: -conditions[i].size(1)):
+            cond = items[i][0]
+            groups.setdefault((id(cond["ref_mel"]), id(cond["style"])), []).append(i)
+        mels = [None] * len(items)
+        metrics = {"segments": len(items), "batches": 0, "frames": 0, "padded_frames": 0}
+        for group in groups.values():
+            for b in range(0, len(group), batch_size):
+                chunk = group[b:b + batch_size]
+                cond = items[chunk[0]][0]
+                with self._autocast(enabled=False):
+                    chunk_mels = self.s2mel_batch(cond, [conditions[i] for i in chunk])
+                for i, mel in zip(chunk, chunk_mels):
+                    mels[i] = mel
+                width = max(mel.size(-1) for mel in chunk_mels)
+                metrics["batches"] += 1
+                metrics["frames"] += sum(mel.size(-1) for mel in chunk_mels)
+                metrics["padded_frames"] += sum(width - mel.size(-1) for mel in chunk_mels)
+        s2mel_time = time.perf_counter() - s2mel_start
+        wavs = []
+        for mel in mels:
+            with self._autocast(enabled=False):
+                wav = tts.bigvgan(mel.float()).squeeze().unsqueeze(0)
+            wavs.append(torch.clamp(32767 * wav, -32767.0, 32767.0).cpu())
+        total = metrics["frames"] + metrics["padded_frames"]
+        metrics.update({
+            "batch_size": batch_size,
+            "padding_ratio": metrics["padded_frames"] / total if total else 0.0,
+            "s2mel_time": s2mel_time,
+            "s2mel_frames_per_s": metrics["frames"] / s2mel_time if s2mel_time > 0 else None,
+            "total_time": time.perf_counter() - start_time,
+        })
+        self.last_s2mel_metrics = metrics
+        return wavs
+
+    def s2mel_condition(self, cond: Dict, latent, codes, code_lens, speaking_speed=1.0):
+        """CFM content frames of one segment: the prompt condition followed by its length-regulated codes (1, T, C)."""
+        tts = self.tts
+        latent = tts.s2mel.models['gpt_layer'](latent)
+        S_infer = tts.semantic_codec.quantizer.vq2emb(codes.unsqueeze(1))
+        S_infer = S_infer.transpose(1, 2)
+        S_infer = S_infer + latent
+        target_lengths = (code_lens * CODE_TO_MEL_RATIO / max(float(speaking_speed), 1e-3)).long()
+        cond_frames = tts.s2mel.models['length_regulator'](S_infer, ylens=target_lengths, n_quantizers=3, f0=None)[0]
+        return torch.cat([cond["prompt_condition"], cond_frames], dim=1)
+
+    def s2mel(self, cond: Dict, latent, codes, code_lens, speaking_speed=1.0):
+        return self.s2mel_batch(cond, [self.s2mel_condition(cond, latent, codes, code_lens, speaking_speed)])[0]
+
+    def s2mel_batch(self, cond: Dict, conditions: Sequence[torch.Tensor]) -> List[torch.Tensor]:
+        """
+        Mel of several segments of the speaker prompt of ``cond`` (``s2mel_condition`` outputs) in one CFM solve:
+        the rows are right padded to the longest, with their lengths as ``x_lens``, and share the prompt mel and
+        style. Returns the generated mel of every segment (1, 80, frames), prompt and padding cut off.
+        """
+        ref_mel = cond["ref_mel"]
+        rows = len(conditions)
+        lengths = [c.size(1) for c in conditions]
+        cat_condition = conditions[0].new_zeros(rows, max(lengths), conditions[0].size(2))
+        for i, c in enumerate(conditions):
+            cat_condition[i, :lengths[i]] = c[0]
+        vc_target = self.tts.s2mel.models['cfm'].inference(cat_condition,
+                                                           torch.LongTensor(lengths).to(cat_condition.device),
+                                                           ref_mel.expand(rows, -1, -1),
+                                                           cond["style"].expand(rows, -1), None,
+                                                           self.diffusion_steps,
+                                                           inference_cfg_rate=INFERENCE_CFG_RATE)
+        return [vc_target[i:i + 1, :, ref_mel.size(-1):lengths[i]] for i in range(rows)]
+
+    # ---- output ------------------------------------------------------------------
+    def _finish(self, wavs, output_path=None):
+        tts = self.tts
+        wavs = tts.insert_interval_silence(wavs, sampling_rate=SAMPLING_RATE, interval_silence=INTERVAL_SILENCE_MS)
+        wav = torch.cat(wavs, dim=1).cpu()
+        if output_path:
+            if os.path.isfile(output_path):
+                os.remove(output_path)
+            if os.path.dirname(output_path) != "":
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            torchaudio.save(output_path, wav.type(torch.int16), SAMPLING_RATE)
+            print(">> wav file saved to:", output_path)
+            return output_path
+        wav_data = wav.type(torch.int16).numpy().T
+        return (SAMPLING_RATE, wav_data)
+
+    def infer(self, spk_audio_prompt, text, output_path, emo_audio_prompt=None, emo_alpha=1.0, emo_vector=None,
+              use_emo_text=False, emo_text=None, use_random=False, speaking_speed=1.0, verbose=False,
+              max_text_tokens_per_segment=120, **generation_kwargs):
+        """Same contract as ``IndexTTS2.infer``."""
+        return self.infer_batch([dict(spk_audio_prompt=spk_audio_prompt, text=text, output_path=output_path,
+                                      emo_audio_prompt=emo_audio_prompt, emo_alpha=emo_alpha,
+                                      emo_vector=emo_vector, use_emo_text=use_emo_text, emo_text=emo_text,
+                                      use_random=use_random, speaking_speed=speaking_speed, verbose=verbose,
+                                      max_text_tokens_per_segment=max_text_tokens_per_segment,
+                                      **generation_kwargs)])[0]
+
+    def _conditioning(self, request: Dict) -> Dict:
+        return self.prepare_conditioning(request["spk_audio_prompt"],
+                                         emo_audio_prompt=request.get("emo_audio_prompt"),
+                                         emo_alpha=request.get("emo_alpha", 1.0),
+                                         emo_vector=request.get("emo_vector"),
+                                         use_emo_text=request.get("use_emo_text", False),
+                                         emo_text=request.get("emo_text"),
+                                         text=request["text"],
+                                         use_random=request.get("use_random", False),
+                                         verbose=request.get("verbose", False))
+
+    def _split_request(self, request: Dict):
+        request = dict(request)
+        speed = float(request.get("speaking_speed", 1.0))
+        segments = self.split_segments(request["text"], request.get("max_text_tokens_per_segment", 120))
+        for name in ("spk_audio_prompt", "emo_audio_prompt", "emo_alpha", "emo_vector", "use_emo_text", "emo_text",
+                     "text", "use_random", "verbose", "speaking_speed", "max_text_tokens_per_segment", "output_path"):
+            request.pop(name, None)
+        seed = request.pop("seed", None)
+        sampling = pop_sampling_kwargs(request)
+        # whatever is left is passed through to GPT2InferenceModel.generate
+        return segments, sampling, request, speed, seed
+
+    def _audio_key(self, path):
+        if self.voice_store is not None:
+            return self.voice_store.key_for(self.tts, path)
+        return hash_audio_file(path)
+
+    def segment_keys(self, request: Dict, segments, sampling, extra, speed, seed) -> List:
+        """
+        Segment-cache key of every segment of ``request`` (None entries when the request cannot be cached).
+        The key covers the normalized text tokens, the voice and emotion inputs, speaking speed, sampling
+        settings, seed and s2mel solver settings, with the emotion rules of ``prepare_conditioning`` applied first.
+        Sampled requests without a seed are not cached: generating them again is expected to give a new take.
+        """
+        if self.segment_cache is None or request.get("use_random", False):
+            return [None] * len(segments)
+        if seed is None and sampling["do_sample"]:
+            return [None] * len(segments)
+        use_emo_text = bool(request.get("use_emo_text", False))
+        emo_vector = request.get("emo_vector")
+        emo_audio = request.get("emo_audio_prompt")
+        if use_emo_text or emo_vector is not None or emo_audio is None:
+            emo_audio = None
+        emotion = {
+            "audio": self._audio_key(emo_audio) if emo_audio else None,
+            "alpha": float(request.get("emo_alpha", 1.0)) if emo_audio or emo_vector is not None else 1.0,
+            "vector": [float(x) for x in emo_vector] if emo_vector is not None and not use_emo_text else None,
+            # text-driven emotion is detected on emo_text, or on the whole request text
+            "text": (request.get("emo_text") or request["text"]) if use_emo_text else None,
+        }
+        cfm = self.tts.s2mel.models['cfm']
+        s2mel = [getattr(cfm, "solver", "euler"), getattr(cfm, "t_schedule", "uniform"),
+                 getattr(cfm, "sway_coef", -1.0), self.diffusion_steps, getattr(cfm, "cfg_schedule", "full"),
+                 getattr(cfm, "cfg_mode", "reuse")]
+        base = [getattr(self.tts, "model_version", None), self._audio_key(request["spk_audio_prompt"]), emotion,
+                round(speed, 4), sampling, extra, seed, s2mel]
+        return [segment_cache_key(base, seg) for seg in segments]
+
+    def infer_stream(self, spk_audio_prompt, text, emo_audio_prompt=None, emo_alpha=1.0, emo_vector=None,
+                     use_emo_text=False, emo_text=None, use_random=False, speaking_speed=1.0, verbose=False,
+                     max_text_tokens_per_segment=120, **generation_kwargs):
+        """
+        Streaming variant of ``infer``: yields ``(sampling_rate, int16 ndarray)`` for each segment as soon
+        as its vocoder pass has finished. Every segment after the first starts with the interval silence,
+        so concatenating the chunks gives the same layout as ``infer``.
+        Time-to-first-audio and RTF of the last stream are kept in ``last_stream_metrics``.
+        """
+        start_time = time.perf_counter()
+        request = dict(spk_audio_prompt=spk_audio_prompt, text=text, emo_audio_prompt=emo_audio_prompt,
+                       emo_alpha=emo_alpha, emo_vector=emo_vector, use_emo_text=use_emo_text, emo_text=emo_text,
+                       use_random=use_random, speaking_speed=speaking_speed, verbose=verbose,
+                       max_text_tokens_per_segment=max_text_tokens_per_segment, **generation_kwargs)
+        if self.low_vram:
+            # the whole text in one chunk, from IndexTTS2.infer
+            sampling_rate, wav_data = self._engine_infer(request)
+            elapsed = time.perf_counter() - start_time
+            audio_length = wav_data.shape[0] / sampling_rate
+            self.last_stream_metrics = {"segments": None, "ttfa": elapsed, "total_time": elapsed,
+                                        "audio_length": audio_length,
+                                        "rtf": elapsed / audio_length if audio_length > 0 else None}
+            yield sampling_rate, wav_data.reshape(-1)
+            return
+        segments, sampling, extra, speed, seed = self._split_request(request)
+        keys = self.segment_keys(request, segments, sampling, extra, speed, seed)
+        if seed is not None:
+            torch.manual_seed(seed)
+        metrics = {"segments": len(segments), "ttfa": None, "total_time": 0.0, "audio_length": 0.0, "rtf": None}
+        self.last_stream_metrics = metrics
+        silence = torch.zeros(1, int(SAMPLING_RATE * INTERVAL_SILENCE_MS / 1000.0))
+        cond = None
+        for s_idx, (seg, key) in enumerate(zip(segments, keys)):
+            wav = self.segment_cache.get(key) if key is not None else None
+            if wav is None:
+                if cond is None:
+                    cond = self._conditioning(request)
+                generated = self.generate_codes([cond], [seg], sampling, **extra)[0]
+                wav = self.decode(cond, generated, speaking_speed=speed)
+                if key is not None:
+                    self.segment_cache.put(key, wav)
+            if s_idx > 0:
+                wav = torch.cat([silence, wav], dim=1)
+            if metrics["ttfa"] is None:
+                metrics["ttfa"] = time.perf_counter() - start_time
+                print(f">> time to first audio: {metrics['ttfa']:.2f} seconds")
+            metrics["audio_length"] += wav.shape[-1] / SAMPLING_RATE
+            yield SAMPLING_RATE, wav.type(torch.int16).squeeze(0).numpy()
+        metrics["total_time"] = time.perf_counter() - start_time
+        if metrics["audio_length"] > 0:
+            metrics["rtf"] = metrics["total_time"] / metrics["audio_length"]
+            print(f">> Total inference time: {metrics['total_time']:.2f} seconds")
+            print(f">> Generated audio length: {metrics['audio_length']:.2f} seconds")
+            print(f">> RTF: {metrics['rtf']:.4f}")
+
+    def infer_batch(self, requests: Sequence[Dict], max_batch_size=8) -> List:
+        """
+        Synthesize several requests for the same speaker and sampling settings, batching their segments
+        through the GPT ``max_batch_size`` rows at a time. Each request is a dict of ``infer`` keyword
+        arguments (plus an optional ``seed``); the results are returned in request order. Requests with a
+        seed are generated one at a time, the others are batched together.
+        Segments found in the segment cache are not generated, and a request whose segments are all
+        cached skips conditioning as well.
+        """
+        start_time = time.perf_counter()
+        if self.low_vram:
+            print(f">> low_vram: running {len(requests)} requests through IndexTTS2.infer")
+            return [self._engine_infer(request) for request in requests]
+        seeded = [request.get("seed") is not None for request in requests]
+        if len(requests) > 1 and any(seeded):
+            # a GPT batch draws all its rows from one RNG stream, so a seeded request runs on its own: its
+            # output (and what the segment cache stores under its seed) does not depend on the other requests
+            results = [None] * len(requests)
+            unseeded = [i for i, s in enumerate(seeded) if not s]
+            if unseeded:
+                for i, wav in zip(unseeded, self.infer_batch([requests[i] for i in unseeded], max_batch_size)):
+                    results[i] = wav
+            for i in (i for i, s in enumerate(seeded) if s):
+                results[i] = self.infer_batch([requests[i]], max_batch_size)[0]
+            return results
+        rows = []  # (request index, segment index, cond, token ids, cache key)
+        wavs: List[Dict[int, torch.Tensor]] = [dict() for _ in requests]
+        sampling, extra, seed, speeds = None, None, None, []
+        cached = 0
+        for r_idx, request in enumerate(requests):
+            segments, request_sampling, request_extra, speed, request_seed = self._split_request(request)
+            speeds.append(speed)
+            if sampling is None:
+                sampling, extra, seed = request_sampling, request_extra, request_seed
+            keys = self.segment_keys(request, segments, request_sampling, request_extra, speed, request_seed)
+            missing = []
+            for s_idx, (seg, key) in enumerate(zip(segments, keys)):
+                wav = self.segment_cache.get(key) if key is not None else None
+                if wav is not None:
+                    wavs[r_idx][s_idx] = wav
+                    cached += 1
+                else:
+                    missing.append((s_idx, seg, key))
+            if missing:
+                cond = self._conditioning(request)
+                rows.extend((r_idx, s_idx, cond, seg, key) for s_idx, seg, key in missing)
+
+        if seed is not None:
+            torch.manual_seed(seed)
+        # longest segments first, so each GPT batch pads as little as possible
+        order = sorted(range(len(rows)), key=lambda i: -len(rows[i][3]))
+        gpt_time = decode_time = 0.0
+        continuous = self.continuous_batching and sampling is not None and sampling["num_beams"] == 1 and not extra
+        if continuous:
+            # one in-flight batch for all rows: slots are refilled as rows stop, across speakers
+            batches = [order] if rows else []
+        else:
+            # rows of one GPT batch must share the same speaker conditioning tensor
+            groups: Dict[int, List[int]] = {}
+            for i in order:
+                groups.setdefault(id(rows[i][2]["spk_cond_emb"]), []).append(i)
+            batches = [group[b:b + max_batch_size] for group in groups.values()
+                       for b in range(0, len(group), max_batch_size)]
+        decoded = []  # (row index, generated)
+        for chunk in batches:
+            m_start_time = time.perf_counter()
+            chunk_conds, chunk_segments = [rows[i][2] for i in chunk], [rows[i][3] for i in chunk]
+            if continuous:
+                generated = self.generate_codes_continuous(chunk_conds, chunk_segments, sampling,
+                                                           max_batch_size=max_batch_size)
+            else:
+                generated = self.generate_codes(chunk_conds, chunk_segments, sampling, **extra)
+            gpt_time += time.perf_counter() - m_start_time
+            decoded.extend(zip(chunk, generated))
+        # decode all rows at once, so the s2mel batches span the GPT batches
+        m_start_time = time.perf_counter()
+        items = [(rows[i][2], gen, speeds[rows[i][0]]) for i, gen in decoded]
+        for (i, _), wav in zip(decoded, self.decode_batch(items) if items else []):
+            r_idx, s_idx, _, _, key = rows[i]
+            wavs[r_idx][s_idx] = wav
+            if key is not None:
+                self.segment_cache.put(key, wav)
+        decode_time += time.perf_counter() - m_start_time
+
+        results = []
+        for r_idx, request in enumerate(requests):
+            segment_wavs = [wavs[r_idx][k] for k in sorted(wavs[r_idx])]
+            results.append(self._finish(segment_wavs, request.get("output_path")))
+        print(f">> batch of {len(requests)} requests, {len(rows) + cached} segments ({cached} cached): "
+              f"gpt {gpt_time:.2f}s, decode {decode_time:.2f}s, total {time.perf_counter() - start_time:.2f}s")
+        if items and self.s2mel_batch_size > 1:
+            metrics = self.last_s2mel_metrics
+            print(f">> s2mel: {metrics['segments']} segments in {metrics['batches']} batches, "
+                  f"padding {metrics['padding_ratio']:.0%}, {metrics['s2mel_frames_per_s']:.1f} frames/s")
+        if continuous and rows:
+            metrics = self.last_batch_metrics
+            print(f">> continuous batching: {metrics['tokens_per_s']:.1f} tokens/s, "
+                  f"slot utilization {metrics['slot_utilization']:.0%} over {metrics['steps']} steps")
+        return results
@@ -1,9 +1,10 @@
 import torch
 from torch import nn
+import torch.nn.functional as F
 import math
 
 from indextts.s2mel.modules.gpt_fast.model import ModelArgs, Transformer
-from indextts.s2mel.modules.wavenet import WN
+from indextts.s2mel.modules.wavenet import WN, reflect_pad_index
 from indextts.s2mel.modules.commons import sequence_mask
 
 from torch.nn.utils import weight_norm
@@ -182,6 +183,80 @@ class DiT(torch.nn.Module):
 
     def setup_caches(self, max_batch_size, max_seq_length):
         self.transformer.setup_caches(max_batch_size, max_seq_length, use_kv_cache=False)
+
+    def embed_timesteps(self, t):
+        """``t_embedder`` and (wavenet final layer) ``t_embedder2`` outputs of the times ``t`` (N,): ((N, D), (N, D2))."""
+        t2 = self.t_embedder2(t) if self.final_layer_type == 'wavenet' else None
+        return self.t_embedder(t), t2
+
+    def prepare_conditioning(self, prompt_x, x_lens, style, cond):
+        """
+        The part of ``forward`` that is the same at every ODE step of a segment, computed once (inference only).
+
+        ``cond_x_merge_linear`` is linear, so its input columns of ``prompt_x``, ``cond_projection(cond)`` and
+        the style are projected here, and only the ``x`` columns are left for each step; the style, constant over
+        time, is projected once per row instead of repeated over T frames. The padding masks and positions are
+        built here too; rows may be right padded segments of different ``x_lens``. Arguments as ``forward``; the
+        result is passed to ``forward_prepared``.
+        """
+        B, _, T = prompt_x.size()
+        weight = self.cond_x_merge_linear.weight
+        cond = self.cond_projection(cond)
+        # input columns of cond_x_merge_linear: x, prompt_x, projected cond, style
+        cond_end = 2 * self.in_channels + cond.size(-1)
+        cond_in = F.linear(torch.cat([prompt_x.transpose(1, 2), cond], dim=-1),
+                           weight[:, self.in_channels:cond_end], self.cond_x_merge_linear.bias)
+        style_token = None
+        if self.transformer_style_condition and not self.style_as_token:
+            cond_in = cond_in + F.linear(style, weight[:, cond_end:])[:, None, :]
+        elif self.style_as_token:
+            style_token = self.style_in(style).unsqueeze(1)
+        seq_len = T + self.style_as_token + self.time_as_token
+        # rows shorter than T (batched segments) are right padded: the masks cover their own length only
+        x_mask = sequence_mask(x_lens + self.style_as_token + self.time_as_token, seq_len).to(prompt_x.device).unsqueeze(1)
+        return {
+            "x_weight": weight[:, :self.in_channels].contiguous(),
+            "cond_in": cond_in,
+            "style_token": style_token,
+            "x_mask": x_mask,
+            "mask": x_mask[:, None, :] if not self.is_causal else None,  # (B, 1, 1, T) key padding mask
+            "input_pos": self.input_pos[:seq_len],
+            "pad_index": (reflect_pad_index(x_lens.expand(B), T, self.wavenet.right_padding())
+                          if self.final_layer_type == 'wavenet' else None),
+        }
+
+    def forward_prepared(self, x, prepared, t1, t2=None):
+        """
+        ``forward`` (no content masking) of the noisy mel ``x`` with the conditioning of ``prepare_conditioning``
+        and the timestep embeddings of ``embed_timesteps``, one row per row of ``x``.
+        """
+        x = x.transpose(1, 2)
+        x_in = F.linear(x, prepared["x_weight"]) + prepared["cond_in"]
+        if prepared["style_token"] is not None:
+            x_in = torch.cat([prepared["style_token"], x_in], dim=1)
+        if self.time_as_token:
+            x_in = torch.cat([t1.unsqueeze(1), x_in], dim=1)
+        x_mask = prepared["x_mask"]
+        x_res = self.transformer(x_in, t1.unsqueeze(1), prepared["input_pos"], prepared["mask"])
+        x_res = x_res[:, 1:] if self.time_as_token else x_res
+        x_res = x_res[:, 1:] if self.style_as_token else x_res
+
+        if self.long_skip_connection:
+            x_res = self.skip_linear(torch.cat([x_res, x], dim=-1))
+        if self.final_layer_type == 'wavenet':
+            x = self.conv1(x_res)
+            x = x.transpose(1, 2)
+            pad_index = prepared["pad_index"]
+            if pad_index is not None:
+                pad_index = pad_index[:, None, :].expand(-1, x.size(1), -1)
+            x = self.wavenet(x, x_mask, g=t2.unsqueeze(2), pad_index=pad_index).transpose(1, 2) + \
+                self.res_projection(x_res)
+            x = self.final_layer(x, t1).transpose(1, 2)
+            x = self.conv2(x)
+        else:
+            x = self.final_mlp(x_res)
+            x = x.transpose(1, 2)
+        return x
         
     def forward(self, x, prompt_x, x_lens, t, style, cond, mask_content=False):
         """
@@ -235,8 +310,9 @@ class DiT(torch.nn.Module):
             
         x_mask = sequence_mask(x_lens + self.style_as_token + self.time_as_token).to(x.device).unsqueeze(1) #torch.Size([1, 1, 1863])True
         input_pos = self.input_pos[:x_in.size(1)]  # (T,) range（0，1863）
-        x_mask_expanded = x_mask[:, None, :].repeat(1, 1, x_in.size(1), 1) if not self.is_causal else None # torch.Size([1, 1, 1863, 1863]
-        x_res = self.transformer(x_in, t1.unsqueeze(1), input_pos, x_mask_expanded) # [2, 1863, 512]
+        # key padding mask: scaled_dot_product_attention broadcasts it over the queries, no T x T mask is built
+        attn_mask = x_mask[:, None, :] if not self.is_causal else None # torch.Size([1, 1, 1, 1863]
+        x_res = self.transformer(x_in, t1.unsqueeze(1), input_pos, attn_mask) # [2, 1863, 512]
         x_res = x_res[:, 1:] if self.time_as_token else x_res
         x_res = x_res[:, 1:] if self.style_as_token else x_res
         
@@ -8,6 +8,17 @@ from indextts.s2mel.modules.commons import sequence_mask
 
 from tqdm import tqdm
 
+CFM_SOLVERS = ("euler", "heun", "midpoint", "dpm")
+T_SCHEDULES = ("uniform", "sway")
+# range of t (0: noise, 1: mel) in which classifier-free guidance runs
+CFG_PRESETS = {
+    "full": (0.0, 1.0),
+    "early": (0.0, 0.5),
+    "middle": (0.25, 0.75),
+}
+CFG_MODES = ("reuse", "skip")
+
+
 class BASECFM(torch.nn.Module, ABC):
     def __init__(
         self,
@@ -26,9 +37,56 @@ class BASECFM(torch.nn.Module, ABC):
             self.zero_prompt_speech_token = args.DiT.zero_prompt_speech_token
         else:
             self.zero_prompt_speech_token = False
+        self.set_solver()
+        self.set_cfg_schedule()
+        self.last_stats = None
+
+    def set_solver(self, solver="euler", t_schedule="uniform", sway_coef=-1.0):
+        """
+        Select the ODE solver and time schedule ``inference`` uses by default.
+
+        Args:
+            solver: ``"euler"`` (1 estimator pass per step), ``"heun"`` / ``"midpoint"`` (2nd order, 2 passes
+                per step) or ``"dpm"`` (DPM-Solver++(2M)-style 2nd-order multistep, 1 pass per step)
+            t_schedule: ``"uniform"`` or ``"sway"`` (F5-TTS sway sampling, ``sway_coef < 0`` puts more steps
+                near the noise end; -1 is ``1 - cos(pi / 2 * t)``)
+        """
+        if solver not in CFM_SOLVERS:
+            raise ValueError(f"Unknown CFM solver {solver!r}, expected one of {CFM_SOLVERS}")
+        if t_schedule not in T_SCHEDULES:
+            raise ValueError(f"Unknown t_span schedule {t_schedule!r}, expected one of {T_SCHEDULES}")
+        self.solver = solver
+        self.t_schedule = t_schedule
+        self.sway_coef = sway_coef
+
+    def set_cfg_schedule(self, preset="full", mode="reuse"):
+        """
+        Select the steps classifier-free guidance runs on (with ``inference_cfg_rate > 0``).
+
+        Args:
+            preset: a key of ``CFG_PRESETS``: guidance only for times in that range of t, where each estimator
+                call runs on the conditional and null inputs; ``"full"`` guides every call
+            mode: outside the range, ``"reuse"`` adds the guidance delta of the last guided call to the
+                conditional velocity, ``"skip"`` uses the conditional velocity alone
+        """
+        if preset not in CFG_PRESETS:
+            raise ValueError(f"Unknown CFG schedule {preset!r}, expected one of {tuple(CFG_PRESETS)}")
+        if mode not in CFG_MODES:
+            raise ValueError(f"Unknown CFG mode {mode!r}, expected one of {CFG_MODES}")
+        self.cfg_schedule = preset
+        self.cfg_mode = mode
+
+    def make_t_span(self, n_timesteps, device=None, t_schedule=None):
+        """``n_timesteps + 1`` times from 0 (noise) to 1 (mel) of the given (or the default) schedule."""
+        t_schedule = t_schedule or self.t_schedule
+        t_span = torch.linspace(0, 1, n_timesteps + 1, device=device)
+        if t_schedule == "sway":
+            t_span = t_span + self.sway_coef * (torch.cos(torch.pi / 2 * t_span) - 1 + t_span)
+        return t_span
 
     @torch.inference_mode()
-    def inference(self, mu, x_lens, prompt, style, f0, n_timesteps, temperature=1.0, inference_cfg_rate=0.5):
+    def inference(self, mu, x_lens, prompt, style, f0, n_timesteps, temperature=1.0, inference_cfg_rate=0.5,
+                  solver=None, t_schedule=None):
         """Forward diffusion
 
         Args:
@@ -43,6 +101,8 @@ class BASECFM(torch.nn.Module, ABC):
             f0: None
             n_timesteps (int): number of diffusion steps
             temperature (float, optional): temperature for scaling noise. Defaults to 1.0.
+            solver (str, optional): ODE solver, see ``set_solver``. Defaults to the one set there (euler).
+            t_schedule (str, optional): time schedule, see ``set_solver``. Defaults to the one set there (uniform).
 
         Returns:
             sample: generated mel-spectrogram
@@ -50,9 +110,103 @@ class BASECFM(torch.nn.Module, ABC):
         """
         B, T = mu.size(0), mu.size(1)
         z = torch.randn([B, self.in_channels, T], device=mu.device) * temperature
-        t_span = torch.linspace(0, 1, n_timesteps + 1, device=mu.device)
-        # t_span = t_span + (-1) * (torch.cos(torch.pi / 2 * t_span) - 1 + t_span)
-        return self.solve_euler(z, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate)
+        t_span = self.make_t_span(n_timesteps, mu.device, t_schedule)
+        solve = getattr(self, f"solve_{solver or self.solver}")
+        return solve(z, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate)
+
+    def _velocity_fn(self, prompt_x, x_lens, style, mu, inference_cfg_rate, t_span):
+        """
+        Estimator of one solve as ``velocity(x, t, t_value)`` (``t`` 0-dim tensor, ``t_value`` the same time as
+        a float), with classifier-free guidance when the rate is > 0.
+
+        Guidance (conditional and null inputs stacked into one estimator batch) only runs at times inside the
+        CFG window of ``set_cfg_schedule``. Outside it the estimator only sees the conditional inputs, and with
+        ``cfg_mode="reuse"`` the last guidance delta ``cond - null`` is added back. Estimator calls and batch
+        rows of the solve are counted in ``self.last_stats``.
+
+        When the estimator supports it (``DiT.prepare_conditioning``), the step-invariant conditioning of the
+        conditional and of the stacked rows is prepared once per solve, and the timestep embeddings of the whole
+        ``t_span`` in one call; other times (midpoints) are embedded on first use.
+        """
+        start, end = CFG_PRESETS[self.cfg_schedule]
+        reuse = self.cfg_mode == "reuse"
+        stats = self.last_stats = {"estimator_calls": 0, "guided_calls": 0, "estimator_rows": 0}
+        last_delta = None
+        prepare = getattr(self.estimator, "prepare_conditioning", None)
+        prepared = {}
+        t_embeddings = {}
+
+        def stacked_inputs():
+            # Stack original and CFG (null) inputs for batched processing
+            return (torch.cat([prompt_x, torch.zeros_like(prompt_x)], dim=0),
+                    torch.cat([style, torch.zeros_like(style)], dim=0),
+                    torch.cat([mu, torch.zeros_like(mu)], dim=0),
+                    # one length broadcasts over the stacked rows, per-row lengths (batched segments) are stacked
+                    x_lens if x_lens is None or x_lens.numel() == 1 else torch.cat([x_lens, x_lens], dim=0))
+
+        def estimate(x, t, t_value, guided):
+            if prepare is None:
+                if guided:
+                    stacked_prompt_x, stacked_style, stacked_mu, stacked_x_lens = stacked_inputs()
+                    stacked_t = torch.cat([t.unsqueeze(0), t.unsqueeze(0)], dim=0)
+                    return self.estimator(torch.cat([x, x], dim=0), stacked_prompt_x, stacked_x_lens, stacked_t,
+                                          stacked_style, stacked_mu)
+                return self.estimator(x, prompt_x, x_lens, t.unsqueeze(0), style, mu)
+            if guided not in prepared:
+                if guided:
+                    stacked_prompt_x, stacked_style, stacked_mu, stacked_x_lens = stacked_inputs()
+                    prepared[guided] = prepare(stacked_prompt_x, stacked_x_lens, stacked_style, stacked_mu)
+                else:
+                    prepared[guided] = prepare(prompt_x, x_lens, style, mu)
+            if t_value not in t_embeddings:
+                t_embeddings[t_value] = self.estimator.embed_timesteps(t.reshape(1))
+            t1, t2 = t_embeddings[t_value]
+            rows = 2 * x.size(0) if guided else x.size(0)
+            t1 = t1.expand(rows, -1)
+            t2 = t2.expand(rows, -1) if t2 is not None else None
+            return self.estimator.forward_prepared(torch.cat([x, x], dim=0) if guided else x, prepared[guided],
+                                                   t1, t2)
+
+        if prepare is not None:
+            # one embedding call for every time of the schedule
+            t1, t2 = self.estimator.embed_timesteps(t_span)
+            for i, t_value in enumerate(t_span.tolist()):
+                t_embeddings[t_value] = (t1[i:i + 1], t2[i:i + 1] if t2 is not None else None)
+
+        def velocity(x, t, t_value):
+            nonlocal last_delta
+            stats["estimator_calls"] += 1
+            if inference_cfg_rate > 0 and start <= t_value <= end:
+                stats["guided_calls"] += 1
+                stats["estimator_rows"] += 2 * x.size(0)
+                # Perform a single forward pass for both original and CFG inputs
+                stacked_dphi_dt = estimate(x, t, t_value, True)
+
+                # Split the output back into the original and CFG components
+                dphi_dt, cfg_dphi_dt = stacked_dphi_dt.chunk(2, dim=0)
+                if reuse:
+                    last_delta = dphi_dt - cfg_dphi_dt
+
+                # Apply CFG formula
+                return (1.0 + inference_cfg_rate) * dphi_dt - inference_cfg_rate * cfg_dphi_dt
+            stats["estimator_rows"] += x.size(0)
+            dphi_dt = estimate(x, t, t_value, False)
+            if inference_cfg_rate > 0 and last_delta is not None:
+                # same as the CFG formula with the null branch moved by as much as the conditional one
+                dphi_dt = dphi_dt + inference_cfg_rate * last_delta
+            return dphi_dt
+
+        return velocity
+
+    def _apply_prompt(self, x, prompt, mu):
+        """Reference mel as the prompt input; the prompt frames of ``x`` (and of ``mu`` if configured) zeroed."""
+        prompt_len = prompt.size(-1)
+        prompt_x = torch.zeros_like(x)
+        prompt_x[..., :prompt_len] = prompt[..., :prompt_len]
+        x[..., :prompt_len] = 0
+        if self.zero_prompt_speech_token:
+            mu[..., :prompt_len] = 0
+        return prompt_x, prompt_len
 
     def solve_euler(self, x, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate=0.5):
         """
@@ -76,34 +230,12 @@ class BASECFM(torch.nn.Module, ABC):
         # Or in future might add like a return_all_steps flag
         sol = []
         # apply prompt
-        prompt_len = prompt.size(-1)
-        prompt_x = torch.zeros_like(x)
-        prompt_x[..., :prompt_len] = prompt[..., :prompt_len]
-        x[..., :prompt_len] = 0
-        if self.zero_prompt_speech_token:
-            mu[..., :prompt_len] = 0
+        prompt_x, prompt_len = self._apply_prompt(x, prompt, mu)
+        velocity = self._velocity_fn(prompt_x, x_lens, style, mu, inference_cfg_rate, t_span)
+        times = t_span.tolist()
         for step in tqdm(range(1, len(t_span))):
             dt = t_span[step] - t_span[step - 1]
-            if inference_cfg_rate > 0:
-                # Stack original and CFG (null) inputs for batched processing
-                stacked_prompt_x = torch.cat([prompt_x, torch.zeros_like(prompt_x)], dim=0)
-                stacked_style = torch.cat([style, torch.zeros_like(style)], dim=0)
-                stacked_mu = torch.cat([mu, torch.zeros_like(mu)], dim=0)
-                stacked_x = torch.cat([x, x], dim=0)
-                stacked_t = torch.cat([t.unsqueeze(0), t.unsqueeze(0)], dim=0)
-
-                # Perform a single forward pass for both original and CFG inputs
-                stacked_dphi_dt = self.estimator(
-                    stacked_x, stacked_prompt_x, x_lens, stacked_t, stacked_style, stacked_mu,
-                )
-
-                # Split the output back into the original and CFG components
-                dphi_dt, cfg_dphi_dt = stacked_dphi_dt.chunk(2, dim=0)
-
-                # Apply CFG formula
-                dphi_dt = (1.0 + inference_cfg_rate) * dphi_dt - inference_cfg_rate * cfg_dphi_dt
-            else:
-                dphi_dt = self.estimator(x, prompt_x, x_lens, t.unsqueeze(0), style, mu)
+            dphi_dt = velocity(x, t, times[step - 1])
 
             x = x + dt * dphi_dt
             t = t + dt
@@ -113,6 +245,83 @@ class BASECFM(torch.nn.Module, ABC):
             x[:, :, :prompt_len] = 0
 
         return sol[-1]
+
+    def solve_heun(self, x, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate=0.5):
+        """
+        Heun (explicit trapezoidal) solver: an Euler predictor, then the average of the velocities at both ends
+        of the step. Second order, two estimator passes per step. Arguments as ``solve_euler``.
+        """
+        prompt_x, prompt_len = self._apply_prompt(x, prompt, mu)
+        velocity = self._velocity_fn(prompt_x, x_lens, style, mu, inference_cfg_rate, t_span)
+        times = t_span.tolist()
+        for step in tqdm(range(1, len(t_span))):
+            t, t_next = t_span[step - 1], t_span[step]
+            dt = t_next - t
+            v = velocity(x, t, times[step - 1])
+            x_pred = x + dt * v
+            x_pred[:, :, :prompt_len] = 0
+            v_next = velocity(x_pred, t_next, times[step])
+            x = x + dt * 0.5 * (v + v_next)
+            x[:, :, :prompt_len] = 0
+        return x
+
+    def solve_midpoint(self, x, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate=0.5):
+        """
+        Explicit midpoint solver: the step is taken with the velocity at a half Euler step. Second order, two
+        estimator passes per step. Arguments as ``solve_euler``.
+        """
+        prompt_x, prompt_len = self._apply_prompt(x, prompt, mu)
+        velocity = self._velocity_fn(prompt_x, x_lens, style, mu, inference_cfg_rate, t_span)
+        times = t_span.tolist()
+        for step in tqdm(range(1, len(t_span))):
+            t, t_next = t_span[step - 1], t_span[step]
+            dt = t_next - t
+            v = velocity(x, t, times[step - 1])
+            x_mid = x + 0.5 * dt * v
+            x_mid[:, :, :prompt_len] = 0
+            v_mid = velocity(x_mid, t + 0.5 * dt, 0.5 * (times[step - 1] + times[step]))
+            x = x + dt * v_mid
+            x[:, :, :prompt_len] = 0
+        return x
+
+    def solve_dpm(self, x, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate=0.5):
+        """
+        DPM-Solver++(2M)-style multistep solver: one estimator pass per step, second order from the second
+        step on by reusing the previous step's data prediction.
+
+        The flow path ``x_t = (1 - (1 - sigma_min) t) x_0 + t x_1`` is a diffusion with ``alpha_t = t`` and
+        ``sigma_t = 1 - (1 - sigma_min) t``; the velocity gives the data prediction
+        ``x_1 = (1 - sigma_min) x_t + sigma_t v``, and the update is exact for the linear part in
+        ``lambda = log(alpha / sigma)``. Arguments as ``solve_euler``.
+        """
+        prompt_x, prompt_len = self._apply_prompt(x, prompt, mu)
+        velocity = self._velocity_fn(prompt_x, x_lens, style, mu, inference_cfg_rate, t_span)
+        times = t_span.tolist()
+        c = 1 - self.sigma_min
+
+        def log_snr(t):
+            return float("-inf") if t <= 0 else torch.tensor(t / (1 - c * t), dtype=torch.float64).log().item()
+
+        prev_data, prev_h = None, None
+        for step in tqdm(range(1, len(times))):
+            t, t_next = times[step - 1], times[step]
+            sigma, sigma_next = 1 - c * t, 1 - c * t_next
+            v = velocity(x, t_span[step - 1], t)
+            data = c * x + sigma * v
+            h = log_snr(t_next) - log_snr(t)
+            # second-order correction once two finite steps in log-SNR are available; the last step (to
+            # sigma_min, a very long step in log-SNR) stays first order, the extrapolation is unstable there
+            if prev_h is not None and prev_h != float("inf") and step < len(times) - 1:
+                r = prev_h / h
+                data_est = (1 + 0.5 / r) * data - (0.5 / r) * prev_data
+            else:
+                data_est = data
+            # x_next = sigma_next / sigma * x - alpha_next * (exp(-h) - 1) * data_est, written without exp(-h)
+            x = (sigma_next / sigma) * x + (t_next - t * sigma_next / sigma) * data_est
+            x[:, :, :prompt_len] = 0
+            prev_data, prev_h = data, h
+        return x
+
     def forward(self, x1, x_lens, prompt_lens, mu, style):
         """Computes diffusion loss
 
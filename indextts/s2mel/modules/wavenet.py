@@ -100,6 +100,20 @@ class DDSConv(nn.Module):
         return x * x_mask
 
 
+def reflect_pad_index(lengths, max_length, extra=0):
+    """
+    (B, T + extra) frame index that reflects each row about its last frame ``lengths[b] - 1`` past its length, like
+    the ``reflect`` padding of ``SConv1d``; None when every row has ``max_length`` frames. ``extra`` frames past T
+    cover the right padding of the convolutions (``WN.right_padding``), so that ``SConv1d``'s own padding of the
+    batch, reflected about frame T - 1, never reaches the window of a shorter row.
+    """
+    if bool((lengths >= max_length).all()):
+        return None
+    positions = torch.arange(max_length + extra, device=lengths.device)[None, :]
+    last = (lengths[:, None] - 1).to(positions.dtype)
+    return torch.where(positions <= last, positions, (2 * last - positions).clamp(min=0))
+
+
 class WN(torch.nn.Module):
     def __init__(self, hidden_channels, kernel_size, dilation_rate, n_layers, gin_channels=0, p_dropout=0, causal=False):
         super(WN, self).__init__()
@@ -135,7 +149,16 @@ class WN(torch.nn.Module):
             res_skip_layer = conv1d_type(hidden_channels, res_skip_channels, 1, norm='weight_norm', causal=causal)
             self.res_skip_layers.append(res_skip_layer)
 
-    def forward(self, x, x_mask, g=None, **kwargs):
+    def right_padding(self):
+        """Largest right padding ``SConv1d`` adds to the input of a dilated convolution (frames)."""
+        return max((l.conv.conv.kernel_size[0] - 1) * l.conv.conv.dilation[0] // 2 for l in self.in_layers)
+
+    def forward(self, x, x_mask, g=None, pad_index=None, **kwargs):
+        """
+        pad_index: optional (B, C, T + right_padding()) frame index for right-padded rows (``reflect_pad_index``):
+            the dilated convolutions then see the reflected end of each row, as with the row alone, instead of its
+            padding
+        """
         output = torch.zeros_like(x)
         n_channels_tensor = torch.IntTensor([self.hidden_channels])
 
@@ -143,7 +166,13 @@ class WN(torch.nn.Module):
             g = self.cond_layer(g)
 
         for i in range(self.n_layers):
-            x_in = self.in_layers[i](x)
+            if pad_index is None:
+                x_in = self.in_layers[i](x)
+            else:
+                # the rows extended past T by this convolution's right padding, cut back to T afterwards
+                conv = self.in_layers[i].conv.conv
+                width = x.size(2) + (conv.kernel_size[0] - 1) * conv.dilation[0] // 2
+                x_in = self.in_layers[i](x.gather(2, pad_index[..., :width]))[..., :x.size(2)]
             if g is not None:
                 cond_offset = i * 2 * self.hidden_channels
                 g_l = g[:, cond_offset:cond_offset + 2 * self.hidden_channels, :]
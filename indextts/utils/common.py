@@ -119,3 +119,43 @@ def safe_log(x: torch.Tensor, clip_val: float = 1e-7) -> torch.Tensor:
         Tensor: Element-wise logarithm of the input tensor with clipping applied.
     """
     return torch.log(torch.clip(x, min=clip_val))
+
+
+def code_lengths(codes: torch.Tensor, stop_token: int) -> torch.Tensor:
+    """Length of each row of ``codes`` (B, T) up to its first ``stop_token``, or T if it has none. Shape (B,)."""
+    is_stop = codes == stop_token
+    first_stop = is_stop.to(torch.uint8).argmax(dim=1)
+    return torch.where(is_stop.any(dim=1), first_stop, codes.size(1))
+
+
+def remove_long_silence(codes: torch.Tensor, stop_token: int, silent_token: int = 52, max_consecutive: int = 30,
+                        max_run: int = 10):
+    """Batched run-length compression of silent codes, without per-token host round-trips.
+
+    Rows are cut at their first ``stop_token``. In rows holding more than ``max_consecutive`` silent tokens,
+    every run of ``silent_token`` is shortened to its first ``max_run`` tokens and the kept codes are moved
+    to the front. Matches ``IndexTTS.remove_long_silence``: if any row was compressed, the tail of every row
+    is filled with ``stop_token``; otherwise the codes are only clipped to the longest row.
+
+    Args:
+        codes (torch.Tensor): Batch of mel codes (B, T).
+    Returns:
+        Tuple[torch.Tensor, torch.Tensor]: compacted codes (B, max(code_lens)) and code_lens (B,).
+    """
+    batch_size, T = codes.shape
+    positions = torch.arange(T, device=codes.device).unsqueeze(0)
+    lengths = code_lengths(codes, stop_token)
+    silent = codes == silent_token
+    fix = silent.sum(dim=1) > max_consecutive  # (B,)
+    # offset of every token inside its silent run: distance to the last non-silent token before it
+    last_other = torch.where(silent, -1, positions).cummax(dim=1).values
+    keep = (positions < lengths.unsqueeze(1)) & (~silent | (positions - last_other <= max_run) | ~fix.unsqueeze(1))
+    code_lens = keep.sum(dim=1)
+    # scatter the kept codes to their compacted positions, everything else to a scratch column
+    target = torch.where(keep, keep.cumsum(dim=1) - 1, T)
+    compacted = torch.full((batch_size, T + 1), stop_token, dtype=codes.dtype, device=codes.device)
+    compacted.scatter_(1, target, codes)
+    codes = torch.where(fix.any(), compacted[:, :T], codes)
+    # the output width is data dependent: one sync per batch
+    max_len = int(code_lens.max()) if batch_size > 0 else 0
+    return codes[:, :max_len], code_lens
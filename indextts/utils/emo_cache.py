@@ -0,0 +1,266 @@
+import os
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence
+
+import torch
+
+from indextts.utils.voice_profile import hash_audio_file
+
+
+class _LRU:
+    def __init__(self, max_entries):
+        self.max_entries = max(1, int(max_entries))
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.data.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        while len(self.data) > self.max_entries:
+            self.data.popitem(last=False)
+
+    def clear(self):
+        self.data.clear()
+
+
+class EmotionCache:
+    """
+    Bounded LRU caches for the emotion-conditioning path of IndexTTS2:
+
+    - ``emo_cond``: w2v-BERT features of emotion reference audios, keyed by file content;
+    - ``emovec``: ``UnifiedVoice.get_emovec`` / ``merge_emovec`` results per (speaker, emo-ref, alpha);
+    - ``blend``: ``emo_matrix``/``spk_matrix`` blends per (speaker style, normalized emotion vector).
+
+    ``IndexTTS2.infer`` itself only remembers the last emotion reference. ``install(tts)`` wraps
+    ``tts.gpt.get_emovec``/``merge_emovec`` and ``find_most_similar_cosine`` with memoized versions,
+    and ``attach(tts, path)`` primes ``cache_emo_cond`` before each call, so a script that cycles
+    through a handful of emotion references or vectors stops recomputing them on every line.
+    Tensors are only memoized once they have been registered under a stable key (see ``register``).
+    The wrappers are bound to one engine at a time; ``uninstall()`` restores the originals and must be
+    called when that engine is released.
+    """
+
+    def __init__(self, max_entries=32):
+        self.emo_cond = _LRU(max_entries)
+        self.emovec = _LRU(max_entries * 4)
+        self.blend = _LRU(max_entries * 4)
+        self.cosine = _LRU(max_entries * 4)
+        self._tensor_keys: Dict[int, tuple] = {}
+        self._path_keys: Dict[str, tuple] = {}
+        self._tts_ref = None
+        # what install() replaced: (gpt, previous instance attributes, module, original cosine function)
+        self._patched = None
+        self._lock = threading.RLock()
+
+    # ---- tensor registry -------------------------------------------------
+    def register(self, tensor: torch.Tensor, key: str):
+        """Associate a conditioning tensor with a content key so results derived from it can be memoized."""
+        with self._lock:
+            if len(self._tensor_keys) > 4 * self.emovec.max_entries:
+                self._tensor_keys = {i: v for i, v in self._tensor_keys.items() if v[0]() is not None}
+            self._tensor_keys[id(tensor)] = (weakref.ref(tensor), key, tensor._version)
+        return tensor
+
+    def key_of(self, tensor) -> Optional[str]:
+        if not isinstance(tensor, torch.Tensor):
+            return None
+        entry = self._tensor_keys.get(id(tensor))
+        if entry is None or entry[0]() is not tensor or entry[2] != tensor._version:
+            return None
+        return entry[1]
+
+    def register_voice(self, tts, voice_key: str):
+        """Register the speaker tensors currently installed in ``tts`` (e.g. by ``VoiceProfileStore.attach``)."""
+        if getattr(tts, "cache_spk_cond", None) is not None:
+            self.register(tts.cache_spk_cond, f"spk:{voice_key}")
+        if getattr(tts, "cache_s2mel_style", None) is not None:
+            self.register(tts.cache_s2mel_style, f"style:{voice_key}")
+
+    # ---- emotion reference conditioning ----------------------------------
+    def _audio_key(self, tts, audio_path: str) -> str:
+        st = os.stat(audio_path)
+        cached = self._path_keys.get(audio_path)
+        if cached is not None and cached[0] == st.st_mtime and cached[1] == st.st_size:
+            return cached[2]
+        key = f"{hash_audio_file(audio_path)}|{getattr(tts, 'max_ref_audio_duration', 15)}"
+        self._path_keys[audio_path] = (st.st_mtime, st.st_size, key)
+        return key
+
+    @torch.no_grad()
+    def _compute_emo_cond(self, tts, audio_path: str, verbose=False) -> torch.Tensor:
+        emo_audio, _ = tts._load_and_cut_audio(audio_path, getattr(tts, "max_ref_audio_duration", 15), verbose, sr=16000)
+        emo_inputs = tts.extract_features(emo_audio, sampling_rate=16000, return_tensors="pt")
+        emo_input_features = emo_inputs["input_features"].to(tts.device)
+        emo_attention_mask = emo_inputs["attention_mask"].to(tts.device)
+        return tts.get_emb(emo_input_features, emo_attention_mask)
+
+    def attach(self, tts, emo_audio_prompt: str, verbose=False) -> str:
+        """
+        Install the emotion conditioning of ``emo_audio_prompt`` into ``tts.cache_emo_cond``.
+        Pass the speaker prompt when no separate emotion reference is used, as ``infer`` does.
+        """
+        key = self._audio_key(tts, emo_audio_prompt)
+        with self._lock:
+            emo_cond_emb = self.emo_cond.get(key)
+        if emo_cond_emb is None:
+            emo_cond_emb = self._compute_emo_cond(tts, emo_audio_prompt, verbose=verbose)
+            with self._lock:
+                self.emo_cond.put(key, emo_cond_emb)
+        self.register(emo_cond_emb, f"emo:{key}")
+        tts.cache_emo_cond = emo_cond_emb
+        tts.cache_emo_audio_prompt = emo_audio_prompt
+        return key
+
+    # ---- emotion vectors ---------------------------------------------------
+    def install(self, tts):
+        """Wrap the emotion-vector entry points of ``tts`` with memoized versions (idempotent)."""
+        if self._tts_ref is not None and self._tts_ref() is tts:
+            return
+        self.uninstall()
+        self._tts_ref = weakref.ref(tts)
+        gpt = tts.gpt
+        orig_get_emovec = type(gpt).get_emovec.__get__(gpt)
+        orig_merge_emovec = type(gpt).merge_emovec.__get__(gpt)
+        cache = self
+
+        def get_emovec(emo_speech_conditioning_latent, emo_cond_lengths):
+            src = cache.key_of(emo_speech_conditioning_latent)
+            if src is None:
+                return orig_get_emovec(emo_speech_conditioning_latent, emo_cond_lengths)
+            key = ("get", src, tuple(emo_cond_lengths.tolist()))
+            with cache._lock:
+                out = cache.emovec.get(key)
+            if out is None:
+                out = orig_get_emovec(emo_speech_conditioning_latent, emo_cond_lengths)
+                with cache._lock:
+                    cache.emovec.put(key, out)
+            return out
+
+        def merge_emovec(speech_conditioning_latent, emo_speech_conditioning_latent, cond_lengths, emo_cond_lengths, alpha=1.0):
+            spk = cache.key_of(speech_conditioning_latent)
+            emo = cache.key_of(emo_speech_conditioning_latent)
+            if spk is None or emo is None:
+                return orig_merge_emovec(speech_conditioning_latent, emo_speech_conditioning_latent,
+                                         cond_lengths, emo_cond_lengths, alpha)
+            key = ("merge", spk, emo, tuple(cond_lengths.tolist()), tuple(emo_cond_lengths.tolist()), float(alpha))
+            with cache._lock:
+                out = cache.emovec.get(key)
+            if out is None:
+                out = orig_merge_emovec(speech_conditioning_latent, emo_speech_conditioning_latent,
+                                        cond_lengths, emo_cond_lengths, alpha)
+                with cache._lock:
+                    cache.emovec.put(key, out)
+            return out
+
+        previous = {name: vars(gpt)[name] for name in ("get_emovec", "merge_emovec") if name in vars(gpt)}
+        # instance attributes shadow the class methods, so merge_emovec's own get_emovec calls hit the cache too
+        gpt.get_emovec = get_emovec
+        gpt.merge_emovec = merge_emovec
+        module, orig_cosine = self._install_cosine(tts)
+        self._patched = (gpt, previous, module, orig_cosine)
+
+    def uninstall(self, tts=None):
+        """Undo ``install``: restore the original entry points and drop the memoized results (no-op if not installed,
+        or installed on an engine other than ``tts``)."""
+        current = self._tts_ref() if self._tts_ref is not None else None
+        if tts is not None and current is not tts:
+            return
+        if self._patched is not None:
+            gpt, previous, module, orig_cosine = self._patched
+            for name in ("get_emovec", "merge_emovec"):
+                if name in previous:
+                    setattr(gpt, name, previous[name])
+                else:
+                    vars(gpt).pop(name, None)
+            wrapper = getattr(module, "find_most_similar_cosine", None) if module is not None else None
+            if orig_cosine is not None and getattr(wrapper, "__wrapped__", None) is orig_cosine:
+                setattr(module, "find_most_similar_cosine", orig_cosine)
+        self._patched = None
+        self._tts_ref = None
+        with self._lock:
+            self.emovec.clear()
+            self.blend.clear()
+            self.cosine.clear()
+
+    def _install_cosine(self, tts):
+        """
+        Memoize ``find_most_similar_cosine`` of the engine's module. The function is a module global, so the wrapper
+        only memoizes queries against the ``spk_matrix`` of the installed engine and passes anything else through.
+        This relies on ``IndexTTS2.infer`` resolving the name in its module dict at call time: true for plain
+        Python and for Cython modules, where names that are not ``cdef``/``cimport``-ed are looked up in the module
+        dict on each use. Returns ``(module, original)``, ``(None, None)`` when nothing was patched.
+        """
+        module = sys.modules.get(type(tts).__module__)
+        if module is None or not callable(getattr(module, "find_most_similar_cosine", None)):
+            return None, None
+        orig = getattr(module, "find_most_similar_cosine")
+        if getattr(orig, "__wrapped__", None) is not None:
+            return None, None  # wrapped by another EmotionCache, which restores it itself
+        cache = self
+
+        def find_most_similar_cosine(query_vector, matrix):
+            src = cache.key_of(query_vector)
+            current = cache._tts_ref() if cache._tts_ref is not None else None
+            index = None
+            if src is not None and current is not None:
+                for i, m in enumerate(current.spk_matrix):
+                    if m is matrix:
+                        index = i
+                        break
+            if index is None:
+                return orig(query_vector, matrix)
+            key = (src, index)
+            with cache._lock:
+                out = cache.cosine.get(key)
+            if out is None:
+                out = orig(query_vector, matrix)
+                with cache._lock:
+                    cache.cosine.put(key, out)
+            return out
+
+        find_most_similar_cosine.__wrapped__ = orig
+        setattr(module, "find_most_similar_cosine", find_most_similar_cosine)
+        return module, orig
+
+    @torch.no_grad()
+    def emo_blend(self, tts, style: torch.Tensor, emo_vector: Sequence[float]) -> torch.Tensor:
+        """
+        ``emovec_mat`` of ``IndexTTS2.infer`` for a ``normalize_emo_vec`` output: the weighted sum of the
+        ``emo_matrix`` rows whose ``spk_matrix`` entries are closest to the speaker ``style``.
+        """
+        module = sys.modules.get(type(tts).__module__)
+        src = self.key_of(style)
+        key = None
+        if src is not None:
+            key = (src, tuple(float(w) for w in emo_vector))
+            with self._lock:
+                out = self.blend.get(key)
+            if out is not None:
+                return out
+        weight_vector = torch.tensor(list(emo_vector), device=tts.device)
+        find = getattr(module, "find_most_similar_cosine")
+        index = [find(style, tmp) for tmp in tts.spk_matrix]
+        emo_matrix = torch.cat([tmp[i].unsqueeze(0) for i, tmp in zip(index, tts.emo_matrix)], 0)
+        out = torch.sum(weight_vector.unsqueeze(1) * emo_matrix, 0).unsqueeze(0)
+        if key is not None:
+            with self._lock:
+                self.blend.put(key, out)
+        return out
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {name: {"hits": lru.hits, "misses": lru.misses, "entries": len(lru.data)}
+                for name, lru in (("emo_cond", self.emo_cond), ("emovec", self.emovec),
+                                  ("blend", self.blend), ("cosine", self.cosine))}
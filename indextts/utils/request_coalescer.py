@@ -0,0 +1,168 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, Hashable, Iterator, List, Sequence
+
+
+class _Request:
+    __slots__ = ("key", "payload", "future", "arrival")
+
+    def __init__(self, key, payload):
+        self.key = key
+        self.payload = payload
+        self.future = Future()
+        self.arrival = time.perf_counter()
+
+
+class RequestCoalescer:
+    """
+    Collect requests that arrive within ``window_ms`` of each other and share a key (speaker and
+    sampling settings), then run them through ``run_batch`` together on a single worker thread.
+
+    ``run_batch(payloads)`` must return one result per payload, in order. The worker thread is the only
+    thread that calls it, so the model behind it does not need to be thread-safe.
+    """
+
+    def __init__(self, run_batch: Callable[[Sequence[Dict]], List], window_ms=50, max_batch_size=8):
+        self.run_batch = run_batch
+        self.window = max(0.0, float(window_ms)) / 1000.0
+        self.max_batch_size = max(1, int(max_batch_size))
+        self._queue: "queue.Queue[_Request]" = queue.Queue()
+        self._pending: List[_Request] = []
+        self.batches = 0
+        self.requests = 0
+        self._worker = threading.Thread(target=self._loop, name="RequestCoalescer", daemon=True)
+        self._worker.start()
+
+    def submit(self, key: Hashable, payload: Dict) -> Future:
+        request = _Request(key, payload)
+        self._queue.put(request)
+        return request.future
+
+    def __call__(self, key: Hashable, payload: Dict):
+        """Submit and block until the result is ready."""
+        return self.submit(key, payload).result()
+
+    def _collect(self) -> List[_Request]:
+        if not self._pending:
+            self._pending.append(self._queue.get())
+        head = self._pending[0]
+        deadline = head.arrival + self.window
+        while sum(1 for r in self._pending if r.key == head.key) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                self._pending.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        # drain whatever already arrived without waiting any longer
+        while True:
+            try:
+                self._pending.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        batch = [r for r in self._pending if r.key == head.key][:self.max_batch_size]
+        self._pending = [r for r in self._pending if r not in batch]
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            batch = [r for r in batch if r.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            self.batches += 1
+            self.requests += len(batch)
+            try:
+                results = self._run(batch)
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0].future.set_exception(e)
+                    continue
+                # one bad request (e.g. a missing prompt file) must not fail the others: run each on its own
+                print(f">> RequestCoalescer: batch of {len(batch)} failed ({e}), retrying one by one")
+                for r in batch:
+                    try:
+                        r.future.set_result(self._run([r])[0])
+                    except Exception as e:
+                        r.future.set_exception(e)
+                continue
+            for r, result in zip(batch, results):
+                r.future.set_result(result)
+
+    def _run(self, batch: List[_Request]) -> List:
+        results = self.run_batch([r.payload for r in batch])
+        if results is None or len(results) != len(batch):
+            count = "no" if results is None else len(results)
+            raise RuntimeError(f"run_batch returned {count} results for {len(batch)} requests")
+        return results
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "avg_batch": self.requests / self.batches if self.batches else 0.0,
+        }
+
+
+class _StreamError:
+    def __init__(self, error):
+        self.error = error
+
+
+_STREAM_END = object()
+
+
+def locked_stream(produce: Callable[[], Iterator], lock) -> Iterator:
+    """
+    Iterate the generator ``produce()`` on a dedicated thread that holds ``lock`` for the whole stream,
+    handing its items over through a queue. Gradio and Starlette step sync generators on arbitrary pool
+    threads, so the lock must never be held across a ``yield`` of the generator they iterate. A consumer
+    that stops early (client disconnect) stops the producer before its next item, which then releases the lock.
+    """
+    # a couple of items ahead at most: an abandoned stream must not keep the lock to finish the whole text
+    items = queue.Queue(maxsize=2)
+    cancelled = threading.Event()
+
+    def put(item):
+        while not cancelled.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def run():
+        try:
+            with lock:
+                stream = iter(produce())
+                try:
+                    # checked before each item, so an abandoned stream stops without computing another one
+                    while not cancelled.is_set():
+                        try:
+                            item = next(stream)
+                        except StopIteration:
+                            break
+                        put(item)
+                finally:
+                    close = getattr(stream, "close", None)
+                    if close is not None:
+                        close()
+        except BaseException as e:
+            put(_StreamError(e))
+        finally:
+            put(_STREAM_END)
+
+    threading.Thread(target=run, name="tts-stream", daemon=True).start()
+    try:
+        while True:
+            item = items.get()
+            if item is _STREAM_END:
+                return
+            if isinstance(item, _StreamError):
+                raise item.error
+            yield item
+    finally:
+        cancelled.set()
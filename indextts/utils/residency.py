@@ -0,0 +1,226 @@
+import gc
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import torch
+import torch.nn as nn
+
+
+def _iter_modules(obj, depth=2, _seen=None):
+    """Yield the ``nn.Module`` attributes of a model wrapper (IndexTTS2, Qwen3TTS, ...), looking ``depth`` levels deep."""
+    if _seen is None:
+        _seen = set()
+    if obj is None or id(obj) in _seen:
+        return
+    _seen.add(id(obj))
+    if isinstance(obj, nn.Module):
+        yield obj
+        return
+    if depth <= 0 or not hasattr(obj, "__dict__"):
+        return
+    for value in vars(obj).values():
+        if isinstance(value, (nn.Module,)) or (hasattr(value, "__dict__") and not isinstance(value, (type, torch.Tensor))):
+            yield from _iter_modules(value, depth - 1, _seen)
+
+
+def _is_tensor_sequence(value) -> bool:
+    # plain lists and tuples only: IndexTTS2 keeps emo_matrix / spk_matrix as tuples of tensors
+    return type(value) in (list, tuple) and len(value) > 0 and all(isinstance(v, torch.Tensor) for v in value)
+
+
+def _tensor_attributes(obj):
+    """Plain tensor attributes (and lists / tuples of tensors) of a wrapper object."""
+    for name, value in list(vars(obj).items()):
+        if isinstance(value, torch.Tensor) or _is_tensor_sequence(value):
+            yield name, value
+
+
+def _module_device(module):
+    for t in module.parameters():
+        return t.device
+    for t in module.buffers():
+        return t.device
+    return None
+
+
+def record_placement(obj) -> Dict:
+    """
+    Device of every module and tensor attribute of a wrapper as it was built. ``low_vram`` engines keep
+    some sub-models on the CPU on purpose; promoting restores this placement instead of moving everything.
+    """
+    placement = {"modules": [(module, _module_device(module)) for module in _iter_modules(obj)], "tensors": {}}
+    if hasattr(obj, "__dict__"):
+        for name, value in _tensor_attributes(obj):
+            placement["tensors"][name] = (value.device if isinstance(value, torch.Tensor)
+                                          else [v.device for v in value])
+    return placement
+
+
+def _move_tensors(obj, device, placement=None):
+    recorded = placement["tensors"] if placement is not None else {}
+    for name, value in _tensor_attributes(obj):
+        devices = recorded.get(name)
+        if isinstance(value, torch.Tensor):
+            setattr(obj, name, value.to(devices if isinstance(devices, torch.device) else device))
+        else:
+            # tensors set after loading (per-request caches, a resized list) go to ``device``
+            if not isinstance(devices, list) or len(devices) != len(value):
+                devices = [device] * len(value)
+            setattr(obj, name, type(value)(v.to(d) for v, d in zip(value, devices)))
+
+
+def module_nbytes(obj) -> int:
+    total = 0
+    for module in _iter_modules(obj):
+        for t in list(module.parameters()) + list(module.buffers()):
+            total += t.numel() * t.element_size()
+    return total
+
+
+def move_wrapper(obj, device, placement=None):
+    """Move a wrapper to ``device``, or with ``placement`` (``record_placement``) back to the recorded devices."""
+    device = torch.device(device)
+    recorded = {id(module): d for module, d in placement["modules"]} if placement is not None else {}
+    for module in _iter_modules(obj):
+        module.to(recorded.get(id(module)) or device)
+    if hasattr(obj, "__dict__"):
+        _move_tensors(obj, device, placement)
+
+
+class _Entry:
+    def __init__(self, name, factory, lock, unload):
+        self.name = name
+        self.factory = factory
+        self.lock = lock
+        self.unload = unload
+        self.instance = None
+        self.state = "unloaded"  # unloaded | cpu | device
+        self.nbytes = 0
+        self.placement = None  # record_placement() of the instance as built
+        self.last_used = 0.0
+
+
+class ModelResidencyManager:
+    """
+    Keep several large models alive in one process and move them between the accelerator and host
+    memory instead of deleting and rebuilding them.
+
+    ``acquire(name)`` loads a model on first use and promotes it back to the placement it was built
+    with (sub-models a ``low_vram`` engine keeps on the CPU stay there); to stay within
+    ``budget_gb`` of device memory, idle models are demoted to the CPU, least recently used first
+    (``budget_gb=0`` keeps a single model on the device). A model is idle when its lock is free, so a
+    model that is generating is never moved. Every load and swap is timed and reported.
+    """
+
+    def __init__(self, device=None, budget_gb=0.0):
+        if device is None:
+            device = "cuda:0" if torch.cuda.is_available() else "cpu"
+        self.device = torch.device(device)
+        self.budget = int(float(budget_gb) * (1 << 30))
+        self._entries: Dict[str, _Entry] = {}
+        self._lock = threading.RLock()
+        self.swaps: List[Dict] = []
+
+    def register(self, name: str, factory: Callable, lock=None, instance=None, unload: Optional[Callable] = None):
+        """
+        ``factory()`` builds the model on the device; ``lock`` is held by whoever is using it.
+        Pass ``instance`` for a model that has already been built.
+        """
+        entry = _Entry(name, factory, lock or threading.RLock(), unload)
+        if instance is not None:
+            entry.instance = instance
+            entry.state = "device"
+            entry.nbytes = module_nbytes(instance)
+            entry.placement = record_placement(instance)
+            entry.last_used = time.perf_counter()
+        self._entries[name] = entry
+        return entry.lock
+
+    def lock(self, name: str):
+        return self._entries[name].lock
+
+    def _record(self, entry, old_state, new_state, seconds):
+        swap = {"model": entry.name, "from": old_state, "to": new_state, "seconds": round(seconds, 3),
+                "size_gb": round(entry.nbytes / (1 << 30), 2)}
+        self.swaps.append(swap)
+        del self.swaps[:-50]
+        print(f">> Residency: {entry.name} {old_state} -> {new_state} in {seconds:.2f}s ({swap['size_gb']} GB)")
+
+    def _empty_cache(self):
+        gc.collect()
+        if self.device.type == "cuda" and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        elif self.device.type == "mps" and torch.backends.mps.is_available():
+            torch.mps.empty_cache()
+
+    def _demote(self, entry: _Entry) -> bool:
+        if entry.state != "device" or self.device.type == "cpu":
+            return False
+        if not entry.lock.acquire(blocking=False):
+            return False  # busy: never move a model that is in use
+        try:
+            start = time.perf_counter()
+            move_wrapper(entry.instance, "cpu")
+            self._empty_cache()
+            entry.state = "cpu"
+            self._record(entry, "device", "cpu", time.perf_counter() - start)
+            return True
+        finally:
+            entry.lock.release()
+
+    def _make_room(self, target: _Entry):
+        others = sorted((e for e in self._entries.values() if e is not target and e.state == "device"),
+                        key=lambda e: e.last_used)
+        for entry in others:
+            resident = sum(e.nbytes for e in self._entries.values() if e.state == "device" and e is not target)
+            if self.budget > 0 and resident + target.nbytes <= self.budget:
+                break
+            if not self._demote(entry):
+                print(f">> Residency: {entry.name} is busy, keeping it on {self.device}")
+
+    def acquire(self, name: str):
+        """Return the model ``name`` resident on the device, loading or promoting it if needed."""
+        with self._lock:
+            entry = self._entries[name]
+            entry.last_used = time.perf_counter()
+            if entry.state == "device":
+                return entry.instance
+            if entry.state == "unloaded":
+                # make room using the previous size estimate (0 on the first load)
+                self._make_room(entry)
+                start = time.perf_counter()
+                entry.instance = entry.factory()
+                entry.nbytes = module_nbytes(entry.instance)
+                entry.placement = record_placement(entry.instance)
+                entry.state = "device"
+                self._record(entry, "unloaded", "device", time.perf_counter() - start)
+                return entry.instance
+            self._make_room(entry)
+            start = time.perf_counter()
+            # back to the placement the model was built with, not every sub-model onto the device
+            move_wrapper(entry.instance, self.device, entry.placement)
+            entry.state = "device"
+            self._record(entry, "cpu", "device", time.perf_counter() - start)
+            return entry.instance
+
+    def unload(self, name: str):
+        """Destroy a model completely (the old behaviour); it is rebuilt on the next ``acquire``."""
+        with self._lock:
+            entry = self._entries[name]
+            with entry.lock:
+                if entry.instance is not None and entry.unload is not None:
+                    entry.unload(entry.instance)
+                entry.instance = None
+                entry.placement = None
+                entry.state = "unloaded"
+            self._empty_cache()
+
+    def stats(self) -> Dict:
+        return {
+            "device": str(self.device),
+            "budget_gb": round(self.budget / (1 << 30), 2),
+            "models": {e.name: {"state": e.state, "size_gb": round(e.nbytes / (1 << 30), 2)}
+                       for e in self._entries.values()},
+            "recent_swaps": self.swaps[-10:],
+        }
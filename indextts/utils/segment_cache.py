@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import numpy as np
+import torch
+
+SEGMENT_CACHE_FORMAT_VERSION = "1"
+
+
+def segment_cache_key(*parts) -> str:
+    """Stable key of a segment from JSON-serializable parts (token ids, voice hash, emotion, sampling, ...)."""
+    payload = json.dumps([SEGMENT_CACHE_FORMAT_VERSION, *parts], sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class SegmentAudioCache:
+    """
+    Disk cache of synthesized segment audio, keyed by everything that determines it (normalized text
+    tokens, voice profile, emotion inputs, speaking speed, sampling settings and seed).
+
+    Each segment is stored as int16 PCM in ``<cache_dir>/<key[:2]>/<key>.npy``. The total size is
+    bounded by ``max_bytes``; least recently used segments are evicted first, and the order survives
+    restarts through the file modification times.
+    """
+
+    def __init__(self, cache_dir="segment_cache", max_bytes=1 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_bytes)
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._scan()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.npy")
+
+    def _scan(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".npy"):
+                    st = os.stat(os.path.join(root, name))
+                    entries.append((st.st_mtime, name[:-4], st.st_size))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._size += size
+        self._evict()
+
+    def _evict(self):
+        while self._size > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self._size -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def get(self, key: str) -> Optional[torch.Tensor]:
+        """Cached waveform of a segment as a float tensor (1, samples), or None."""
+        with self._lock:
+            if key not in self._index:
+                self.misses += 1
+                return None
+            path = self._path(key)
+            try:
+                pcm = np.load(path)
+                os.utime(path)
+            except (OSError, ValueError):
+                self._size -= self._index.pop(key)
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+            self.hits += 1
+        return torch.from_numpy(pcm.astype(np.float32)).unsqueeze(0)
+
+    def put(self, key: str, wav: torch.Tensor):
+        """Store the waveform (1, samples) of a segment, as returned by ``IndexTTS2Pipeline.decode``."""
+        # same truncation as the final int16 conversion, so cached and fresh segments are identical
+        pcm = wav.detach().reshape(-1).cpu().type(torch.int16).numpy()
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, pcm)
+        os.replace(tmp, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            if key in self._index:
+                self._size -= self._index.pop(key)
+            self._index[key] = size
+            self._size += size
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._index):
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+            self._index.clear()
+            self._size = 0
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._index),
+            "size_mb": round(self._size / (1 << 20), 1),
+            "evictions": self.evictions,
+        }
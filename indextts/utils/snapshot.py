@@ -0,0 +1,457 @@
+"""
+Inference snapshot for IndexTTS2.
+
+A normal start builds every sub-model and reads each checkpoint (gpt.pth, s2mel.pth, the BigVGAN and
+w2v-BERT weights from the HF cache, wav2vec2bert_stats.pt, CAMPPlus, the semantic codec, feat1/feat2 and
+the qwen emo model) with a full ``torch.load`` copy. ``compile_snapshot`` writes the fully built engine
+once, as:
+
+- ``weights.pt``: every tensor of the engine in a single file, in the dtype it runs in, with weight norm
+  already folded, saved in torch's zip format so that it can be opened with ``torch.load(mmap=True)``;
+- ``skeleton.pkl``: the engine object graph with every tensor replaced by a reference into ``weights.pt``;
+- ``manifest.json``: format version, build options, source checkpoint fingerprints, per-component sizes
+  and the startup report.
+
+``load_snapshot`` rebuilds the engine without running ``IndexTTS2.__init__``: tensors are mapped straight
+from the page cache (zero-copy on CPU, one host-to-device copy otherwise).
+
+Usage::
+
+    python -m indextts.utils.snapshot --model_dir checkpoints --fp16
+    python webui.py --snapshot checkpoints/snapshot
+"""
+import collections
+import gc
+import io
+import json
+import os
+import pickle
+import sys
+import time
+from typing import Dict, Optional
+
+import torch
+import torch.nn as nn
+
+# bumped whenever a pickled class gains attributes in __init__ (2: static and prefix KV cache on GPT2InferenceModel,
+# 3: speculative decoder on UnifiedVoice, 4: beam search on UnifiedVoice, 5: UnifiedVoice.last_generation,
+# 6: fused sampling decoder on UnifiedVoice, 7: solver and t_span schedule on the s2mel CFM,
+# 8: CFG schedule on the s2mel CFM)
+SNAPSHOT_FORMAT_VERSION = "8"
+WEIGHTS_FILE = "weights.pt"
+SKELETON_FILE = "skeleton.pkl"
+MANIFEST_FILE = "manifest.json"
+
+# Cache slots of IndexTTS2 that hold per-request tensors; they are not part of the snapshot
+CACHE_ATTRIBUTES = ("cache_spk_cond", "cache_s2mel_style", "cache_s2mel_prompt", "cache_mel",
+                    "cache_spk_audio_prompt", "cache_emo_cond", "cache_emo_audio_prompt")
+# Checkpoint files that IndexTTS2.__init__ reads from model_dir (config key -> attribute), for the "before" report
+CHECKPOINT_COMPONENTS = {"gpt_checkpoint": "gpt", "s2mel_checkpoint": "s2mel", "w2v_stat": "semantic_mean",
+                         "emo_matrix": "emo_matrix", "spk_matrix": "spk_matrix"}
+_SOURCE_SUFFIXES = (".pth", ".pt", ".bin", ".safetensors", ".yaml", ".json", ".model")
+
+
+def _rebuild_mel_fn(tts):
+    from indextts.s2mel.modules.audio import mel_spectrogram
+
+    params = tts.cfg.s2mel["preprocess_params"]
+    spect = params["spect_params"]
+    mel_fn_args = {
+        "n_fft": spect["n_fft"],
+        "win_size": spect["win_length"],
+        "hop_size": spect["hop_length"],
+        "num_mels": spect["n_mels"],
+        "sampling_rate": params["sr"],
+        "fmin": spect.get("fmin", 0),
+        "fmax": None if spect.get("fmax", "None") == "None" else 8000,
+        "center": False,
+    }
+    return lambda x: mel_spectrogram(x, **mel_fn_args)
+
+
+def _rebuild_normalizer(tts):
+    from indextts.utils.front import TextNormalizer
+
+    normalizer = TextNormalizer()
+    normalizer.load()
+    return normalizer
+
+
+def _rebuild_tokenizer(tts):
+    from indextts.utils.front import TextTokenizer
+
+    return TextTokenizer(tts.bpe_path, tts.normalizer)
+
+
+def _rebuild_qwen_emo(tts):
+    from indextts.infer_v2 import QwenEmotion
+
+    return QwenEmotion(os.path.join(tts.model_dir, tts.cfg.qwen_emo_path))
+
+
+# Attributes that cannot be pickled (closures, native text-normalizer graphs, ...) are rebuilt on load,
+# in this order
+REBUILDERS = {
+    "mel_fn": _rebuild_mel_fn,
+    "normalizer": _rebuild_normalizer,
+    "tokenizer": _rebuild_tokenizer,
+    "qwen_emo": _rebuild_qwen_emo,
+}
+
+
+def fold_weight_norm(module: nn.Module) -> int:
+    """Bake weight-norm reparametrizations into plain weights. Returns the number of layers folded."""
+    from torch.nn.utils import parametrize
+
+    folded = 0
+    for m in module.modules():
+        if parametrize.is_parametrized(m, "weight") and hasattr(m.parametrizations.weight, "original0"):
+            parametrize.remove_parametrizations(m, "weight", leave_parametrized=True)
+            folded += 1
+        elif hasattr(m, "weight_g") and hasattr(m, "weight_v"):
+            try:
+                nn.utils.remove_weight_norm(m)
+                folded += 1
+            except ValueError:
+                pass
+    return folded
+
+
+def source_fingerprint(model_dir: str) -> Dict[str, list]:
+    """Size and mtime of the checkpoint files directly under ``model_dir``."""
+    fingerprint = {}
+    if not os.path.isdir(model_dir):
+        return fingerprint
+    for name in sorted(os.listdir(model_dir)):
+        path = os.path.join(model_dir, name)
+        if os.path.isfile(path) and name.endswith(_SOURCE_SUFFIXES):
+            st = os.stat(path)
+            fingerprint[name] = [st.st_size, int(st.st_mtime)]
+    return fingerprint
+
+
+_NAMEDTUPLES = {}
+
+
+def _namedtuple_class(typename, fields):
+    key = (typename, tuple(fields))
+    if key not in _NAMEDTUPLES:
+        _NAMEDTUPLES[key] = collections.namedtuple(typename, fields)
+    return _NAMEDTUPLES[key]
+
+
+def _namedtuple_instance(typename, fields, values):
+    return _namedtuple_class(typename, fields)(*values)
+
+
+def _is_local_namedtuple(cls) -> bool:
+    if not (isinstance(cls, type) and issubclass(cls, tuple) and hasattr(cls, "_fields")):
+        return False
+    module = sys.modules.get(cls.__module__)
+    return getattr(module, cls.__qualname__, None) is not cls
+
+
+class _SkeletonPickler(pickle.Pickler):
+    """Pickles an object graph with every tensor replaced by a key into a shared tensor table."""
+
+    def __init__(self, file, tensors: Dict[str, torch.Tensor], devices: Dict[str, str], seen: Dict[int, str]):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.tensors = tensors
+        self.devices = devices
+        self.seen = seen
+
+    def persistent_id(self, obj):
+        if not isinstance(obj, torch.Tensor):
+            return None
+        key = self.seen.get(id(obj))
+        if key is None:
+            key = f"t{len(self.tensors)}"
+            self.seen[id(obj)] = key
+            # keep the original alive so that its id() is not reused while pickling
+            self.tensors[key] = (obj, obj.detach().to("cpu").contiguous())
+            self.devices[key] = str(obj.device)
+        return ("tensor", key, isinstance(obj, nn.Parameter), bool(obj.requires_grad))
+
+    def reducer_override(self, obj):
+        # namedtuple classes created inside functions (e.g. the perceiver attention config) are not importable
+        if _is_local_namedtuple(obj):
+            return _namedtuple_class, (obj.__name__, obj._fields)
+        if _is_local_namedtuple(type(obj)):
+            return _namedtuple_instance, (type(obj).__name__, type(obj)._fields, tuple(obj))
+        return NotImplemented
+
+
+class _SkeletonUnpickler(pickle.Unpickler):
+    def __init__(self, file, resolve):
+        super().__init__(file)
+        self.resolve = resolve
+
+    def persistent_load(self, pid):
+        _, key, is_param, requires_grad = pid
+        return self.resolve(key, is_param, requires_grad)
+
+
+def _nbytes(obj, seen) -> int:
+    total = 0
+    modules = [obj] if isinstance(obj, nn.Module) else []
+    if not modules and hasattr(obj, "__dict__"):
+        modules = [v for v in vars(obj).values() if isinstance(v, nn.Module)]
+    for module in modules:
+        for t in list(module.parameters()) + list(module.buffers()):
+            if id(t) not in seen:
+                seen.add(id(t))
+                total += t.numel() * t.element_size()
+    for t in (obj if isinstance(obj, (list, tuple)) else [obj]):
+        if isinstance(t, torch.Tensor) and id(t) not in seen:
+            seen.add(id(t))
+            total += t.numel() * t.element_size()
+    return total
+
+
+def _describe(obj):
+    module = obj if isinstance(obj, nn.Module) else None
+    if module is None and hasattr(obj, "__dict__"):
+        module = next((v for v in vars(obj).values() if isinstance(v, nn.Module)), None)
+    tensor = obj if isinstance(obj, torch.Tensor) else None
+    if isinstance(obj, (list, tuple)) and obj and isinstance(obj[0], torch.Tensor):
+        tensor = obj[0]
+    if module is not None:
+        tensor = next(iter(list(module.parameters()) + list(module.buffers())), None)
+    if tensor is None:
+        return None, None
+    return str(tensor.device), str(tensor.dtype).replace("torch.", "")
+
+
+@torch.no_grad()
+def compile_snapshot(tts, output_dir: str, options: Optional[Dict] = None, baseline: Optional[Dict] = None) -> Dict:
+    """
+    Write ``tts`` as an inference snapshot to ``output_dir`` and return the manifest.
+
+    Weight norm is folded into the live modules first (outputs are unchanged), so ``tts`` stays usable.
+    ``options`` records the flags the engine was built with (use_fp16, low_vram, ...) so that a snapshot
+    built with different flags is not picked up; ``baseline`` is the startup report of the normal load.
+    """
+    start = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    state = dict(vars(tts))
+    for name in CACHE_ATTRIBUTES:
+        if name in state:
+            state[name] = None
+
+    folded = 0
+    for value in state.values():
+        if isinstance(value, nn.Module):
+            folded += fold_weight_norm(value)
+
+    tensors, devices, seen = {}, {}, {}
+    skeleton, components, rebuild = {}, {}, []
+    counted = set()
+    for name, value in state.items():
+        buf = io.BytesIO()
+        try:
+            _SkeletonPickler(buf, tensors, devices, seen).dump(value)
+        except Exception as e:
+            if name not in REBUILDERS:
+                raise RuntimeError(f"Cannot snapshot attribute '{name}' ({type(value).__name__}): {e}") from e
+            rebuild.append(name)
+            continue
+        skeleton[name] = buf.getvalue()
+        nbytes = _nbytes(value, counted)
+        if nbytes:
+            device, dtype = _describe(value)
+            components[name] = {"size_mb": round(nbytes / (1 << 20), 1), "device": device, "dtype": dtype}
+
+    weights_path = os.path.join(output_dir, WEIGHTS_FILE)
+    torch.save({key: cpu for key, (_, cpu) in tensors.items()}, weights_path + ".tmp")
+    os.replace(weights_path + ".tmp", weights_path)
+    skeleton_path = os.path.join(output_dir, SKELETON_FILE)
+    with open(skeleton_path + ".tmp", "wb") as f:
+        pickle.dump({"class": type(tts), "attributes": skeleton, "devices": devices}, f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(skeleton_path + ".tmp", skeleton_path)
+
+    manifest = {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "torch_version": torch.__version__,
+        "model_dir": os.path.abspath(getattr(tts, "model_dir", "")),
+        "model_version": getattr(tts, "model_version", None),
+        "options": dict(options or {}),
+        "source": source_fingerprint(getattr(tts, "model_dir", "")),
+        "weight_norm_folded": folded,
+        "tensors": len(tensors),
+        "size_mb": round(os.path.getsize(weights_path) / (1 << 20), 1),
+        "components": components,
+        "rebuild": [name for name in REBUILDERS if name in rebuild],
+        "compile_seconds": round(time.perf_counter() - start, 2),
+        "startup_report": {"before": baseline or {}},
+    }
+    write_manifest(output_dir, manifest)
+    print(f">> Snapshot written to {output_dir}: {len(tensors)} tensors, {manifest['size_mb']} MB, "
+          f"{folded} weight-norm layers folded, rebuilt on load: {manifest['rebuild']}")
+    return manifest
+
+
+def read_manifest(snapshot_dir: str) -> Optional[Dict]:
+    path = os.path.join(snapshot_dir, MANIFEST_FILE)
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_manifest(snapshot_dir: str, manifest: Dict):
+    path = os.path.join(snapshot_dir, MANIFEST_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def snapshot_is_current(snapshot_dir: str, model_dir: str, **options) -> bool:
+    """
+    True if ``snapshot_dir`` holds a snapshot built from the current checkpoints in ``model_dir``
+    with the same build ``options`` (e.g. ``use_fp16=True, low_vram=False``).
+    """
+    manifest = read_manifest(snapshot_dir)
+    if manifest is None or manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+        return False
+    for name in (WEIGHTS_FILE, SKELETON_FILE):
+        if not os.path.isfile(os.path.join(snapshot_dir, name)):
+            return False
+    if manifest.get("torch_version", "").split("+")[0] != torch.__version__.split("+")[0]:
+        return False
+    if manifest.get("source") != source_fingerprint(model_dir):
+        return False
+    built = manifest.get("options", {})
+    return all(built.get(k) == v for k, v in options.items())
+
+
+@torch.no_grad()
+def load_snapshot(snapshot_dir: str, device=None, verbose=True):
+    """
+    Rebuild an IndexTTS2 instance from ``snapshot_dir`` without running its constructor.
+
+    ``device`` overrides the accelerator the snapshot was compiled on; sub-models that were kept on
+    the CPU (``low_vram``) stay on the CPU. The per-component load times are stored in
+    ``tts.startup_report``.
+    """
+    report = {}
+    total_start = time.perf_counter()
+    manifest = read_manifest(snapshot_dir) or {}
+
+    start = time.perf_counter()
+    weights = torch.load(os.path.join(snapshot_dir, WEIGHTS_FILE), map_location="cpu", mmap=True, weights_only=True)
+    report["weights (mmap)"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with open(os.path.join(snapshot_dir, SKELETON_FILE), "rb") as f:
+        skeleton = pickle.load(f)
+    report["skeleton"] = time.perf_counter() - start
+
+    cls = skeleton["class"]
+    devices = skeleton["devices"]
+    target = torch.device(device) if device is not None else None
+    resolved = {}
+
+    def resolve(key, is_param, requires_grad):
+        t = resolved.get(key)
+        if t is None:
+            source = torch.device(devices[key])
+            dest = source if source.type == "cpu" else (target or source)
+            t = weights[key].to(dest)
+            if is_param:
+                t = nn.Parameter(t, requires_grad=requires_grad)
+            resolved[key] = t
+        return t
+
+    components = manifest.get("components", {})
+    tts = cls.__new__(cls)
+    for name, blob in skeleton["attributes"].items():
+        start = time.perf_counter()
+        setattr(tts, name, _SkeletonUnpickler(io.BytesIO(blob), resolve).load())
+        # small attributes (config, flags, feature extractor) are reported together
+        label = name if name in components else "other attributes"
+        report[label] = report.get(label, 0.0) + time.perf_counter() - start
+    if target is not None:
+        tts.device = str(target)
+
+    for name in manifest.get("rebuild", [n for n in REBUILDERS if not hasattr(tts, n)]):
+        start = time.perf_counter()
+        setattr(tts, name, REBUILDERS[name](tts))
+        report[f"{name} (rebuilt)"] = time.perf_counter() - start
+
+    report["total"] = time.perf_counter() - total_start
+    tts.startup_report = {k: round(v, 3) for k, v in report.items()}
+    if verbose:
+        print(f">> IndexTTS2 loaded from snapshot {snapshot_dir} in {report['total']:.2f}s")
+    return tts
+
+
+def time_checkpoint_reads(model_dir: str, cfg) -> Dict[str, float]:
+    """Time a plain ``torch.load`` of each checkpoint IndexTTS2 reads from ``model_dir``, keyed by component."""
+    timings = {}
+    for key, component in CHECKPOINT_COMPONENTS.items():
+        filename = cfg.get(key) if hasattr(cfg, "get") else None
+        path = os.path.join(model_dir, filename) if filename else None
+        if not path or not os.path.isfile(path):
+            continue
+        start = time.perf_counter()
+        obj = torch.load(path, map_location="cpu", weights_only=False)
+        timings[component] = round(time.perf_counter() - start, 3)
+        del obj
+    return timings
+
+
+def format_report(manifest: Dict) -> str:
+    before = manifest.get("startup_report", {}).get("before", {})
+    after = manifest.get("startup_report", {}).get("after", {})
+    lines = ["Startup report (seconds)", f"{'component':<32}{'before':>10}{'after':>10}"]
+    names = [n for n in after if n != "total"] + [n for n in before if n not in after and n != "total"] + ["total"]
+    for name in names:
+        b = before.get(name)
+        a = after.get(name)
+        lines.append(f"{name:<32}{'' if b is None else f'{b:.3f}':>10}{'' if a is None else f'{a:.3f}':>10}")
+    return "\n".join(lines)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compile an IndexTTS2 inference snapshot")
+    parser.add_argument("--model_dir", type=str, default="checkpoints", help="Model checkpoints directory")
+    parser.add_argument("--output", type=str, default=None, help="Snapshot directory (default: <model_dir>/snapshot)")
+    parser.add_argument("--fp16", action="store_true", default=False, help="Build the snapshot with FP16 GPT weights")
+    parser.add_argument("--cuda_kernel", action="store_true", default=False, help="Use the BigVGAN CUDA kernel")
+    parser.add_argument("--low_vram", action="store_true", default=False, help="Build for low VRAM mode")
+    parser.add_argument("--device", type=str, default=None, help="Device to build on (e.g. 'cuda:0', 'cpu')")
+    args = parser.parse_args()
+
+    from omegaconf import OmegaConf
+
+    from indextts.infer_v2 import IndexTTS2
+
+    output_dir = args.output or os.path.join(args.model_dir, "snapshot")
+    cfg_path = os.path.join(args.model_dir, "config.yaml")
+    start = time.perf_counter()
+    tts = IndexTTS2(model_dir=args.model_dir, cfg_path=cfg_path, use_fp16=args.fp16,
+                    use_cuda_kernel=args.cuda_kernel, device=args.device, low_vram=args.low_vram)
+    baseline = {"total": round(time.perf_counter() - start, 3)}
+    # checkpoint reads below hit a warm page cache, so they are a lower bound of the cold-start cost
+    baseline.update(time_checkpoint_reads(args.model_dir, OmegaConf.load(cfg_path)))
+
+    options = {"use_fp16": args.fp16, "use_cuda_kernel": args.cuda_kernel, "low_vram": args.low_vram}
+    manifest = compile_snapshot(tts, output_dir, options=options, baseline=baseline)
+    device = tts.device
+    del tts
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+    tts = load_snapshot(output_dir, device=device)
+    manifest["startup_report"]["after"] = tts.startup_report
+    write_manifest(output_dir, manifest)
+    print(format_report(manifest))
+
+
+if __name__ == "__main__":
+    main()
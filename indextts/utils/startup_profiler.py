@@ -0,0 +1,167 @@
+import builtins
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+
+class _Node:
+    __slots__ = ("name", "start", "end", "children")
+
+    def __init__(self, name, start):
+        self.name = name
+        self.start = start
+        self.end = None
+        self.children: List["_Node"] = []
+
+    def seconds(self, now):
+        end = self.end
+        if end is None:
+            end = max([c.end or now for c in self.children], default=now)
+        return end - self.start
+
+    def to_dict(self, now, min_ms) -> Dict:
+        children = [c.to_dict(now, min_ms) for c in self.children]
+        kept = [c for c in children if c["ms"] >= min_ms]
+        node = {"name": self.name, "ms": round(self.seconds(now) * 1000, 1)}
+        if kept:
+            node["children"] = kept
+        if len(kept) < len(children):
+            node["hidden_children_ms"] = round(sum(c["ms"] for c in children if c["ms"] < min_ms), 1)
+        return node
+
+
+class StartupProfiler:
+    """
+    Timing tree of process startup: named stages (``with profiler.stage("load IndexTTS2")``) and every
+    first-time import below them. Each thread gets its own subtree, so a background model load shows
+    up next to the main thread.
+
+    A disabled profiler costs nothing: ``stage`` is a no-op and no import hook is installed.
+    """
+
+    def __init__(self, enabled=False, output_path: Optional[str] = None, min_ms=5.0):
+        self.enabled = enabled
+        self.output_path = output_path
+        self.min_ms = min_ms
+        self.root = _Node("startup", time.perf_counter())
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._orig_import = None
+        if enabled:
+            self._install_import_hook()
+
+    @classmethod
+    def from_argv(cls, argv=None, flag="--profile-startup", default_path="startup_profile.json"):
+        """Read ``--profile-startup [PATH]`` straight from argv, before argparse and the heavy imports run."""
+        argv = sys.argv[1:] if argv is None else argv
+        for i, arg in enumerate(argv):
+            if arg == flag:
+                has_path = i + 1 < len(argv) and not argv[i + 1].startswith("-")
+                return cls(True, argv[i + 1] if has_path else default_path)
+            if arg.startswith(flag + "="):
+                return cls(True, arg.split("=", 1)[1])
+        return cls(False)
+
+    def _stack(self) -> List[_Node]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            root = self.root
+            if threading.current_thread() is not threading.main_thread():
+                root = _Node(f"thread {threading.current_thread().name}", time.perf_counter())
+                with self._lock:
+                    self.root.children.append(root)
+            stack = self._local.stack = [root]
+        return stack
+
+    def _push(self, name) -> _Node:
+        stack = self._stack()
+        node = _Node(name, time.perf_counter())
+        with self._lock:
+            stack[-1].children.append(node)
+        stack.append(node)
+        return node
+
+    def _pop(self, node: _Node):
+        node.end = time.perf_counter()
+        stack = self._stack()
+        while stack and stack[-1] is not node:
+            stack.pop()
+        if len(stack) > 1:
+            stack.pop()
+
+    @contextmanager
+    def stage(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        node = self._push(name)
+        try:
+            yield
+        finally:
+            self._pop(node)
+
+    def start_stage(self, name: str) -> Optional[_Node]:
+        """Open a stage that spans module-level code where a ``with`` block does not fit; close it with ``end_stage``."""
+        return self._push(name) if self.enabled else None
+
+    def end_stage(self, node: Optional[_Node]):
+        if node is not None:
+            self._pop(node)
+
+    def _install_import_hook(self):
+        orig_import = builtins.__import__
+        self._orig_import = orig_import
+
+        def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+            # only first-time absolute imports are worth timing; everything else is a dict lookup
+            if level or name in sys.modules:
+                return orig_import(name, globals, locals, fromlist, level)
+            node = self._push(f"import {name}")
+            try:
+                return orig_import(name, globals, locals, fromlist, level)
+            finally:
+                self._pop(node)
+
+        builtins.__import__ = timed_import
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.root.start
+
+    def report(self) -> Dict:
+        return self.root.to_dict(time.perf_counter(), self.min_ms)
+
+    def format(self) -> str:
+        lines = []
+
+        def walk(node, depth):
+            lines.append(f"{'  ' * depth}{node['ms']:>9.1f} ms  {node['name']}")
+            for child in node.get("children", []):
+                walk(child, depth + 1)
+
+        walk(self.report(), 0)
+        return "\n".join(lines)
+
+    def write(self, label: Optional[str] = None):
+        """Print the tree and write it as JSON to ``output_path``."""
+        if not self.enabled:
+            return
+        report = self.report()
+        if label:
+            report["label"] = label
+        if self.output_path:
+            with open(self.output_path, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f">> Startup profile ({label or 'startup'}), {self.elapsed():.2f}s since start:")
+        print(self.format())
+
+    def finish(self, label: Optional[str] = None):
+        """Write the final report and remove the import hook."""
+        if not self.enabled:
+            return
+        self.write(label)
+        if self._orig_import is not None and builtins.__import__ is not self._orig_import:
+            builtins.__import__ = self._orig_import
+        self.enabled = False
@@ -0,0 +1,194 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import torch
+import torchaudio
+from safetensors.torch import load_file, save_file
+
+# Per-voice tensors produced by the speaker-conditioning stage of IndexTTS2.infer()
+PROFILE_KEYS = ("spk_cond_emb", "style", "prompt_condition", "ref_mel")
+PROFILE_FORMAT_VERSION = "1"
+
+
+def _module_device(module, default):
+    try:
+        return next(module.parameters()).device
+    except (StopIteration, AttributeError):
+        return default
+
+
+def hash_audio_file(audio_path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Content hash of a prompt audio file, so renamed or re-uploaded copies of the same voice share one profile.
+    """
+    h = hashlib.sha1()
+    with open(audio_path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+@torch.no_grad()
+def compute_voice_profile(tts, audio_path: str, verbose=False) -> Dict[str, torch.Tensor]:
+    """
+    Run the speaker-conditioning stage of IndexTTS2 for one prompt audio:
+    w2v-BERT semantic features, semantic-codec quantization, reference mel, CAMPPlus style
+    and the s2mel prompt condition.
+
+    Each sub-model is run on the device it currently lives on, so this also works when
+    ``low_vram`` has offloaded some of them to the CPU.
+    """
+    device = torch.device(tts.device)
+    max_duration = getattr(tts, "max_ref_audio_duration", 15)
+    audio, sr = tts._load_and_cut_audio(audio_path, max_duration, verbose)
+    audio_22k = torchaudio.transforms.Resample(sr, 22050)(audio)
+    audio_16k = torchaudio.transforms.Resample(sr, 16000)(audio)
+
+    inputs = tts.extract_features(audio_16k, sampling_rate=16000, return_tensors="pt")
+    input_features = inputs["input_features"].to(device)
+    attention_mask = inputs["attention_mask"].to(device)
+    spk_cond_emb = tts.get_emb(input_features, attention_mask)
+
+    codec_device = _module_device(tts.semantic_codec, device)
+    _, S_ref = tts.semantic_codec.quantize(spk_cond_emb.to(codec_device))
+    ref_mel = tts.mel_fn(audio_22k.to(device).float())
+    ref_target_lengths = torch.LongTensor([ref_mel.size(2)]).to(device)
+
+    campplus_device = _module_device(tts.campplus_model, device)
+    feat = torchaudio.compliance.kaldi.fbank(audio_16k.to(campplus_device),
+                                             num_mel_bins=80,
+                                             dither=0,
+                                             sample_frequency=16000)
+    feat = feat - feat.mean(dim=0, keepdim=True)
+    style = tts.campplus_model(feat.unsqueeze(0))
+
+    length_regulator = tts.s2mel.models['length_regulator']
+    regulator_device = _module_device(length_regulator, device)
+    prompt_condition = length_regulator(S_ref.to(regulator_device),
+                                        ylens=ref_target_lengths.to(regulator_device),
+                                        n_quantizers=3,
+                                        f0=None)[0]
+    return {
+        "spk_cond_emb": spk_cond_emb.to(device),
+        "style": style.to(device),
+        "prompt_condition": prompt_condition.to(device),
+        "ref_mel": ref_mel.to(device),
+    }
+
+
+class VoiceProfileStore:
+    """
+    Persistent store of IndexTTS2 speaker conditioning, keyed by the content hash of the prompt audio.
+
+    Profiles are written as ``<cache_dir>/<key>.safetensors`` (memory-mapped on load) and the most
+    recently used ``max_entries`` are kept in memory, so switching between speakers of a multi-role
+    script, or restarting the WebUI, never recomputes conditioning for a voice seen before.
+    """
+
+    def __init__(self, cache_dir="voice_profiles", max_entries=16):
+        self.cache_dir = cache_dir
+        self.max_entries = max(1, int(max_entries))
+        self._profiles: "OrderedDict[str, Dict[str, torch.Tensor]]" = OrderedDict()
+        # audio path -> (mtime, size, key): avoid re-hashing unchanged files on every request
+        self._path_keys: Dict[str, Tuple[float, int, str]] = {}
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key_for(self, tts, audio_path: str) -> str:
+        st = os.stat(audio_path)
+        cached = self._path_keys.get(audio_path)
+        if cached is not None and cached[0] == st.st_mtime and cached[1] == st.st_size:
+            return cached[2]
+        digest = hash_audio_file(audio_path)
+        # conditioning also depends on the model and on how much of the reference audio is used
+        tag = f"{getattr(tts, 'model_version', None) or '1.0'}|{getattr(tts, 'max_ref_audio_duration', 15)}"
+        key = hashlib.sha1(f"{digest}|{tag}".encode("utf-8")).hexdigest()
+        self._path_keys[audio_path] = (st.st_mtime, st.st_size, key)
+        return key
+
+    def _profile_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.safetensors")
+
+    def _remember(self, key: str, profile: Dict[str, torch.Tensor]):
+        self._profiles[key] = profile
+        self._profiles.move_to_end(key)
+        while len(self._profiles) > self.max_entries:
+            self._profiles.popitem(last=False)
+
+    def get(self, key: str, device=None) -> Optional[Dict[str, torch.Tensor]]:
+        with self._lock:
+            profile = self._profiles.get(key)
+            if profile is not None:
+                self._profiles.move_to_end(key)
+                self.hits += 1
+                return profile
+            path = self._profile_path(key)
+            if not os.path.isfile(path):
+                return None
+            try:
+                tensors = load_file(path, device=str(device) if device is not None else "cpu")
+            except Exception as e:
+                print(f">> Failed to load voice profile {path}: {e}")
+                return None
+            if any(k not in tensors for k in PROFILE_KEYS):
+                return None
+            profile = {k: tensors[k] for k in PROFILE_KEYS}
+            self._remember(key, profile)
+            self.disk_hits += 1
+            return profile
+
+    def put(self, key: str, profile: Dict[str, torch.Tensor], audio_path: Optional[str] = None):
+        with self._lock:
+            self._remember(key, profile)
+            tensors = {k: profile[k].detach().to("cpu").contiguous() for k in PROFILE_KEYS}
+            metadata = {"format": PROFILE_FORMAT_VERSION}
+            if audio_path:
+                metadata["source"] = os.path.basename(audio_path)
+            path = self._profile_path(key)
+            tmp_path = path + ".tmp"
+            try:
+                save_file(tensors, tmp_path, metadata=metadata)
+                os.replace(tmp_path, path)
+            except Exception as e:
+                print(f">> Failed to save voice profile {path}: {e}")
+
+    def load_or_compute(self, tts, audio_path: str, verbose=False) -> Tuple[str, Dict[str, torch.Tensor]]:
+        key = self.key_for(tts, audio_path)
+        profile = self.get(key, device=tts.device)
+        if profile is None:
+            with self._lock:
+                self.misses += 1
+            profile = compute_voice_profile(tts, audio_path, verbose=verbose)
+            self.put(key, profile, audio_path=audio_path)
+        return key, profile
+
+    def attach(self, tts, audio_path: str, verbose=False) -> str:
+        """
+        Load (or compute and persist) the profile of ``audio_path`` and install it into the
+        single-speaker cache of ``tts``, so the following ``tts.infer(spk_audio_prompt=audio_path, ...)``
+        skips the speaker-conditioning stage.
+        """
+        key, profile = self.load_or_compute(tts, audio_path, verbose=verbose)
+        tts.cache_spk_cond = profile["spk_cond_emb"]
+        tts.cache_s2mel_style = profile["style"]
+        tts.cache_s2mel_prompt = profile["prompt_condition"]
+        tts.cache_mel = profile["ref_mel"]
+        tts.cache_spk_audio_prompt = audio_path
+        return key
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "in_memory": len(self._profiles),
+        }
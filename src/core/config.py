@@ -44,6 +44,9 @@ class ConfigManager:
                     self.config["completion_sound_enabled"] = False
                 if "completion_sound_path" not in self.config:
                     self.config["completion_sound_path"] = ""
+                # 新增：批量/播客的基础 seed（None 为每次随机；固定后重新生成时未修改的行可命中分段缓存）
+                if "batch_seed" not in self.config:
+                    self.config["batch_seed"] = None
             else:
                 # 创建默认配置
                 self.config = {
@@ -73,7 +76,8 @@ class ConfigManager:
                     "voice_custom_names": {},
                     "save_mp3": False,
                     "completion_sound_enabled": False,
-                    "completion_sound_path": ""
+                    "completion_sound_path": "",
+                    "batch_seed": None
                 }
                 self.save_config()
                 print(f"创建默认配置文件: {self.config_file}")
@@ -103,7 +107,8 @@ class ConfigManager:
                 "voice_custom_names": {},
                 "save_mp3": False,
                 "completion_sound_enabled": False,
-                "completion_sound_path": ""
+                "completion_sound_path": "",
+                "batch_seed": None
             }
     
     def save_config(self):
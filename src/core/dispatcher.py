@@ -0,0 +1,193 @@
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from src.core.engine_client import EngineHttpClient
+
+
+def port_is_open(host, port, timeout=0.5):
+    """端口连通性检测（与 wait_for_service 相同的判断方式）"""
+    try:
+        with socket.create_connection((host, int(port)), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+class EngineInstance:
+    """单个推理实例的状态：健康状况、在途请求数、平均耗时"""
+
+    def __init__(self, host, port, client):
+        self.host = host
+        self.port = int(port)
+        self.base_url = f"http://{host}:{port}"
+        self.client = client
+        self.healthy = False
+        self.in_flight = 0
+        self.completed = 0
+        self.failures = 0
+        self.avg_latency = None
+        self.last_check = 0.0
+
+    def record(self, seconds):
+        self.completed += 1
+        # 指数滑动平均，用于在途数相同时区分快慢实例
+        self.avg_latency = seconds if self.avg_latency is None else 0.8 * self.avg_latency + 0.2 * seconds
+
+    def to_dict(self):
+        return {
+            "port": self.port,
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "failures": self.failures,
+            "avg_latency": round(self.avg_latency, 3) if self.avg_latency is not None else None,
+        }
+
+
+class EngineDispatcher:
+    """在 start_port..end_port 上的多个 webui.py 实例之间分发批量任务。
+
+    - 定期健康检查每个端口（优先 /api/ready，旧版引擎退化为端口连通检测）；
+    - 记录每个实例的在途请求数，每一行发给当前负载最低的健康实例；
+    - 单行失败时换一个实例重试；
+    - map() 的返回结果保持输入顺序，N 个实例约可获得 N 倍吞吐。
+    """
+
+    def __init__(self, start_port, end_port, host="127.0.0.1", client_factory=None,
+                 max_in_flight_per_instance=1, health_interval=10.0, logger=None):
+        self.host = host
+        self.max_in_flight = max(1, int(max_in_flight_per_instance))
+        self.health_interval = health_interval
+        self.logger = logger
+        factory = client_factory or (lambda base_url: EngineHttpClient(base_url))
+        self.instances = [EngineInstance(host, p, factory(f"http://{host}:{p}"))
+                          for p in range(int(start_port), int(end_port) + 1)]
+        self._cond = threading.Condition()
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        """从 config.json 的 start_port / end_port 创建；batch_seed 不为空时每一行使用由文本派生的固定 seed"""
+        seed = config.get("batch_seed")
+        if seed is not None and "client_factory" not in kwargs:
+            kwargs["client_factory"] = lambda base_url: EngineHttpClient(base_url, seed=seed)
+        return cls(config.get("start_port", 7860), config.get("end_port", 7860), **kwargs)
+
+    def log(self, msg, level="info"):
+        if self.logger:
+            getattr(self.logger, level)(msg)
+        else:
+            print(msg)
+
+    def _check(self, inst):
+        healthy = False
+        if port_is_open(inst.host, inst.port):
+            try:
+                with urllib.request.urlopen(f"{inst.base_url}/api/ready", timeout=3) as resp:
+                    healthy = resp.status == 200
+            except urllib.error.HTTPError as e:
+                # 不带 /api/ready 的旧版引擎：端口开放即视为可用；加载中的实例返回 503
+                healthy = e.code == 404
+            except Exception:
+                healthy = False
+        inst.last_check = time.time()
+        return healthy
+
+    def refresh_health(self, force=False):
+        """并发检查所有实例，返回健康实例数"""
+        now = time.time()
+        todo = [i for i in self.instances if force or now - i.last_check >= self.health_interval]
+        if todo:
+            with ThreadPoolExecutor(max_workers=min(16, len(todo))) as ex:
+                results = list(ex.map(self._check, todo))
+            with self._cond:
+                for inst, ok in zip(todo, results):
+                    if ok != inst.healthy:
+                        self.log(f"推理实例 {inst.port} {'可用' if ok else '不可用'}")
+                    inst.healthy = ok
+                self._cond.notify_all()
+        return sum(1 for i in self.instances if i.healthy)
+
+    def _acquire(self, exclude=()):
+        while True:
+            with self._cond:
+                while True:
+                    candidates = [i for i in self.instances
+                                  if i.healthy and i.in_flight < self.max_in_flight and i.port not in exclude]
+                    if candidates:
+                        inst = min(candidates, key=lambda i: (i.in_flight, i.avg_latency or 0.0))
+                        inst.in_flight += 1
+                        return inst
+                    if any(i.healthy and i.port not in exclude for i in self.instances):
+                        self._cond.wait(timeout=1.0)
+                    elif exclude and any(i.healthy for i in self.instances):
+                        # 只剩下失败过的实例，也允许重试
+                        exclude = ()
+                    else:
+                        break
+            # 没有健康实例：重新检查一次
+            if self.refresh_health(force=True) == 0:
+                raise RuntimeError("没有可用的推理实例")
+
+    def _release(self, inst, seconds=None, failed=False):
+        with self._cond:
+            inst.in_flight -= 1
+            if failed:
+                inst.failures += 1
+            elif seconds is not None:
+                inst.record(seconds)
+            self._cond.notify_all()
+
+    def submit(self, fn, item, max_retries=2):
+        """在负载最低的实例上执行 fn(client, item)，失败时换实例重试"""
+        tried = set()
+        last_err = None
+        for _ in range(max_retries + 1):
+            inst = self._acquire(exclude=tried)
+            start = time.perf_counter()
+            try:
+                result = fn(inst.client, item)
+            except Exception as e:
+                last_err = e
+                self._release(inst, failed=True)
+                tried.add(inst.port)
+                if not port_is_open(inst.host, inst.port):
+                    with self._cond:
+                        inst.healthy = False
+                self.log(f"推理实例 {inst.port} 处理失败，准备重试: {e}", "warning")
+                continue
+            self._release(inst, seconds=time.perf_counter() - start)
+            return result
+        raise last_err
+
+    def map(self, fn, items, max_retries=2, progress_callback=None):
+        """批量执行，返回与 items 顺序一致的结果列表；失败的行结果为异常对象"""
+        items = list(items)
+        if self.refresh_health(force=True) == 0:
+            raise RuntimeError("没有可用的推理实例")
+        results = [None] * len(items)
+        done = [0]
+        lock = threading.Lock()
+        workers = max(1, len(self.instances) * self.max_in_flight)
+
+        def run(idx):
+            try:
+                results[idx] = self.submit(fn, items[idx], max_retries=max_retries)
+            except Exception as e:
+                results[idx] = e
+            with lock:
+                done[0] += 1
+                if progress_callback:
+                    progress_callback(done[0], len(items))
+            # 顺带刷新过期的健康状态，让重新上线的实例尽快参与分发
+            self.refresh_health()
+
+        with ThreadPoolExecutor(max_workers=min(workers, max(1, len(items)))) as ex:
+            list(ex.map(run, range(len(items))))
+        return results
+
+    def stats(self):
+        return [i.to_dict() for i in self.instances]
@@ -0,0 +1,105 @@
+import base64
+import hashlib
+import http.client
+import json
+import os
+import threading
+import urllib.parse
+
+
+def line_seed(base_seed, text):
+    """批量/播客中一行的固定 seed：只由基础 seed 与该行文本决定，与行号无关，
+    插入、删除或移动其他行后，未修改的行仍得到同一个 seed，从而命中推理端的分段缓存。"""
+    digest = hashlib.sha1(f"{int(base_seed)}:{text}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "little") & 0x7FFFFFFF
+
+
+class EngineHttpClient:
+    """推理端二进制 HTTP 接口 (/api/tts) 的客户端。
+
+    JSON 请求直接返回 WAV/FLAC 字节，不再需要 gradio_client 的多次往返，
+    也不需要轮询 outputs/ 目录或二次下载文件。每个线程复用一条 keep-alive 连接。
+    """
+
+    def __init__(self, base_url, timeout=600, remote=False, seed=None):
+        parsed = urllib.parse.urlparse(base_url if "://" in base_url else f"http://{base_url}")
+        self.base_url = f"{parsed.scheme}://{parsed.netloc}"
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        self.https = parsed.scheme == "https"
+        self.timeout = timeout
+        # Remote 模式下推理端看不到本地文件，需要把参考音频随请求一起发送
+        self.remote = remote
+        # 设置后，未自带 seed 的请求按行文本派生固定 seed（见 line_seed）；None 表示每次随机
+        self.seed = seed
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            conn = cls(self.host, self.port, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _request(self, method, path, body=None, headers=None):
+        # 连接可能已被服务端关闭（空闲超时），重试一次
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                resp = conn.getresponse()
+                data = resp.read()
+                return resp.status, dict(resp.getheaders()), data
+            except (http.client.HTTPException, ConnectionError, OSError):
+                self.close()
+                if attempt == 1:
+                    raise
+
+    def health(self):
+        """检查推理端是否就绪（模型已加载），返回 True/False"""
+        try:
+            status, _, _ = self._request("GET", "/api/ready")
+            return status == 200
+        except Exception:
+            return False
+
+    def _encode_audio_field(self, payload, path_key, b64_key):
+        path = payload.get(path_key)
+        if self.remote and path and os.path.isfile(path):
+            with open(path, "rb") as f:
+                payload[b64_key] = base64.b64encode(f.read()).decode("ascii")
+            payload.pop(path_key, None)
+
+    def synthesize(self, payload, dest_path=None, fmt="wav"):
+        """发送合成请求。
+
+        payload 字段与推理端 SynthesisRequest 一致（text, spk_audio_prompt, emo_control_method, emo_vector, seed 等）。
+        指定 dest_path 时写入文件并返回路径，否则返回音频字节。失败时抛出 RuntimeError。
+        """
+        payload = dict(payload)
+        payload["format"] = fmt
+        if self.seed is not None and payload.get("seed") is None:
+            payload["seed"] = line_seed(self.seed, payload.get("text", ""))
+        self._encode_audio_field(payload, "spk_audio_prompt", "spk_audio_base64")
+        self._encode_audio_field(payload, "emo_audio_prompt", "emo_audio_base64")
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        status, headers, data = self._request("POST", "/api/tts", body=body,
+                                              headers={"Content-Type": "application/json",
+                                                       "Connection": "keep-alive"})
+        if status != 200:
+            raise RuntimeError(f"合成失败 HTTP {status}: {data[:500].decode('utf-8', 'replace')}")
+        if dest_path is None:
+            return data
+        os.makedirs(os.path.dirname(dest_path) or ".", exist_ok=True)
+        tmp = dest_path + ".part"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, dest_path)
+        return dest_path
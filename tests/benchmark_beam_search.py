@@ -0,0 +1,100 @@
+import argparse
+import contextlib
+import io
+import json
+import sys
+import time
+from pathlib import Path
+
+import torch
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from indextts.gpt.model_v2 import UnifiedVoice
+
+
+def _build_model(layers, dim, heads, max_mel_tokens):
+    torch.manual_seed(0)
+    conformer = dict(output_size=256, linear_units=512, attention_heads=4, num_blocks=1,
+                     input_layer="conv2d2", perceiver_mult=2)
+    model = UnifiedVoice(layers=layers, model_dim=dim, heads=heads, max_text_tokens=120,
+                         max_mel_tokens=max_mel_tokens, number_text_tokens=1000, number_mel_codes=8194,
+                         start_mel_token=8192, stop_mel_token=8193, condition_type="conformer_perceiver",
+                         condition_module=conformer, emo_condition_module=dict(conformer))
+    model.post_init_gpt2_config(kv_cache=True)
+    # random weights never settle on the stop token: every run decodes the full length
+    model.mel_head.bias.data[model.stop_mel_token] = -1e4
+    return model.eval()
+
+
+def _setup(model, path):
+    if path == "hf":
+        model.enable_static_kv_cache(False)
+    elif path == "hf_static":
+        model.enable_static_kv_cache(True)
+        model.beam_search = None
+    else:
+        model.enable_lean_beam_search()
+
+
+def _run(model, inputs, tokens, kwargs):
+    cond, emo_vec, text = inputs
+    torch.manual_seed(0)
+    with torch.no_grad(), contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        codes, _ = model.inference_speech(cond, text, cond_lengths=torch.tensor([cond.shape[1]]), emo_vec=emo_vec,
+                                          max_generate_length=tokens, **kwargs)
+        elapsed = time.perf_counter() - start
+    return codes, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HF generate() vs MelBeamSearch for num_beams=1/3/5 (CPU)")
+    parser.add_argument("--layers", type=int, default=8)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--heads", type=int, default=8)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--beams", type=int, nargs="+", default=[1, 3, 5])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    model = _build_model(args.layers, args.dim, args.heads, args.tokens + 1)
+    generator = torch.Generator().manual_seed(1)
+    inputs = (torch.randn(1, 120, 1024, generator=generator), torch.randn(1, args.dim, generator=generator),
+              torch.randint(2, 900, (1, 60), generator=generator))
+    # the WebUI sampling settings
+    sampling = dict(do_sample=True, top_p=0.8, top_k=30, temperature=0.8, length_penalty=0.0,
+                    repetition_penalty=10.0)
+
+    report = {"config": vars(args), "sampling": sampling, "runs": []}
+    for beams in args.beams:
+        kwargs = dict(sampling, num_beams=beams)
+        row = {"num_beams": beams}
+        # with one beam there is no beam search: the lean path falls back to generate()
+        paths = ("hf", "hf_static", "lean") if beams > 1 else ("hf", "hf_static")
+        codes = {}
+        for path in paths:
+            _setup(model, path)
+            _run(model, inputs, 16, kwargs)  # warm-up
+            times = []
+            for _ in range(args.repeats):
+                codes[path], elapsed = _run(model, inputs, args.tokens, kwargs)
+                times.append(elapsed)
+            best = min(times)
+            row[path] = {"total_s": round(best, 3), "tokens_per_s": round(codes[path].shape[1] / best, 1)}
+        if beams > 1:
+            row["lean"]["speedup_vs_hf"] = round(row["hf"]["total_s"] / row["lean"]["total_s"], 2)
+            row["lean"]["speedup_vs_hf_static"] = round(row["hf_static"]["total_s"] / row["lean"]["total_s"], 2)
+            # same seed, same candidate draws: the codes must not change
+            row["lean"]["identical_to_hf"] = torch.equal(codes["lean"], codes["hf"])
+            row["lean"]["reorder_fraction"] = round(model.beam_search.last_stats["reorder_fraction"], 3)
+        report["runs"].append(row)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
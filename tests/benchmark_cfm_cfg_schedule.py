@@ -0,0 +1,122 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import torch
+from omegaconf import OmegaConf
+from torch.utils.flop_counter import FlopCounterMode
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from indextts.s2mel.modules.flow_matching import CFG_MODES, CFG_PRESETS, CFM, CFM_SOLVERS
+
+# the settings of IndexTTS2Pipeline.s2mel
+DIFFUSION_STEPS = 25
+INFERENCE_CFG_RATE = 0.7
+
+
+def _build_cfm(model_dir):
+    """The s2mel CFM of ``model_dir/config.yaml``, with the trained weights when ``s2mel.pth`` is there."""
+    cfg = OmegaConf.load(os.path.join(model_dir, "config.yaml"))
+    torch.manual_seed(0)
+    cfm = CFM(cfg.s2mel)
+    checkpoint = os.path.join(model_dir, cfg.get("s2mel_checkpoint", "s2mel.pth"))
+    trained = os.path.exists(checkpoint)
+    if trained:
+        params = torch.load(checkpoint, map_location="cpu")["net"]["cfm"]
+        params = {k[len("module."):] if k.startswith("module.") else k: v for k, v in params.items()}
+        cfm.load_state_dict(params, strict=False)
+    cfm.estimator.setup_caches(max_batch_size=2, max_seq_length=8192)
+    return cfm.eval(), trained
+
+
+def _flops_per_row(cfm, inputs):
+    """DiT FLOPs of one estimator row (the guided call runs two rows: conditional and null)."""
+    mu, x_lens, prompt, style = inputs
+    x = torch.randn(1, cfm.in_channels, mu.shape[1])
+    prompt_x = torch.zeros_like(x)
+    prompt_x[..., :prompt.shape[-1]] = prompt
+    counter = FlopCounterMode(display=False)
+    with torch.no_grad(), counter:
+        cfm.estimator(x, prompt_x, x_lens, torch.tensor([0.5]), style, mu)
+    return counter.get_total_flops()
+
+
+def _run(cfm, inputs, steps, seed):
+    mu, x_lens, prompt, style = inputs
+    torch.manual_seed(seed)
+    with contextlib.redirect_stderr(io.StringIO()):  # tqdm
+        start = time.perf_counter()
+        mel = cfm.inference(mu.clone(), x_lens, prompt, style, None, steps, inference_cfg_rate=INFERENCE_CFG_RATE)
+        elapsed = time.perf_counter() - start
+    return mel[:, :, prompt.shape[-1]:], elapsed, dict(cfm.last_stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="s2mel CFG schedules: DiT FLOPs, time and mel L1 vs CFG on every step")
+    parser.add_argument("--model_dir", type=str, default=str(ROOT / "checkpoints"),
+                        help="config.yaml and, if present, s2mel.pth (random weights otherwise)")
+    parser.add_argument("--frames", type=int, default=300, help="mel frames of the segment, prompt included")
+    parser.add_argument("--prompt_frames", type=int, default=100)
+    parser.add_argument("--steps", type=int, default=DIFFUSION_STEPS)
+    parser.add_argument("--solver", type=str, default="euler", choices=CFM_SOLVERS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    cfm, trained = _build_cfm(args.model_dir)
+    cfm.set_solver(args.solver)
+    generator = torch.Generator().manual_seed(1)
+    inputs = (torch.randn(1, args.frames, cfm.estimator.content_dim, generator=generator),
+              torch.LongTensor([args.frames]),
+              torch.randn(1, cfm.in_channels, args.prompt_frames, generator=generator),
+              torch.randn(1, 192, generator=generator))
+    flops_per_row = _flops_per_row(cfm, inputs)
+
+    runs = []
+    with torch.no_grad():
+        cfm.set_cfg_schedule("full")
+        _run(cfm, inputs, 2, args.seed)  # warm-up
+        reference, reference_s, reference_stats = _run(cfm, inputs, args.steps, args.seed)
+        reference_flops = reference_stats["estimator_rows"] * flops_per_row
+        for preset in CFG_PRESETS:
+            if preset == "full":
+                continue
+            for mode in CFG_MODES:
+                cfm.set_cfg_schedule(preset, mode)
+                mel, elapsed, stats = _run(cfm, inputs, args.steps, args.seed)
+                flops = stats["estimator_rows"] * flops_per_row
+                runs.append({
+                    "preset": preset,
+                    "mode": mode,
+                    "guided_calls": stats["guided_calls"],
+                    "estimator_calls": stats["estimator_calls"],
+                    "estimator_rows": stats["estimator_rows"],
+                    "dit_gflops": round(flops / 1e9, 2),
+                    "flop_saving": round(1 - flops / reference_flops, 3),
+                    "time_s": round(elapsed, 3),
+                    "time_saving": round(1 - elapsed / reference_s, 3),
+                    "l1_vs_full_cfg": round(float((mel - reference).abs().mean()), 5),
+                })
+    report = {
+        "config": vars(args),
+        "trained_weights": trained,
+        "dit_gflops_per_row": round(flops_per_row / 1e9, 3),
+        "reference": {"preset": "full", "estimator_rows": reference_stats["estimator_rows"],
+                      "dit_gflops": round(reference_flops / 1e9, 2), "time_s": round(reference_s, 3),
+                      "mel_abs_mean": round(float(reference.abs().mean()), 5)},
+        "runs": runs,
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import torch
+from omegaconf import OmegaConf
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from indextts.s2mel.modules.flow_matching import CFM, CFM_SOLVERS, T_SCHEDULES
+
+# the settings of IndexTTS2Pipeline.s2mel
+REFERENCE_STEPS = 25
+INFERENCE_CFG_RATE = 0.7
+# estimator passes per step
+PASSES = {"euler": 1, "heun": 2, "midpoint": 2, "dpm": 1}
+
+
+def _build_cfm(model_dir):
+    """The s2mel CFM of ``model_dir/config.yaml``, with the trained weights when ``s2mel.pth`` is there."""
+    cfg = OmegaConf.load(os.path.join(model_dir, "config.yaml"))
+    torch.manual_seed(0)
+    cfm = CFM(cfg.s2mel)
+    checkpoint = os.path.join(model_dir, cfg.get("s2mel_checkpoint", "s2mel.pth"))
+    trained = os.path.exists(checkpoint)
+    if trained:
+        params = torch.load(checkpoint, map_location="cpu")["net"]["cfm"]
+        params = {k[len("module."):] if k.startswith("module.") else k: v for k, v in params.items()}
+        cfm.load_state_dict(params, strict=False)
+    cfm.estimator.setup_caches(max_batch_size=2, max_seq_length=8192)
+    return cfm.eval(), trained
+
+
+def _run(cfm, inputs, steps, solver, schedule, seed):
+    """One ``inference`` call from the same noise; returns the generated (non-prompt) frames and the time."""
+    mu, x_lens, prompt, style = inputs
+    torch.manual_seed(seed)
+    with contextlib.redirect_stderr(io.StringIO()):  # tqdm
+        start = time.perf_counter()
+        mel = cfm.inference(mu.clone(), x_lens, prompt, style, None, steps, inference_cfg_rate=INFERENCE_CFG_RATE,
+                            solver=solver, t_schedule=schedule)
+        elapsed = time.perf_counter() - start
+    return mel[:, :, prompt.shape[-1]:], elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="s2mel CFM solvers / step counts vs the 25-step Euler reference")
+    parser.add_argument("--model_dir", type=str, default=str(ROOT / "checkpoints"),
+                        help="config.yaml and, if present, s2mel.pth (random weights otherwise)")
+    parser.add_argument("--frames", type=int, default=300, help="mel frames, prompt included")
+    parser.add_argument("--prompt_frames", type=int, default=100)
+    parser.add_argument("--solvers", type=str, nargs="+", default=list(CFM_SOLVERS), choices=CFM_SOLVERS)
+    parser.add_argument("--schedules", type=str, nargs="+", default=list(T_SCHEDULES), choices=T_SCHEDULES)
+    parser.add_argument("--steps", type=int, nargs="+", default=[4, 6, 8, 12])
+    parser.add_argument("--fine_steps", type=int, default=0,
+                        help="also report the error against a Heun solution with this many steps (0 disables)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    cfm, trained = _build_cfm(args.model_dir)
+    generator = torch.Generator().manual_seed(1)
+    mu = torch.randn(1, args.frames, cfm.estimator.content_dim, generator=generator)
+    inputs = (mu, torch.LongTensor([args.frames]), torch.randn(1, cfm.in_channels, args.prompt_frames,
+                                                                 generator=generator),
+              torch.randn(1, 192, generator=generator))
+
+    with torch.no_grad():
+        reference, reference_s = _run(cfm, inputs, REFERENCE_STEPS, "euler", "uniform", args.seed)
+        fine = _run(cfm, inputs, args.fine_steps, "heun", "uniform", args.seed)[0] if args.fine_steps else None
+        runs = []
+        for solver in args.solvers:
+            for schedule in args.schedules:
+                for steps in args.steps:
+                    mel, elapsed = _run(cfm, inputs, steps, solver, schedule, args.seed)
+                    row = {"solver": solver, "schedule": schedule, "steps": steps,
+                           "estimator_passes": steps * PASSES[solver], "time_s": round(elapsed, 3),
+                           "speedup": round(reference_s / elapsed, 2),
+                           "l1_vs_euler25": round(float((mel - reference).abs().mean()), 5)}
+                    if fine is not None:
+                        row["l1_vs_fine"] = round(float((mel - fine).abs().mean()), 5)
+                    runs.append(row)
+
+    report = {
+        "config": vars(args),
+        "trained_weights": trained,
+        "reference": {"solver": "euler", "schedule": "uniform", "steps": REFERENCE_STEPS,
+                      "time_s": round(reference_s, 3), "mel_abs_mean": round(float(reference.abs().mean()), 5)},
+        "runs": runs,
+    }
+    if fine is not None:
+        report["reference"]["l1_vs_fine"] = round(float((reference - fine).abs().mean()), 5)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import torch
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from indextts.gpt.continuous_batching import ContinuousBatchScheduler
+from indextts.gpt.model_v2 import UnifiedVoice
+
+
+def _build_model(layers, dim, heads, max_mel_tokens):
+    torch.manual_seed(0)
+    conformer = dict(output_size=dim, linear_units=dim * 2, attention_heads=heads, num_blocks=1,
+                     input_layer="conv2d2", perceiver_mult=2)
+    model = UnifiedVoice(layers=layers, model_dim=dim, heads=heads, max_text_tokens=120,
+                         max_mel_tokens=max_mel_tokens, number_text_tokens=1000, number_mel_codes=8194,
+                         start_mel_token=8192, stop_mel_token=8193, condition_type="conformer_perceiver",
+                         condition_module=conformer, emo_condition_module=dict(conformer))
+    model.post_init_gpt2_config(kv_cache=True)
+    # random weights never settle on the stop token: segment lengths come from per-segment limits instead
+    model.mel_head.bias.data[model.stop_mel_token] = -1e4
+    return model.eval()
+
+
+def _segments(model, count, dim, min_len, max_len):
+    generator = torch.Generator().manual_seed(1)
+    cond = torch.randn(1, 120, 1024, generator=generator)
+    emo_vec = torch.randn(1, dim, generator=generator)
+    with torch.no_grad():
+        latent = model.get_conditioning(cond.transpose(1, 2), torch.tensor([cond.shape[1]]))
+        conds_latent = model.build_conds_latent(latent, emo_vec, 1)
+    segments = []
+    for _ in range(count):
+        text = torch.randint(2, 900, (int(torch.randint(20, 100, (1,), generator=generator)),), generator=generator)
+        # wildly different lengths: short interjections next to long sentences
+        length = int(min_len + (max_len - min_len) * torch.rand(1, generator=generator) ** 2)
+        segments.append({"conds_latent": conds_latent, "text_tokens": text, "max_generate_length": length})
+    return cond, emo_vec, segments
+
+
+def _fixed_batches(model, cond, emo_vec, segments, batch_size):
+    """Today's path: fixed batches (sorted by text length) that run until their longest row is done."""
+    order = sorted(range(len(segments)), key=lambda i: -len(segments[i]["text_tokens"]))
+    steps = useful = 0
+    start = time.perf_counter()
+    for b in range(0, len(order), batch_size):
+        chunk = [segments[i] for i in order[b:b + batch_size]]
+        longest = max(s["max_generate_length"] for s in chunk)
+        width = max(len(s["text_tokens"]) for s in chunk)
+        text = torch.full((len(chunk), width), model.stop_text_token, dtype=torch.long)
+        for row, s in enumerate(chunk):
+            text[row, :len(s["text_tokens"])] = s["text_tokens"]
+        n = len(chunk)
+        with torch.no_grad():
+            model.inference_speech(cond.repeat(n, 1, 1), text, cond_lengths=torch.tensor([cond.shape[1]] * n),
+                                   emo_vec=emo_vec.repeat(n, 1), max_generate_length=longest, do_sample=True,
+                                   top_k=30, top_p=0.8, temperature=0.8, repetition_penalty=10.0, num_beams=1)
+        steps += longest * batch_size
+        useful += sum(s["max_generate_length"] for s in chunk)
+    elapsed = time.perf_counter() - start
+    return {"total_s": round(elapsed, 3), "tokens_per_s": round(useful / elapsed, 1),
+            "slot_utilization": round(useful / steps, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fixed batches vs continuous batching of mel-code generation (CPU)")
+    parser.add_argument("--layers", type=int, default=6)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--heads", type=int, default=8)
+    parser.add_argument("--segments", type=int, default=32)
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--min_len", type=int, default=20)
+    parser.add_argument("--max_len", type=int, default=400)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    model = _build_model(args.layers, args.dim, args.heads, args.max_len + 1)
+    cond, emo_vec, segments = _segments(model, args.segments, args.dim, args.min_len, args.max_len)
+    ContinuousBatchScheduler(model, max_batch_size=2).generate(segments[:2])  # warm-up
+
+    torch.manual_seed(0)
+    fixed = _fixed_batches(model, cond, emo_vec, segments, args.batch_size)
+    torch.manual_seed(0)
+    scheduler = ContinuousBatchScheduler(model, max_batch_size=args.batch_size)
+    scheduler.generate(segments)
+    metrics = scheduler.last_metrics
+    report = {
+        "config": vars(args),
+        "useful_tokens": sum(s["max_generate_length"] for s in segments),
+        "fixed_batches": fixed,
+        "continuous": {
+            "total_s": round(metrics["total_time"], 3),
+            "tokens_per_s": round(metrics["tokens_per_s"], 1),
+            "slot_utilization": round(metrics["slot_utilization"], 3),
+            "steps": metrics["steps"],
+            "prefill_s": round(metrics["prefill_time"], 3),
+        },
+    }
+    report["speedup"] = round(fixed["total_s"] / report["continuous"]["total_s"], 2)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
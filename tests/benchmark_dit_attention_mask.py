@@ -0,0 +1,91 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import torch
+from omegaconf import OmegaConf
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from indextts.s2mel.modules.flow_matching import CFM
+
+MEL_FRAMES_PER_S = 22050 / 256
+
+
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _child(args):
+    """One guided DiT step (conditional + null rows) in this process; prints its peak RSS as JSON."""
+    seconds = args.seconds[0]
+    torch.set_num_threads(args.threads)
+    cfg = OmegaConf.load(os.path.join(args.model_dir, "config.yaml"))
+    torch.manual_seed(0)
+    dit = CFM(cfg.s2mel).estimator.eval()
+    dit.setup_caches(max_batch_size=2, max_seq_length=8192)
+    if args.mask == "full":
+        # the mask built before key padding masks: x_mask repeated to (B, 1, T, T)
+        forward = dit.transformer.forward
+
+        def full_mask_forward(x, c, input_pos, mask, *rest, **kwargs):
+            return forward(x, c, input_pos, mask.repeat(1, 1, x.size(1), 1), *rest, **kwargs)
+
+        dit.transformer.forward = full_mask_forward
+    frames = int((seconds + args.prompt_seconds) * MEL_FRAMES_PER_S)
+    generator = torch.Generator().manual_seed(1)
+    x = torch.randn(2, dit.in_channels, frames, generator=generator)
+    prompt_x = torch.zeros_like(x)
+    prompt_frames = int(args.prompt_seconds * MEL_FRAMES_PER_S)
+    prompt_x[..., :prompt_frames] = torch.randn(2, dit.in_channels, prompt_frames, generator=generator)
+    style = torch.randn(2, 192, generator=generator)
+    cond = torch.randn(2, frames, dit.content_dim, generator=generator)
+    x_lens = torch.LongTensor([frames])
+    t = torch.full((2,), 0.4)
+    before = _peak_rss_mb()
+    with torch.no_grad():
+        start = time.perf_counter()
+        dit(x, prompt_x, x_lens, t, style, cond)
+        elapsed = time.perf_counter() - start
+    peak = _peak_rss_mb()
+    print(json.dumps({"seconds": seconds, "frames": frames, "mask": args.mask, "peak_rss_mb": round(peak, 1),
+                      "step_rss_mb": round(peak - before, 1), "step_s": round(elapsed, 2)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak RSS of a guided s2mel DiT step: (B, 1, T, T) vs key padding mask")
+    parser.add_argument("--model_dir", type=str, default=str(ROOT / "checkpoints"))
+    parser.add_argument("--seconds", type=float, nargs="+", default=[10, 30, 60], help="generated audio per segment")
+    parser.add_argument("--prompt_seconds", type=float, default=10)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--mask", type=str, choices=["full", "key"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mask is not None:
+        _child(args)
+        return
+    runs = []
+    for seconds in args.seconds:
+        row = {"seconds": seconds}
+        for mask in ("full", "key"):
+            # a fresh process per run: ru_maxrss never goes down
+            out = subprocess.run([sys.executable, __file__, "--model_dir", args.model_dir, "--seconds", str(seconds),
+                                  "--prompt_seconds", str(args.prompt_seconds), "--threads", str(args.threads),
+                                  "--mask", mask], capture_output=True, text=True, check=True).stdout
+            result = json.loads(out.strip().splitlines()[-1])
+            row["frames"] = result["frames"]
+            row[mask] = {k: result[k] for k in ("peak_rss_mb", "step_rss_mb", "step_s")}
+        row["step_rss_saving_mb"] = round(row["full"]["step_rss_mb"] - row["key"]["step_rss_mb"], 1)
+        runs.append(row)
+    print(json.dumps({"config": vars(args), "runs": runs}, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import torch
+from omegaconf import OmegaConf
+from torch.profiler import ProfilerActivity, profile
+from torch.utils.flop_counter import FlopCounterMode
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from indextts.s2mel.modules.flow_matching import CFM
+
+
+def _build_dit(model_dir):
+    cfg = OmegaConf.load(os.path.join(model_dir, "config.yaml"))
+    torch.manual_seed(0)
+    dit = CFM(cfg.s2mel).estimator.eval()
+    dit.setup_caches(max_batch_size=2, max_seq_length=8192)
+    return dit
+
+
+def _per_step_ms(fn, steps):
+    fn()  # warm-up
+    start = time.perf_counter()
+    for _ in range(steps):
+        fn()
+    return (time.perf_counter() - start) / steps * 1e3
+
+
+def _gflops(fn):
+    counter = FlopCounterMode(display=False)
+    with counter:
+        fn()
+    return counter.get_total_flops() / 1e9
+
+
+def _top_ops(fn, steps, top):
+    """Self CPU time per step of the most expensive aten ops."""
+    with profile(activities=[ProfilerActivity.CPU]) as prof:
+        for _ in range(steps):
+            fn()
+    averages = sorted(prof.key_averages(), key=lambda e: e.self_cpu_time_total, reverse=True)[:top]
+    return [{"op": e.key, "calls_per_step": e.count // steps, "self_ms_per_step": round(e.self_cpu_time_total / steps / 1e3, 3)}
+            for e in averages]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DiT step: forward() vs prepared conditioning + forward_prepared() (CPU)")
+    parser.add_argument("--model_dir", type=str, default=str(ROOT / "checkpoints"))
+    parser.add_argument("--frames", type=int, nargs="+", default=[300, 800])
+    parser.add_argument("--prompt_frames", type=int, default=150)
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    dit = _build_dit(args.model_dir)
+    generator = torch.Generator().manual_seed(1)
+    report = {"config": vars(args), "runs": []}
+    for frames in args.frames:
+        for rows in (2, 1):  # guided (conditional + null) and unguided steps
+            x = torch.randn(rows, dit.in_channels, frames, generator=generator)
+            prompt_x = torch.zeros_like(x)
+            prompt_x[..., :args.prompt_frames] = torch.randn(rows, dit.in_channels, args.prompt_frames, generator=generator)
+            style = torch.randn(rows, 192, generator=generator)
+            cond = torch.randn(rows, frames, dit.content_dim, generator=generator)
+            x_lens = torch.LongTensor([frames])
+            t = torch.full((rows,), 0.4)
+
+            with torch.no_grad():
+                def before():
+                    return dit(x, prompt_x, x_lens, t, style, cond)
+
+                start = time.perf_counter()
+                prepared = dit.prepare_conditioning(prompt_x, x_lens, style, cond)
+                t1, t2 = dit.embed_timesteps(t[:1])
+                prepare_ms = (time.perf_counter() - start) * 1e3
+                t1, t2 = t1.expand(rows, -1), t2.expand(rows, -1) if t2 is not None else None
+
+                def after():
+                    return dit.forward_prepared(x, prepared, t1, t2)
+
+                max_diff = float((before() - after()).abs().max())
+                before_ms = _per_step_ms(before, args.steps)
+                after_ms = _per_step_ms(after, args.steps)
+                report["runs"].append({
+                    "frames": frames,
+                    "rows": rows,
+                    "before_ms_per_step": round(before_ms, 2),
+                    "after_ms_per_step": round(after_ms, 2),
+                    "saving": round(1 - after_ms / before_ms, 3),
+                    "before_gflops_per_step": round(_gflops(before), 2),
+                    "after_gflops_per_step": round(_gflops(after), 2),
+                    # paid once per segment (and row set) instead of every step
+                    "prepare_ms": round(prepare_ms, 2),
+                    "max_abs_diff": max_diff,
+                    "profile_before": _top_ops(before, args.steps, args.top),
+                    "profile_after": _top_ops(after, args.steps, args.top),
+                })
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import argparse
+import contextlib
+import copy
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import torch
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from indextts.gpt.model_v2 import UnifiedVoice
+from indextts.gpt.quantize import QUANT_MODES, load_quantized_gpt, quantize_gpt, save_quantized_gpt
+
+
+def _build_model(args):
+    if args.model_dir:
+        from omegaconf import OmegaConf
+
+        from indextts.utils.checkpoint import load_checkpoint
+
+        cfg = OmegaConf.load(os.path.join(args.model_dir, "config.yaml"))
+        model = UnifiedVoice(**cfg.gpt)
+        load_checkpoint(model, os.path.join(args.model_dir, cfg.gpt_checkpoint))
+    else:
+        torch.manual_seed(0)
+        conformer = dict(output_size=256, linear_units=512, attention_heads=4, num_blocks=1,
+                         input_layer="conv2d2", perceiver_mult=2)
+        model = UnifiedVoice(layers=args.layers, model_dim=args.dim, heads=args.heads, max_text_tokens=120,
+                             max_mel_tokens=args.tokens + 1, number_text_tokens=1000, number_mel_codes=8194,
+                             start_mel_token=8192, stop_mel_token=8193, condition_type="conformer_perceiver",
+                             condition_module=conformer, emo_condition_module=dict(conformer))
+        # random weights never settle on the stop token: every run decodes the full length
+        model.mel_head.bias.data[model.stop_mel_token] = -1e4
+    model.eval()
+    model.post_init_gpt2_config(kv_cache=True, static_kv_cache=True)
+    return model
+
+
+def _block_megabytes(model):
+    tensors = list(model.gpt.h.parameters()) + list(model.gpt.h.buffers())  # after a forward: as served
+    return round(sum(t.numel() * t.element_size() for t in tensors) / 1024 ** 2, 1)
+
+
+def _generate(model, inputs, tokens):
+    """Greedy codes and wall time; also returns the GPT prompt (ids, mask) seen by the first forward."""
+    cond, emo_vec, text = inputs
+    prompt = {}
+
+    def capture(_, args, kwargs):
+        prompt.setdefault("input_ids", kwargs.get("input_ids"))
+        prompt.setdefault("attention_mask", kwargs.get("attention_mask"))
+
+    hook = model.inference_model.register_forward_pre_hook(capture, with_kwargs=True)
+    try:
+        with torch.no_grad(), contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            codes, _ = model.inference_speech(cond, text, cond_lengths=torch.tensor([cond.shape[1]]),
+                                              emo_vec=emo_vec, max_generate_length=tokens, do_sample=False)
+            elapsed = time.perf_counter() - start
+    finally:
+        hook.remove()
+    return codes[0], elapsed, prompt
+
+
+@torch.no_grad()
+def _teacher_forced_agreement(model, prompt, reference):
+    """Share of positions where the model's argmax matches the reference code, fed the reference prefix."""
+    im = model.inference_model
+    ids, mask = prompt["input_ids"], prompt["attention_mask"]
+    out = im(input_ids=ids, attention_mask=mask, use_cache=True, return_dict=True)
+    predictions = [out.logits[0, -1].argmax()]
+    cache = out.past_key_values
+    for code in reference[:-1]:
+        mask = torch.cat([mask, mask.new_ones(1, 1)], dim=1)
+        out = im(input_ids=code.view(1, 1), attention_mask=mask, past_key_values=cache, use_cache=True,
+                 return_dict=True)
+        predictions.append(out.logits[0, -1].argmax())
+    return float((torch.stack(predictions) == reference).float().mean())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="fp32 vs weight-only int8/int4 UnifiedVoice GPT on CPU")
+    parser.add_argument("--model_dir", type=str, default=None,
+                        help="Use the real GPT from this checkpoints directory instead of random weights")
+    parser.add_argument("--layers", type=int, default=8)
+    parser.add_argument("--dim", type=int, default=1280)
+    parser.add_argument("--heads", type=int, default=20)
+    parser.add_argument("--tokens", type=int, default=100)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    model = _build_model(args)
+    generator = torch.Generator().manual_seed(1)
+    inputs = (torch.randn(1, 120, 1024, generator=generator), torch.randn(1, model.model_dim, generator=generator),
+              torch.randint(2, 900, (1, 60), generator=generator))
+    _generate(model, inputs, 8)  # warm-up
+    reference, fp32_s, _ = _generate(model, inputs, args.tokens)
+    report = {"config": vars(args),
+              "fp32": {"block_mb": _block_megabytes(model), "tokens_per_s": round(len(reference) / fp32_s, 2)}}
+
+    for mode in QUANT_MODES:
+        quantized = copy.deepcopy(model)
+        quantize_gpt(quantized, mode)
+        with tempfile.TemporaryDirectory() as tmp:
+            # round trip through the saved format, as served
+            path = os.path.join(tmp, f"gpt_{mode}.pth")
+            save_quantized_gpt(quantized, path)
+            size_mb = os.path.getsize(path) / 1024 ** 2
+            loaded = copy.deepcopy(model)
+            load_quantized_gpt(loaded, path)
+        del quantized
+        _generate(loaded, inputs, 8)  # warm-up, packs the int4 weights
+        codes, elapsed, prompt = _generate(loaded, inputs, args.tokens)
+        n = min(len(codes), len(reference))
+        mismatch = (codes[:n] != reference[:n]).nonzero()
+        report[mode] = {
+            "block_mb": _block_megabytes(loaded),
+            "file_mb": round(size_mb, 1),
+            "tokens_per_s": round(len(codes) / elapsed, 2),
+            "speedup": round(fp32_s / len(reference) / (elapsed / len(codes)), 2),
+            # free-running greedy decoding: codes before the first divergence, and overall positional agreement
+            "identical_prefix": int(mismatch[0]) if len(mismatch) else n,
+            "free_running_agreement": round(float((codes[:n] == reference[:n]).float().mean()), 3),
+            # fed the fp32 codes: how often the quantized model picks the same next code
+            "teacher_forced_agreement": round(_teacher_forced_agreement(loaded, prompt, reference), 3),
+        }
+        del loaded
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
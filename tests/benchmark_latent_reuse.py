@@ -0,0 +1,128 @@
+import argparse
+import contextlib
+import io
+import json
+import sys
+import time
+from pathlib import Path
+
+import torch
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from indextts.gpt.model_v2 import UnifiedVoice
+from indextts.utils.common import remove_long_silence
+
+
+def _build_model(layers, dim, heads, max_mel_tokens):
+    torch.manual_seed(0)
+    conformer = dict(output_size=512, linear_units=2048, attention_heads=8, num_blocks=6,
+                     input_layer="conv2d2", perceiver_mult=2)
+    model = UnifiedVoice(layers=layers, model_dim=dim, heads=heads, max_text_tokens=120,
+                         max_mel_tokens=max_mel_tokens, number_text_tokens=1000, number_mel_codes=8194,
+                         start_mel_token=8192, stop_mel_token=8193, condition_type="conformer_perceiver",
+                         condition_module=conformer, emo_condition_module=dict(conformer))
+    model.post_init_gpt2_config(kv_cache=True, static_kv_cache=True)
+    # random weights never settle on the stop token: every run decodes the full length
+    model.mel_head.bias.data[model.stop_mel_token] = -1e4
+    return model.eval()
+
+
+def _best(fn, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return result, min(times)
+
+
+@torch.no_grad()
+def _latent_pass(model, cond, text, codes, code_lens):
+    """The per-segment GPT pass of ``IndexTTS.infer_fast``, conditioning encoders included."""
+    latents = []
+    cond_len = torch.tensor([cond.shape[1]])
+    for i in range(codes.shape[0]):
+        n = int(code_lens[i])
+        latents.append(model(cond, text[i:i + 1], torch.tensor([text.shape[1]]), codes[i:i + 1, :n],
+                             torch.tensor([n]), cond, cond_mel_lengths=cond_len, emo_cond_mel_lengths=cond_len,
+                             use_speed=torch.zeros(1, dtype=torch.long), do_spk_cond=True))
+    return latents
+
+
+@torch.no_grad()
+def _latent_pass_gpt_only(model, speech_latent, emo_vec, text, codes, code_lens):
+    """The per-segment GPT pass of ``IndexTTS2Pipeline.decode``: speaker latent and emotion vector precomputed."""
+    latents = []
+    for i in range(codes.shape[0]):
+        n = int(code_lens[i])
+        latents.append(model(speech_latent, text[i:i + 1], torch.tensor([text.shape[1]]), codes[i:i + 1, :n],
+                             torch.tensor([n]), None, emo_vec=emo_vec, use_speed=torch.zeros(1, dtype=torch.long)))
+    return latents
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Separate GPT latent pass vs latents from the generation prompt KV (CPU)")
+    parser.add_argument("--layers", type=int, default=8)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--heads", type=int, default=8)
+    parser.add_argument("--text_tokens", type=int, default=80)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--batch", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    model = _build_model(args.layers, args.dim, args.heads, args.tokens + 1)
+    generator = torch.Generator().manual_seed(1)
+    cond = torch.randn(1, 300, 1024, generator=generator)
+    cond_len = torch.tensor([cond.shape[1]])
+    with torch.no_grad():
+        # the emotion vector inference_speech derives from the speaker prompt, shared by the rows of a batch
+        emo_vec = model.emo_layer(model.emovec_layer(model.get_emo_conditioning(cond.transpose(1, 2), cond_len)))
+        speech_latent = model.get_conditioning(cond.transpose(1, 2), cond_len)
+
+    report = {"config": vars(args), "runs": []}
+    for batch in args.batch:
+        text = torch.randint(2, 900, (batch, args.text_tokens), generator=generator)
+
+        def generate():
+            torch.manual_seed(0)
+            with torch.no_grad(), contextlib.redirect_stdout(io.StringIO()):
+                codes, _ = model.inference_speech(cond, text, cond_lengths=cond_len, emo_vec=emo_vec.expand(batch, -1),
+                                                  do_sample=True, top_k=30, top_p=0.8, temperature=0.8,
+                                                  repetition_penalty=10.0, max_generate_length=args.tokens)
+            return remove_long_silence(codes, model.stop_mel_token)
+
+        (codes, code_lens), gen_s = _best(generate, args.repeats)
+        reference, latent_pass_s = _best(lambda: _latent_pass(model, cond, text, codes, code_lens), args.repeats)
+        _, gpt_only_s = _best(lambda: _latent_pass_gpt_only(model, speech_latent, emo_vec, text, codes, code_lens),
+                              args.repeats)
+        # the prompt KV of the last generate() is still in the static cache
+        reused, reuse_s = _best(lambda: model.latents_from_generation(codes), args.repeats)
+        max_diff = max(float((reused[i:i + 1, :int(code_lens[i])] - ref).abs().max())
+                       for i, ref in enumerate(reference))
+        report["runs"].append({
+            "batch": batch,
+            "codes_per_row": int(code_lens.max()),
+            "generate_s": round(gen_s, 3),
+            # infer_fast: conditioning encoders + GPT over conditioning, text and codes
+            "latent_pass_s": round(latent_pass_s, 3),
+            # IndexTTS2Pipeline.decode: GPT over conditioning, text and codes
+            "latent_pass_gpt_only_s": round(gpt_only_s, 3),
+            # GPT over the codes only
+            "reuse_s": round(reuse_s, 3),
+            "latent_speedup": round(latent_pass_s / reuse_s, 2),
+            "latent_speedup_gpt_only": round(gpt_only_s / reuse_s, 2),
+            # share of generate + latent wall time saved per batch
+            "end_to_end_saving": round((latent_pass_s - reuse_s) / (gen_s + latent_pass_s), 3),
+            "max_abs_diff": max_diff,
+        })
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
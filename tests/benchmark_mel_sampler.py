@@ -0,0 +1,122 @@
+import argparse
+import contextlib
+import io
+import json
+import sys
+import time
+from pathlib import Path
+
+import torch
+from transformers import (LogitsProcessorList, RepetitionPenaltyLogitsProcessor, TemperatureLogitsWarper,
+                          TopKLogitsWarper, TopPLogitsWarper)
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from indextts.gpt.model_v2 import UnifiedVoice
+from indextts.gpt.sampling import MelTokenSampler
+
+VOCAB = 8194
+# the WebUI sampling settings
+SAMPLING = dict(top_k=30, top_p=0.8, temperature=0.8, repetition_penalty=10.0)
+
+
+def _per_step_us(fn, steps):
+    fn()  # warm-up
+    start = time.perf_counter()
+    for _ in range(steps):
+        fn()
+    return (time.perf_counter() - start) / steps * 1e6
+
+
+def _microbenchmark(rows, history, steps):
+    """One sampling step of generate() (processors over the history) vs MelTokenSampler (presence bitmap)."""
+    generator = torch.Generator().manual_seed(0)
+    logits = torch.randn(rows, VOCAB, generator=generator)
+    input_ids = torch.randint(0, VOCAB, (rows, history), generator=generator)
+    seen = torch.zeros(rows, VOCAB, dtype=torch.bool).scatter_(1, input_ids, True)
+    identity = torch.arange(rows)
+    processors = LogitsProcessorList([RepetitionPenaltyLogitsProcessor(SAMPLING["repetition_penalty"]),
+                                      TemperatureLogitsWarper(SAMPLING["temperature"]),
+                                      TopKLogitsWarper(SAMPLING["top_k"]), TopPLogitsWarper(SAMPLING["top_p"])])
+    sampler = MelTokenSampler(**SAMPLING)
+
+    def hf_step():
+        scores = processors(input_ids, logits.clone())
+        return torch.multinomial(scores.softmax(dim=-1), num_samples=1).squeeze(1)
+
+    def fused_step():
+        tokens = sampler(logits, seen)
+        seen[identity, tokens] = True
+        return tokens
+
+    hf_us = _per_step_us(hf_step, steps)
+    fused_us = _per_step_us(fused_step, steps)
+    return {"rows": rows, "history": history, "hf_us": round(hf_us, 1), "fused_us": round(fused_us, 1),
+            "speedup": round(hf_us / fused_us, 2)}
+
+
+def _decode(args):
+    """Whole generation of one batch with generate() on the static cache vs the fused decoder."""
+    torch.manual_seed(0)
+    conformer = dict(output_size=256, linear_units=512, attention_heads=4, num_blocks=1,
+                     input_layer="conv2d2", perceiver_mult=2)
+    model = UnifiedVoice(layers=args.layers, model_dim=args.dim, heads=args.heads, max_text_tokens=120,
+                         max_mel_tokens=args.tokens + 1, number_text_tokens=1000, number_mel_codes=VOCAB,
+                         start_mel_token=8192, stop_mel_token=8193, condition_type="conformer_perceiver",
+                         condition_module=conformer, emo_condition_module=dict(conformer)).eval()
+    model.post_init_gpt2_config(kv_cache=True, static_kv_cache=True)
+    # random weights never settle on the stop token: every run decodes the full length
+    model.mel_head.bias.data[model.stop_mel_token] = -1e4
+    generator = torch.Generator().manual_seed(1)
+    cond = torch.randn(1, 120, 1024, generator=generator)
+    results = []
+    for batch in args.batch:
+        emo_vec = torch.randn(batch, args.dim, generator=generator)
+        text = torch.randint(2, 900, (batch, 60), generator=generator)
+
+        def run(tokens):
+            with torch.no_grad(), contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                codes, _ = model.inference_speech(cond, text, cond_lengths=torch.tensor([cond.shape[1]]),
+                                                  emo_vec=emo_vec, max_generate_length=tokens, do_sample=True,
+                                                  **SAMPLING)
+                return codes, time.perf_counter() - start
+
+        row = {"batch": batch}
+        for path in ("hf_static", "fused"):
+            model.enable_fused_sampling(path == "fused")
+            model.enable_static_kv_cache(True)
+            run(16)  # warm-up
+            codes, elapsed = min((run(args.tokens) for _ in range(args.repeats)), key=lambda r: r[1])
+            row[path] = {"total_s": round(elapsed, 3), "ms_per_step": round(elapsed / codes.shape[1] * 1e3, 2)}
+        row["speedup"] = round(row["hf_static"]["total_s"] / row["fused"]["total_s"], 2)
+        results.append(row)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HF logits processors vs the fused MelTokenSampler (CPU)")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--history", type=int, nargs="+", default=[100, 600])
+    parser.add_argument("--steps", type=int, default=200)
+    parser.add_argument("--layers", type=int, default=8)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--heads", type=int, default=8)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--batch", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    report = {"config": vars(args), "sampling": SAMPLING,
+              "per_step": [_microbenchmark(rows, history, args.steps) for rows in args.rows
+                           for history in args.history],
+              "decode": _decode(args)}
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import torch
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+# the per-row reference and the inputs of tests/test_prepare_gpt_inputs.py, which checks both are bit-identical
+from test_prepare_gpt_inputs import build_model, prepare_gpt_inputs_loop, text_batch
+
+
+def _time(fn, repeats):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Loop vs tensorized UnifiedVoice.prepare_gpt_inputs")
+    parser.add_argument("--dim", type=int, default=1280)
+    parser.add_argument("--text_len", type=int, default=120)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    model = build_model(args.dim).to(args.device)
+    generator = torch.Generator().manual_seed(0)
+    with torch.no_grad():
+        timings = []
+        for b in (1, 4, 8, 16, 32):
+            text = text_batch(model, b, args.text_len, generator).to(args.device)
+            conds = torch.randn(1, 34, args.dim, generator=generator).to(args.device)
+            sync = torch.cuda.synchronize if args.device.startswith("cuda") else (lambda: None)
+
+            def loop():
+                prepare_gpt_inputs_loop(model, conds, text)
+                sync()
+
+            def tensorized():
+                model.prepare_gpt_inputs(conds, text)
+                sync()
+
+            loop_ms, vec_ms = _time(loop, args.repeats), _time(tensorized, args.repeats)
+            timings.append({"batch": b, "loop_ms": round(loop_ms, 3), "tensorized_ms": round(vec_ms, 3),
+                            "speedup": round(loop_ms / vec_ms, 2)})
+    print(json.dumps({"config": vars(args), "timings": timings}, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
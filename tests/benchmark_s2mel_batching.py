@@ -0,0 +1,101 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import torch
+from omegaconf import OmegaConf
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from indextts.s2mel.modules.flow_matching import CFM
+
+# the settings of IndexTTS2Pipeline.s2mel
+INFERENCE_CFG_RATE = 0.7
+
+
+def _build_cfm(model_dir):
+    """The s2mel CFM of ``model_dir/config.yaml``, with the trained weights when ``s2mel.pth`` is there."""
+    cfg = OmegaConf.load(os.path.join(model_dir, "config.yaml"))
+    torch.manual_seed(0)
+    cfm = CFM(cfg.s2mel)
+    checkpoint = os.path.join(model_dir, cfg.get("s2mel_checkpoint", "s2mel.pth"))
+    trained = os.path.exists(checkpoint)
+    if trained:
+        params = torch.load(checkpoint, map_location="cpu")["net"]["cfm"]
+        params = {k[len("module."):] if k.startswith("module.") else k: v for k, v in params.items()}
+        cfm.load_state_dict(params, strict=False)
+    cfm.estimator.setup_caches(max_batch_size=2, max_seq_length=8192)
+    return cfm.eval(), trained
+
+
+def _solve(cfm, conditions, prompt, style, steps):
+    """IndexTTS2Pipeline.s2mel_batch: rows right padded to the longest, prompt mel and style broadcast."""
+    rows = len(conditions)
+    lengths = [c.size(1) for c in conditions]
+    mu = conditions[0].new_zeros(rows, max(lengths), conditions[0].size(2))
+    for i, c in enumerate(conditions):
+        mu[i, :lengths[i]] = c[0]
+    with contextlib.redirect_stderr(io.StringIO()):  # tqdm
+        cfm.inference(mu, torch.LongTensor(lengths), prompt.expand(rows, -1, -1), style.expand(rows, -1), None,
+                      steps, inference_cfg_rate=INFERENCE_CFG_RATE)
+
+
+def _run(cfm, conditions, prompt, style, steps, batch_size):
+    """All segments, longest first, ``batch_size`` per CFM call (as ``IndexTTS2Pipeline.decode_batch``)."""
+    order = sorted(conditions, key=lambda c: -c.size(1))
+    prompt_frames = prompt.size(-1)
+    frames = padded = 0
+    start = time.perf_counter()
+    for b in range(0, len(order), batch_size):
+        chunk = order[b:b + batch_size]
+        _solve(cfm, chunk, prompt, style, steps)
+        width = max(c.size(1) for c in chunk)
+        frames += sum(c.size(1) - prompt_frames for c in chunk)
+        padded += sum(width - c.size(1) for c in chunk)
+    elapsed = time.perf_counter() - start
+    return {"batch_size": batch_size, "cfm_calls": -(-len(order) // batch_size),
+            "padding_ratio": round(padded / (frames + padded), 3), "time_s": round(elapsed, 3),
+            "frames_per_s": round(frames / elapsed, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="s2mel throughput of padded segment batches vs one segment per call")
+    parser.add_argument("--model_dir", type=str, default=str(ROOT / "checkpoints"),
+                        help="config.yaml and, if present, s2mel.pth (random weights otherwise)")
+    parser.add_argument("--segments", type=int, default=8)
+    parser.add_argument("--min_frames", type=int, default=150, help="generated mel frames of the shortest segment")
+    parser.add_argument("--max_frames", type=int, default=450)
+    parser.add_argument("--prompt_frames", type=int, default=100)
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=list(range(1, 9)))
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    cfm, trained = _build_cfm(args.model_dir)
+    generator = torch.Generator().manual_seed(args.seed)
+    lengths = torch.randint(args.min_frames, args.max_frames + 1, (args.segments,), generator=generator).tolist()
+    conditions = [torch.randn(1, args.prompt_frames + n, cfm.estimator.content_dim, generator=generator)
+                  for n in lengths]
+    prompt = torch.randn(1, cfm.in_channels, args.prompt_frames, generator=generator)
+    style = torch.randn(1, 192, generator=generator)
+
+    with torch.no_grad():
+        _solve(cfm, conditions[:2], prompt, style, 2)  # warm-up
+        runs = [_run(cfm, conditions, prompt, style, args.steps, batch_size) for batch_size in args.batch_sizes]
+    for run in runs:
+        run["speedup"] = round(run["frames_per_s"] / runs[0]["frames_per_s"], 2)
+    report = {"config": vars(args), "trained_weights": trained, "segment_frames": lengths, "runs": runs}
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
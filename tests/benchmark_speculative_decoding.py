@@ -0,0 +1,102 @@
+import argparse
+import contextlib
+import io
+import json
+import sys
+import time
+from pathlib import Path
+
+import torch
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from indextts.gpt.model_v2 import UnifiedVoice
+
+
+def _build_model(layers, dim, heads, max_mel_tokens, upper_scale):
+    torch.manual_seed(0)
+    conformer = dict(output_size=dim, linear_units=dim * 2, attention_heads=heads, num_blocks=1,
+                     input_layer="conv2d2", perceiver_mult=2)
+    model = UnifiedVoice(layers=layers, model_dim=dim, heads=heads, max_text_tokens=120,
+                         max_mel_tokens=max_mel_tokens, number_text_tokens=1000, number_mel_codes=8194,
+                         start_mel_token=8192, stop_mel_token=8193, condition_type="conformer_perceiver",
+                         condition_module=conformer, emo_condition_module=dict(conformer))
+    model.post_init_gpt2_config(kv_cache=True)
+    # random weights never settle on the stop token: every run decodes the full length
+    model.mel_head.bias.data[model.stop_mel_token] = -1e4
+    # in a trained GPT the deep blocks only refine the residual stream; random blocks all rewrite it, which
+    # would make any truncated draft useless. Damp the residual branches of the upper half to mimic that.
+    for block in model.gpt.h[layers // 2:]:
+        block.attn.c_proj.weight.data *= upper_scale
+        block.mlp.c_proj.weight.data *= upper_scale
+    model.mel_head.weight.data *= 20  # peaked distributions, like a trained head
+    return model.eval()
+
+
+def _run(model, cond, emo_vec, text, tokens, sampling, seed):
+    torch.manual_seed(seed)
+    with torch.no_grad(), contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        codes, _ = model.inference_speech(cond, text, cond_lengths=torch.tensor([cond.shape[1]]), emo_vec=emo_vec,
+                                          max_generate_length=tokens, **sampling)
+        elapsed = time.perf_counter() - start
+    return codes, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plain vs self-speculative GPT mel-code decoding (CPU)")
+    parser.add_argument("--layers", type=int, default=12)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--heads", type=int, default=8)
+    parser.add_argument("--tokens", type=int, default=300)
+    parser.add_argument("--draft_layers", type=int, nargs="+", default=[3, 6])
+    parser.add_argument("--speculate_k", type=int, nargs="+", default=[2, 4])
+    parser.add_argument("--upper_scale", type=float, default=0.2)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    model = _build_model(args.layers, args.dim, args.heads, args.tokens + 1, args.upper_scale)
+    generator = torch.Generator().manual_seed(1)
+    cond = torch.randn(1, 120, 1024, generator=generator)
+    emo_vec = torch.randn(1, args.dim, generator=generator)
+    text = torch.randint(0, 900, (1, 60), generator=generator)
+    modes = {
+        "greedy": dict(do_sample=False),
+        "sampling": dict(do_sample=True, top_k=30, top_p=0.8, temperature=0.8, repetition_penalty=10.0),
+    }
+
+    report = {"config": vars(args)}
+    for name, sampling in modes.items():
+        model.enable_static_kv_cache(True)
+        model.speculative_decoder = None
+        _run(model, cond, emo_vec, text, 16, sampling, 0)  # warm-up
+        plain_codes, plain_s = _run(model, cond, emo_vec, text, args.tokens, sampling, 0)
+        rows = []
+        for draft_layers in args.draft_layers:
+            for k in args.speculate_k:
+                model.enable_speculative_decoding(draft_layers, k)
+                codes, elapsed = _run(model, cond, emo_vec, text, args.tokens, sampling, 0)
+                stats = model.speculative_decoder.last_stats
+                row = {
+                    "draft_layers": draft_layers,
+                    "speculate_k": k,
+                    "acceptance_rate": round(stats["acceptance_rate"], 3),
+                    "codes_per_full_forward": round(stats["tokens_per_target_forward"], 2),
+                    "estimated_speedup": round(stats["estimated_speedup"], 2),
+                    "total_s": round(elapsed, 3),
+                    "speedup": round(plain_s / elapsed, 2),
+                }
+                if name == "greedy":
+                    row["identical_to_plain"] = torch.equal(codes, plain_codes)
+                rows.append(row)
+        report[name] = {"plain_s": round(plain_s, 3), "tokens_per_s": round(args.tokens / plain_s, 1),
+                        "speculative": rows}
+    model.enable_speculative_decoding(0)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
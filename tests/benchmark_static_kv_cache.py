@@ -0,0 +1,80 @@
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import torch
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from indextts.gpt.model_v2 import UnifiedVoice
+
+
+def _build_model(layers, dim, heads, max_mel_tokens):
+    torch.manual_seed(0)
+    conformer = dict(output_size=dim, linear_units=dim * 2, attention_heads=heads, num_blocks=1,
+                     input_layer="conv2d2", perceiver_mult=2)
+    model = UnifiedVoice(layers=layers, model_dim=dim, heads=heads, max_text_tokens=120,
+                         max_mel_tokens=max_mel_tokens, number_text_tokens=1000, number_mel_codes=8194,
+                         start_mel_token=8192, stop_mel_token=8193, condition_type="conformer_perceiver",
+                         condition_module=conformer, emo_condition_module=dict(conformer))
+    model.post_init_gpt2_config(kv_cache=True)
+    return model.eval()
+
+
+def _per_token_latency(model, static, tokens, cond, emo_vec, text):
+    model.enable_static_kv_cache(static)
+    stamps = []
+    hook = model.inference_model.register_forward_hook(lambda *_: stamps.append(time.perf_counter()))
+    try:
+        with torch.no_grad():
+            t0 = time.perf_counter()
+            model.inference_speech(cond, text, cond_lengths=torch.tensor([cond.shape[1]]), emo_vec=emo_vec,
+                                   max_generate_length=tokens, min_new_tokens=tokens, do_sample=False)
+    finally:
+        hook.remove()
+    # first forward is the prompt prefill; the rest are one decoded token each
+    steps = [b - a for a, b in zip(stamps, stamps[1:])]
+    return stamps[0] - t0, steps
+
+
+def _buckets(steps, size):
+    return [round(sum(steps[i:i + size]) / len(steps[i:i + size]) * 1000, 3) for i in range(0, len(steps), size)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-token GPT decoding latency, dynamic vs static KV cache (CPU)")
+    parser.add_argument("--layers", type=int, default=8)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--heads", type=int, default=8)
+    parser.add_argument("--tokens", type=int, default=1200)
+    parser.add_argument("--bucket", type=int, default=100)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    model = _build_model(args.layers, args.dim, args.heads, args.tokens + 1)
+    cond = torch.randn(1, 120, 1024)
+    emo_vec = torch.randn(1, args.dim)
+    text = torch.randint(0, 900, (1, 60))
+
+    _per_token_latency(model, True, 32, cond, emo_vec, text)  # warm-up
+    report = {"config": vars(args)}
+    for name, static in (("dynamic", False), ("static", True)):
+        prefill, steps = _per_token_latency(model, static, args.tokens, cond, emo_vec, text)
+        buckets = _buckets(steps, args.bucket)
+        report[name] = {
+            "prefill_ms": round(prefill * 1000, 2),
+            "tokens": len(steps),
+            "total_s": round(sum(steps), 3),
+            f"ms_per_token_by_{args.bucket}_tokens": buckets,
+            "last_over_first_bucket": round(buckets[-1] / buckets[0], 3),
+        }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
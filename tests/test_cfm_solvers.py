@@ -0,0 +1,265 @@
+import contextlib
+import io
+import math
+import sys
+import unittest
+from pathlib import Path
+
+import torch
+from omegaconf import OmegaConf
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from indextts.s2mel.modules.flow_matching import BASECFM, CFG_MODES, CFG_PRESETS, CFM, CFM_SOLVERS, T_SCHEDULES
+
+CHANNELS, FRAMES, PROMPT = 4, 12, 3
+CHANNELS_MEL = 80
+# least error ratio from 8 to 32 steps: first order for euler (4x), second order for the others (16x)
+MIN_RATIO = {"euler": 3.0, "heun": 12.0, "midpoint": 12.0, "dpm": 12.0}
+
+
+def _velocity(t, x):
+    return t * x + 0.5 * math.sin(3 * t)
+
+
+class AnalyticEstimator(torch.nn.Module):
+    """dx/dt = t x + 0.5 sin(3t): smooth, nonlinear in t, and ignores the conditioning (so CFG is a no-op)."""
+
+    def forward(self, x, prompt_x, x_lens, t, style, mu):
+        return x * t.view(-1, 1, 1) + 0.5 * torch.sin(3 * t).view(-1, 1, 1)
+
+
+class GuidedEstimator(AnalyticEstimator):
+    """Adds the mean of the style: the guidance delta ``cond - null`` is the same at every step."""
+
+    def forward(self, x, prompt_x, x_lens, t, style, mu):
+        return super().forward(x, prompt_x, x_lens, t, style, mu) + style.mean(dim=1).view(-1, 1, 1)
+
+
+def _cfm(estimator):
+    cfm = BASECFM(OmegaConf.create({"DiT": {"in_channels": CHANNELS}, "reg_loss_type": "l1"}))
+    cfm.estimator = estimator
+    return cfm
+
+
+def _rk4(x, steps=4000):
+    t, h = 0.0, 1.0 / steps
+    for _ in range(steps):
+        k1 = _velocity(t, x)
+        k2 = _velocity(t + h / 2, x + h / 2 * k1)
+        k3 = _velocity(t + h / 2, x + h / 2 * k2)
+        k4 = _velocity(t + h, x + h * k3)
+        x = x + h / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+        t += h
+    return x
+
+
+class CFMSolverTest(unittest.TestCase):
+    """The solvers must converge to the ODE solution at their order, with the prompt frames left at zero."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cfm = _cfm(AnalyticEstimator())
+        generator = torch.Generator().manual_seed(0)
+        cls.x0 = torch.randn(1, CHANNELS, FRAMES, generator=generator, dtype=torch.float64)
+        cls.exact = _rk4(cls.x0[..., PROMPT:].clone())
+        cls.prompt = torch.randn(1, CHANNELS, PROMPT, generator=generator, dtype=torch.float64)
+        cls.mu = torch.zeros(1, FRAMES, 8, dtype=torch.float64)
+        cls.style = torch.zeros(1, 16, dtype=torch.float64)
+
+    def _solve(self, solver, schedule, steps, cfg_rate=0.7):
+        t_span = self.cfm.make_t_span(steps, t_schedule=schedule).double()
+        with contextlib.redirect_stderr(io.StringIO()):  # tqdm
+            return getattr(self.cfm, f"solve_{solver}")(self.x0.clone(), None, self.prompt, self.mu, self.style,
+                                                        None, t_span, cfg_rate)
+
+    def test_convergence_order(self):
+        for solver in CFM_SOLVERS:
+            for schedule in T_SCHEDULES:
+                with self.subTest(solver=solver, schedule=schedule):
+                    errors = []
+                    for steps in (8, 32):
+                        out = self._solve(solver, schedule, steps)
+                        self.assertEqual(float(out[..., :PROMPT].abs().max()), 0.0)
+                        errors.append(float((out[..., PROMPT:] - self.exact).abs().max()))
+                    self.assertGreater(errors[0] / errors[1], MIN_RATIO[solver])
+
+    def test_cfg_off_matches_cfg_on(self):
+        # the estimator ignores the conditioning, so the guided velocity equals the plain one
+        for solver in CFM_SOLVERS:
+            with self.subTest(solver=solver):
+                torch.testing.assert_close(self._solve(solver, "uniform", 6, cfg_rate=0),
+                                           self._solve(solver, "uniform", 6))
+
+    def test_schedules(self):
+        uniform = self.cfm.make_t_span(10, t_schedule="uniform")
+        sway = self.cfm.make_t_span(10, t_schedule="sway")
+        torch.testing.assert_close(uniform, torch.linspace(0, 1, 11))
+        self.assertAlmostEqual(float(sway[0]), 0.0)
+        self.assertAlmostEqual(float(sway[-1]), 1.0, places=6)
+        self.assertTrue(bool((sway.diff() > 0).all()))
+        # the default sway coefficient puts the early steps closer together
+        self.assertLess(float(sway[1]), float(uniform[1]))
+
+    def test_set_solver(self):
+        self.assertEqual((self.cfm.solver, self.cfm.t_schedule), ("euler", "uniform"))
+        with self.assertRaises(ValueError):
+            self.cfm.set_solver("rk45")
+        with self.assertRaises(ValueError):
+            self.cfm.set_solver("heun", "cosine")
+        self.assertEqual((self.cfm.solver, self.cfm.t_schedule), ("euler", "uniform"))
+
+
+class CFGScheduleTest(unittest.TestCase):
+    """Guidance only runs inside the preset's range of t; outside it the delta is reused or dropped."""
+
+    def setUp(self):
+        self.cfm = _cfm(GuidedEstimator())
+        generator = torch.Generator().manual_seed(1)
+        self.x0 = torch.randn(1, CHANNELS, FRAMES, generator=generator, dtype=torch.float64)
+        self.prompt = torch.randn(1, CHANNELS, PROMPT, generator=generator, dtype=torch.float64)
+        self.mu = torch.zeros(1, FRAMES, 8, dtype=torch.float64)
+        self.style = torch.ones(1, 16, dtype=torch.float64)
+
+    def _solve(self, solver="euler", steps=10, cfg_rate=0.7):
+        t_span = self.cfm.make_t_span(steps).double()
+        with contextlib.redirect_stderr(io.StringIO()):  # tqdm
+            return getattr(self.cfm, f"solve_{solver}")(self.x0.clone(), None, self.prompt, self.mu, self.style,
+                                                        None, t_span, cfg_rate)
+
+    def test_estimator_rows(self):
+        # euler over 10 steps evaluates t = 0, 0.1, ..., 0.9
+        expected = {"full": 10, "early": 6, "middle": 5}
+        for preset in CFG_PRESETS:
+            for mode in CFG_MODES:
+                with self.subTest(preset=preset, mode=mode):
+                    self.cfm.set_cfg_schedule(preset, mode)
+                    self._solve()
+                    self.assertEqual(self.cfm.last_stats, {"estimator_calls": 10, "guided_calls": expected[preset],
+                                                           "estimator_rows": 10 + expected[preset]})
+        self._solve(cfg_rate=0)
+        self.assertEqual(self.cfm.last_stats["estimator_rows"], 10)
+
+    def test_reuse_and_skip(self):
+        for solver in CFM_SOLVERS:
+            with self.subTest(solver=solver):
+                self.cfm.set_cfg_schedule("full")
+                guided = self._solve(solver)
+                self.cfm.set_cfg_schedule("early", "reuse")
+                # the delta is constant here, so reusing it gives the fully guided trajectory
+                torch.testing.assert_close(self._solve(solver), guided)
+                self.cfm.set_cfg_schedule("early", "skip")
+                self.assertGreater(float((self._solve(solver) - guided).abs().max()), 1e-3)
+
+    def test_invalid_schedule(self):
+        with self.assertRaises(ValueError):
+            self.cfm.set_cfg_schedule("late")
+        with self.assertRaises(ValueError):
+            self.cfm.set_cfg_schedule("early", "interpolate")
+
+
+def _tiny_s2mel_args(**dit):
+    """checkpoints/config.yaml's s2mel section, shrunk."""
+    args = OmegaConf.load(ROOT / "checkpoints" / "config.yaml").s2mel
+    args.DiT.update(hidden_dim=64, num_heads=4, depth=3, content_dim=32, **dit)
+    args.wavenet.update(hidden_dim=64, num_layers=2)
+    return args
+
+
+class PreparedConditioningTest(unittest.TestCase):
+    """``DiT.forward_prepared`` with the hoisted conditioning must match ``DiT.forward``."""
+
+    def _inputs(self, rows, frames=40, prompt=15):
+        generator = torch.Generator().manual_seed(2)
+        x = torch.randn(rows, CHANNELS_MEL, frames, generator=generator)
+        prompt_x = torch.zeros_like(x)
+        prompt_x[..., :prompt] = torch.randn(rows, CHANNELS_MEL, prompt, generator=generator)
+        return (x, prompt_x, torch.LongTensor([frames]), torch.randn(rows, 192, generator=generator),
+                torch.randn(rows, frames, 32, generator=generator))
+
+    def test_matches_forward(self):
+        for dit in (dict(), dict(final_layer_type="mlp")):
+            torch.manual_seed(0)
+            cfm = CFM(_tiny_s2mel_args(**dit)).eval()
+            cfm.estimator.setup_caches(max_batch_size=2, max_seq_length=128)
+            for rows in (1, 2):
+                with self.subTest(rows=rows, **dit), torch.no_grad():
+                    x, prompt_x, x_lens, style, cond = self._inputs(rows)
+                    t = torch.full((rows,), 0.3)
+                    expected = cfm.estimator(x, prompt_x, x_lens, t, style, cond)
+                    prepared = cfm.estimator.prepare_conditioning(prompt_x, x_lens, style, cond)
+                    t1, t2 = cfm.estimator.embed_timesteps(t)
+                    actual = cfm.estimator.forward_prepared(x, prepared, t1, t2)
+                    torch.testing.assert_close(actual, expected, atol=1e-5, rtol=0)
+
+    def test_solve_matches_unprepared_estimator(self):
+        torch.manual_seed(0)
+        cfm = CFM(_tiny_s2mel_args()).eval()
+        cfm.estimator.setup_caches(max_batch_size=2, max_seq_length=128)
+        x, prompt_x, x_lens, style, mu = self._inputs(1)
+        prompt = prompt_x[..., :15]
+
+        def solve():
+            with torch.no_grad(), contextlib.redirect_stderr(io.StringIO()):  # tqdm
+                return cfm.solve_heun(x.clone(), x_lens, prompt, mu.clone(), style, None, cfm.make_t_span(4), 0.7)
+
+        prepared = solve()
+        # the plain estimator call path, as for estimators without prepare_conditioning
+        cfm.estimator.prepare_conditioning = None
+        torch.testing.assert_close(prepared, solve(), atol=1e-5, rtol=0)
+
+    def test_key_padding_mask_matches_full_mask(self):
+        torch.manual_seed(0)
+        cfm = CFM(_tiny_s2mel_args()).eval()
+        cfm.estimator.setup_caches(max_batch_size=2, max_seq_length=128)
+        x, prompt_x, _, style, cond = self._inputs(2)
+        x_lens, t = torch.LongTensor([40, 27]), torch.full((2,), 0.3)
+        with torch.no_grad():
+            expected = cfm.estimator(x, prompt_x, x_lens, t, style, cond)
+            # the (B, 1, T, T) mask the DiT built before
+            forward = cfm.estimator.transformer.forward
+            cfm.estimator.transformer.forward = lambda x, c, input_pos, mask: forward(
+                x, c, input_pos, mask.repeat(1, 1, x.size(1), 1))
+            actual = cfm.estimator(x, prompt_x, x_lens, t, style, cond)
+        torch.testing.assert_close(actual, expected, atol=1e-5, rtol=0)
+
+
+class BatchedSolveTest(unittest.TestCase):
+    """Right padded segments solved as one batch must match the segments solved one by one."""
+
+    def test_matches_single_rows(self):
+        # [40, 39, 38]: rows one and two frames short of the batch, within the wavenet convolutions' padding
+        for lengths in ([48, 40, 31], [40, 39, 38]):
+            with self.subTest(lengths=lengths):
+                self._check(lengths)
+
+    def _check(self, lengths):
+        torch.manual_seed(0)
+        cfm = CFM(_tiny_s2mel_args()).eval()
+        cfm.estimator.setup_caches(max_batch_size=2, max_seq_length=128)
+        generator = torch.Generator().manual_seed(3)
+        prompt_frames = 12
+        prompt = torch.randn(1, CHANNELS_MEL, prompt_frames, generator=generator)
+        style = torch.randn(1, 192, generator=generator)
+        mus = [torch.randn(1, n, 32, generator=generator) for n in lengths]
+        noise = torch.randn(len(lengths), CHANNELS_MEL, max(lengths), generator=generator)
+        mu = torch.zeros(len(lengths), max(lengths), 32)
+        for i, m in enumerate(mus):
+            mu[i, :lengths[i]] = m[0]
+
+        def solve(x, mu, x_lens, rows):
+            with torch.no_grad(), contextlib.redirect_stderr(io.StringIO()):  # tqdm
+                return cfm.solve_euler(x, x_lens, prompt.expand(rows, -1, -1), mu, style.expand(rows, -1), None,
+                                       cfm.make_t_span(3), 0.7)
+
+        batched = solve(noise.clone(), mu, torch.LongTensor(lengths), len(lengths))
+        for i, n in enumerate(lengths):
+            with self.subTest(length=n):
+                single = solve(noise[i:i + 1, :, :n].clone(), mus[i], torch.LongTensor([n]), 1)
+                torch.testing.assert_close(batched[i:i + 1, :, :n], single, atol=1e-5, rtol=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
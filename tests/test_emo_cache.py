@@ -0,0 +1,85 @@
+import sys
+import types
+import unittest
+from pathlib import Path
+
+import torch
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from indextts.utils.emo_cache import EmotionCache
+
+ENGINE_MODULE = "_fake_infer_v2"
+
+
+def _find_most_similar_cosine(query_vector, matrix):
+    return torch.argmax(torch.nn.functional.cosine_similarity(query_vector.float(), matrix.float(), dim=1))
+
+
+class _GPT:
+    def get_emovec(self, emo_speech_conditioning_latent, emo_cond_lengths):
+        return emo_speech_conditioning_latent.sum()
+
+    def merge_emovec(self, speech_conditioning_latent, emo_speech_conditioning_latent, cond_lengths,
+                     emo_cond_lengths, alpha=1.0):
+        return self.get_emovec(emo_speech_conditioning_latent, emo_cond_lengths) * alpha
+
+
+def _engine_module():
+    """A stand-in for the compiled ``indextts.infer_v2``: an engine class and its module-level cosine search."""
+    module = types.ModuleType(ENGINE_MODULE)
+    module.find_most_similar_cosine = _find_most_similar_cosine
+    module.Engine = type("Engine", (), {"__module__": ENGINE_MODULE})
+    sys.modules[ENGINE_MODULE] = module
+    return module
+
+
+def _engine(module):
+    tts = module.Engine()
+    tts.gpt = _GPT()
+    tts.spk_matrix = [torch.randn(4, 8)]
+    return tts
+
+
+class EmotionCacheInstallTest(unittest.TestCase):
+    """``install`` patches one engine; ``uninstall`` (or installing on another engine) puts everything back."""
+
+    def setUp(self):
+        self.module = _engine_module()
+        self.addCleanup(sys.modules.pop, ENGINE_MODULE, None)
+
+    def test_uninstall_restores_originals(self):
+        cache = EmotionCache()
+        tts = _engine(self.module)
+        cache.install(tts)
+        self.assertIn("get_emovec", vars(tts.gpt))
+        self.assertIsNot(self.module.find_most_similar_cosine, _find_most_similar_cosine)
+        latent = cache.register(torch.ones(2, 3), "emo:a")
+        self.assertEqual(float(tts.gpt.merge_emovec(latent, latent, torch.tensor([3]), torch.tensor([3]))), 6.0)
+        self.assertEqual(cache.stats()["emovec"]["entries"], 2)
+
+        cache.uninstall(_engine(self.module))  # another engine: nothing to undo
+        self.assertIn("get_emovec", vars(tts.gpt))
+        cache.uninstall(tts)
+        self.assertNotIn("get_emovec", vars(tts.gpt))
+        self.assertNotIn("merge_emovec", vars(tts.gpt))
+        self.assertIs(self.module.find_most_similar_cosine, _find_most_similar_cosine)
+        self.assertEqual(cache.stats()["emovec"]["entries"], 0)
+
+    def test_install_on_new_engine_releases_old(self):
+        cache = EmotionCache()
+        old, new = _engine(self.module), _engine(self.module)
+        cache.install(old)
+        cache.install(new)
+        self.assertNotIn("get_emovec", vars(old.gpt))
+        self.assertIn("get_emovec", vars(new.gpt))
+        # the global is wrapped once, around the original function
+        self.assertIs(self.module.find_most_similar_cosine.__wrapped__, _find_most_similar_cosine)
+        cache.uninstall()
+        self.assertIs(self.module.find_most_similar_cosine, _find_most_similar_cosine)
+
+
+if __name__ == "__main__":
+    unittest.main()
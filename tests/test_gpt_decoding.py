@@ -0,0 +1,157 @@
+import contextlib
+import io
+import sys
+import unittest
+from pathlib import Path
+
+import torch
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from indextts.gpt.continuous_batching import ContinuousBatchScheduler
+from indextts.gpt.model_v2 import UnifiedVoice
+
+MAX_CODES = 40
+SAMPLING = dict(do_sample=True, top_k=30, top_p=0.8, temperature=0.8, repetition_penalty=10.0)
+
+
+def _tiny_model():
+    torch.manual_seed(0)
+    conformer = dict(output_size=32, linear_units=64, attention_heads=2, num_blocks=1, input_layer="conv2d2",
+                     perceiver_mult=2)
+    model = UnifiedVoice(layers=4, model_dim=64, heads=4, max_text_tokens=60, max_mel_tokens=100,
+                         number_text_tokens=100, number_mel_codes=8194, start_mel_token=8192, stop_mel_token=8193,
+                         condition_type="conformer_perceiver", condition_module=conformer,
+                         emo_condition_module=dict(conformer))
+    model.post_init_gpt2_config(kv_cache=True)
+    # rows stop at different steps, some run into the length limit
+    model.mel_head.bias.data[model.stop_mel_token] = 1.2
+    return model.eval()
+
+
+def _cut(codes, stop_token):
+    """The codes of every row up to its first stop token."""
+    rows = []
+    for row in codes:
+        stops = (row == stop_token).nonzero()
+        rows.append(row[:int(stops[0])] if len(stops) else row)
+    return rows
+
+
+class GptDecodingTest(unittest.TestCase):
+    """
+    Every decoding path of ``UnifiedVoice.inference_speech`` must reproduce HF ``generate()`` over the dynamic
+    KV cache: token for token when greedy, and with the same draws under the same seed when sampling.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.model = _tiny_model()
+        generator = torch.Generator().manual_seed(3)
+        cls.cond = torch.randn(1, 50, 1024, generator=generator)
+        cls.emo_vec = torch.randn(3, 64, generator=generator)
+        cls.text = torch.randint(2, 90, (3, 12), generator=generator)
+        cls.text[1, 8:] = cls.model.stop_text_token  # left padded in the prompt
+
+    def setUp(self):
+        self._reset()
+
+    def _reset(self):
+        """The reference path: ``generate()`` with the dynamic KV cache."""
+        model = self.model
+        model.enable_static_kv_cache(False)
+        model.speculative_decoder = None
+        model.beam_search = None
+        model.sampling_decoder = None
+
+    def _generate(self, rows=3, seed=0, **kwargs):
+        torch.manual_seed(seed)
+        with torch.no_grad(), contextlib.redirect_stdout(io.StringIO()):
+            return self.model.inference_speech(self.cond, self.text[:rows], cond_lengths=torch.tensor([50]),
+                                               emo_vec=self.emo_vec[:rows], max_generate_length=MAX_CODES,
+                                               **kwargs)[0]
+
+    def _assert_same_codes(self, actual, expected):
+        stop = self.model.stop_mel_token
+        self.assertEqual(actual.shape[0], expected.shape[0])
+        for a, e in zip(_cut(actual, stop), _cut(expected, stop)):
+            self.assertTrue(torch.equal(a, e), f"{a.tolist()} != {e.tolist()}")
+
+    def test_static_kv_cache(self):
+        for kwargs in (dict(do_sample=False, num_beams=1), dict(SAMPLING, num_beams=1),
+                       dict(do_sample=False, num_beams=3)):
+            with self.subTest(**kwargs):
+                self._reset()
+                expected = self._generate(**kwargs)
+                self.model.enable_static_kv_cache(True)
+                self._assert_same_codes(self._generate(**kwargs), expected)
+
+    def test_prefix_kv_cache(self):
+        for kwargs in (dict(do_sample=False, num_beams=1), dict(SAMPLING, num_beams=1)):
+            with self.subTest(**kwargs):
+                self._reset()
+                expected = self._generate(**kwargs)
+                self.model.enable_prefix_kv_cache()
+                # the first call fills the prefix cache, the second one reads it back
+                for _ in range(2):
+                    self._assert_same_codes(self._generate(**kwargs), expected)
+                self.assertGreater(self.model.inference_model.prefix_cache.stats()["hits"], 0)
+
+    def test_continuous_batching(self):
+        model = self.model
+        greedy = dict(do_sample=False, repetition_penalty=10.0)
+        limits = [MAX_CODES, 7, 25]
+        expected = []
+        for i, limit in enumerate(limits):
+            text = self.text[i:i + 1]
+            text = text[:, :int((text[0] != model.stop_text_token).sum())]
+            torch.manual_seed(0)
+            with torch.no_grad(), contextlib.redirect_stdout(io.StringIO()):
+                codes = model.inference_speech(self.cond, text, cond_lengths=torch.tensor([50]),
+                                               emo_vec=self.emo_vec[i:i + 1], max_generate_length=limit,
+                                               num_beams=1, **greedy)[0]
+            expected.append(_cut(codes, model.stop_mel_token)[0])
+        with torch.no_grad():
+            latent = model.get_conditioning(self.cond.transpose(1, 2), torch.tensor([50]))
+        prompts = []
+        for i, limit in enumerate(limits):
+            with torch.no_grad():
+                conds_latent = model.build_conds_latent(latent, self.emo_vec[i:i + 1], 1)
+            text = self.text[i][self.text[i] != model.stop_text_token]
+            prompts.append({"conds_latent": conds_latent, "text_tokens": text, "max_generate_length": limit})
+        # two slots for three rows: the third is admitted when the first one retires
+        model.enable_static_kv_cache(True)
+        results = ContinuousBatchScheduler(model, max_batch_size=2, **greedy).generate(prompts)
+        for result, codes in zip(results, expected):
+            self.assertTrue(torch.equal(result["codes"], codes), f"{result['codes'].tolist()} != {codes.tolist()}")
+
+    def test_speculative_decoding(self):
+        kwargs = dict(do_sample=False, num_beams=1, repetition_penalty=10.0)
+        expected = self._generate(**kwargs)
+        expected_single = self._generate(rows=1, **kwargs)
+        for draft_layers, speculate_k in ((1, 2), (2, 4)):
+            with self.subTest(draft_layers=draft_layers, speculate_k=speculate_k):
+                self.model.enable_speculative_decoding(draft_layers, speculate_k)
+                self.model.speculative_decoder.last_stats = None
+                # a batch is not speculated: it falls back to generate()
+                self._assert_same_codes(self._generate(**kwargs), expected)
+                self.assertIsNone(self.model.speculative_decoder.last_stats)
+                self._assert_same_codes(self._generate(rows=1, **kwargs), expected_single)
+                self.assertIsNotNone(self.model.speculative_decoder.last_stats)
+                self._reset()
+
+    def test_lean_beam_search(self):
+        for kwargs in (dict(do_sample=False, num_beams=3, repetition_penalty=10.0),
+                       dict(SAMPLING, num_beams=3, length_penalty=0.0)):
+            with self.subTest(**kwargs):
+                self._reset()
+                expected = self._generate(**kwargs)
+                self.model.enable_lean_beam_search()
+                self._assert_same_codes(self._generate(**kwargs), expected)
+                self.assertIsNotNone(self.model.beam_search.last_stats)
+
+
+if __name__ == "__main__":
+    unittest.main()
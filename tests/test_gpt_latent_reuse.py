@@ -0,0 +1,115 @@
+import contextlib
+import io
+import sys
+import unittest
+from pathlib import Path
+
+import torch
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from indextts.gpt.model_v2 import UnifiedVoice
+from indextts.utils.common import remove_long_silence
+
+SILENT = 52
+ATOL = 1e-4
+
+
+def _tiny_model():
+    torch.manual_seed(0)
+    conformer = dict(output_size=32, linear_units=64, attention_heads=2, num_blocks=1, input_layer="conv2d2",
+                     perceiver_mult=2)
+    model = UnifiedVoice(layers=3, model_dim=64, heads=4, max_text_tokens=60, max_mel_tokens=100,
+                         number_text_tokens=100, number_mel_codes=8194, start_mel_token=8192, stop_mel_token=8193,
+                         condition_type="conformer_perceiver", condition_module=conformer,
+                         emo_condition_module=dict(conformer))
+    model.post_init_gpt2_config(kv_cache=True, static_kv_cache=True)
+    # stop after a few dozen codes
+    model.mel_head.bias.data[model.stop_mel_token] = 1.0
+    return model.eval()
+
+
+class LatentsFromGenerationTest(unittest.TestCase):
+    """``latents_from_generation`` must give the latents of the separate ``forward()`` pass."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.model = _tiny_model()
+        generator = torch.Generator().manual_seed(5)
+        cls.cond = torch.randn(1, 50, 1024, generator=generator)
+        cls.emo_vec = torch.randn(2, 64, generator=generator)
+        cls.text = torch.randint(2, 90, (2, 12), generator=generator)
+        cls.text[1, 9:] = cls.model.stop_text_token  # left padded in the prompt
+        cls.text_lengths = [12, 9]
+
+    def setUp(self):
+        self.model.enable_static_kv_cache(True)
+        self.model.beam_search = None
+        self.model.speculative_decoder = None
+
+    def _generate(self, batch=2, num_return_sequences=1, **kwargs):
+        torch.manual_seed(1)
+        with torch.no_grad(), contextlib.redirect_stdout(io.StringIO()):
+            return self.model.inference_speech(self.cond, self.text[:batch], cond_lengths=torch.tensor([50]),
+                                               emo_vec=self.emo_vec[:batch], max_generate_length=40,
+                                               num_return_sequences=num_return_sequences, **kwargs)
+
+    def _assert_matches_forward(self, codes, latent, code_lens, speech_latent, batch):
+        per_prompt = codes.shape[0] // batch
+        checked = 0
+        for i in range(codes.shape[0]):
+            b, n = i // per_prompt, int(code_lens[i])
+            if n == 0:
+                continue
+            length = self.text_lengths[b]
+            with torch.no_grad():
+                expected = self.model(speech_latent, self.text[b:b + 1, :length], torch.tensor([length]),
+                                      codes[i:i + 1, :n], torch.tensor([n]), None, emo_vec=self.emo_vec[b:b + 1],
+                                      use_speed=torch.zeros(1, dtype=torch.long))
+            torch.testing.assert_close(latent[i:i + 1, :n], expected, atol=ATOL, rtol=0)
+            checked += 1
+        self.assertGreater(checked, 0)
+
+    def _check(self, batch=2, num_return_sequences=1, compact=False, **kwargs):
+        codes, speech_latent = self._generate(batch, num_return_sequences, **kwargs)
+        if compact:
+            # force the silence compaction on every row
+            codes = codes.clone()
+            codes[:, 2:30:2] = SILENT
+            codes[:, 3:31:4] = SILENT
+        codes, code_lens = remove_long_silence(codes, self.model.stop_mel_token, max_consecutive=5 if compact else 30)
+        latent = self.model.latents_from_generation(codes)
+        self.assertIsNotNone(latent)
+        self.assertEqual(latent.shape[:2], codes.shape)
+        self._assert_matches_forward(codes, latent, code_lens, speech_latent, batch)
+
+    def test_sampling_left_padded_batch(self):
+        self._check(do_sample=True, top_k=30)
+
+    def test_num_return_sequences(self):
+        self._check(num_return_sequences=2, do_sample=True, top_k=30)
+
+    def test_compacted_codes(self):
+        self._check(compact=True, do_sample=True, top_k=30)
+
+    def test_hf_beam_search(self):
+        self._check(num_beams=3, do_sample=True, top_k=30)
+
+    def test_lean_beam_search(self):
+        self.model.enable_lean_beam_search()
+        self._check(num_return_sequences=2, num_beams=3, do_sample=True, top_k=30, repetition_penalty=10.0)
+
+    def test_speculative_decoding(self):
+        self.model.enable_speculative_decoding(1, 3)
+        self._check(batch=1, do_sample=False)
+
+    def test_dynamic_cache_has_no_prompt(self):
+        self.model.enable_static_kv_cache(False)
+        codes, _ = self._generate(do_sample=True, top_k=30)
+        self.assertIsNone(self.model.latents_from_generation(codes))
+
+
+if __name__ == "__main__":
+    unittest.main()
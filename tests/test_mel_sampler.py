@@ -0,0 +1,135 @@
+import contextlib
+import io
+import sys
+import unittest
+from pathlib import Path
+
+import torch
+from transformers import (LogitsProcessorList, RepetitionPenaltyLogitsProcessor, TemperatureLogitsWarper,
+                          TopKLogitsWarper, TopPLogitsWarper)
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from indextts.gpt.model_v2 import UnifiedVoice
+from indextts.gpt.sampling import MelTokenSampler
+
+VOCAB = 8194
+CONFIGS = [
+    dict(),
+    dict(repetition_penalty=10.0),
+    dict(temperature=0.8),
+    dict(top_k=30),
+    dict(top_p=0.8),
+    # the WebUI settings
+    dict(top_k=30, top_p=0.8, temperature=0.8, repetition_penalty=10.0),
+]
+
+
+def _hf_processors(top_k=None, top_p=None, temperature=None, repetition_penalty=None):
+    """The processors ``generate(do_sample=True)`` builds for these settings, in its order."""
+    processors = LogitsProcessorList()
+    if repetition_penalty is not None:
+        processors.append(RepetitionPenaltyLogitsProcessor(repetition_penalty))
+    if temperature is not None:
+        processors.append(TemperatureLogitsWarper(temperature))
+    if top_k is not None:
+        processors.append(TopKLogitsWarper(top_k))
+    if top_p is not None:
+        processors.append(TopPLogitsWarper(top_p))
+    return processors
+
+
+def _inputs(generator, rows=4, history=300):
+    logits = torch.randn(rows, VOCAB, generator=generator) * 3
+    input_ids = torch.randint(0, VOCAB, (rows, history), generator=generator)
+    # make sure some of the favourite codes were already generated
+    input_ids[:, :5] = logits.topk(5, dim=-1).indices
+    seen = torch.zeros(rows, VOCAB, dtype=torch.bool).scatter_(1, input_ids, True)
+    return logits, input_ids, seen
+
+
+class MelTokenSamplerTest(unittest.TestCase):
+    """``MelTokenSampler`` must sample from the distribution of the HF processors it replaces."""
+
+    def test_distribution_matches_hf_processors(self):
+        generator = torch.Generator().manual_seed(0)
+        for config in CONFIGS:
+            with self.subTest(**config):
+                logits, input_ids, seen = _inputs(generator)
+                expected = _hf_processors(**config)(input_ids, logits.clone()).softmax(dim=-1)
+                actual = MelTokenSampler(**config).probs(logits, seen)
+                torch.testing.assert_close(actual, expected, atol=1e-6, rtol=0)
+
+    def test_greedy_matches_hf_penalty(self):
+        generator = torch.Generator().manual_seed(1)
+        logits, input_ids, seen = _inputs(generator, rows=16)
+        expected = RepetitionPenaltyLogitsProcessor(10.0)(input_ids, logits.clone()).argmax(dim=-1)
+        actual = MelTokenSampler(do_sample=False, repetition_penalty=10.0)(logits, seen)
+        self.assertTrue(torch.equal(actual, expected))
+
+    def test_sample_frequencies(self):
+        generator = torch.Generator().manual_seed(2)
+        config = CONFIGS[-1]
+        logits, input_ids, seen = _inputs(generator, rows=1)
+        expected = _hf_processors(**config)(input_ids, logits.clone()).softmax(dim=-1)[0]
+        draws = 20000
+        torch.manual_seed(0)
+        tokens = MelTokenSampler(**config)(logits.expand(draws, -1), seen.expand(draws, -1))
+        observed = torch.bincount(tokens, minlength=VOCAB).float() / draws
+        self.assertLess(float((observed - expected).abs().sum()) / 2, 0.02)  # total variation distance
+        self.assertTrue(bool((expected[tokens] > 0).all()), "sampled a code outside top-k / top-p")
+
+
+class MelSamplingDecoderTest(unittest.TestCase):
+    """Greedy codes of the fused decoder must match ``generate()`` token for token."""
+
+    def setUp(self):
+        torch.manual_seed(0)
+        conformer = dict(output_size=32, linear_units=64, attention_heads=2, num_blocks=1, input_layer="conv2d2",
+                         perceiver_mult=2)
+        self.model = UnifiedVoice(layers=2, model_dim=64, heads=4, max_text_tokens=60, max_mel_tokens=100,
+                                  number_text_tokens=100, number_mel_codes=VOCAB, start_mel_token=8192,
+                                  stop_mel_token=8193, condition_type="conformer_perceiver",
+                                  condition_module=conformer, emo_condition_module=dict(conformer)).eval()
+        self.model.post_init_gpt2_config(kv_cache=True, static_kv_cache=True)
+        generator = torch.Generator().manual_seed(3)
+        self.cond = torch.randn(1, 50, 1024, generator=generator)
+        self.emo_vec = torch.randn(3, 64, generator=generator)
+        self.text = torch.randint(2, 90, (3, 12), generator=generator)
+        self.text[1, 8:] = self.model.stop_text_token
+
+    def _generate(self, **kwargs):
+        with torch.no_grad(), contextlib.redirect_stdout(io.StringIO()):
+            return self.model.inference_speech(self.cond, self.text, cond_lengths=torch.tensor([50]),
+                                               emo_vec=self.emo_vec, max_generate_length=40, **kwargs)[0]
+
+    def test_greedy_matches_generate(self):
+        model, generate = self.model, self._generate
+
+        # all rows stopped at different steps (output cut), some rows stopped, none stopped
+        for stop_bias in (1.5, 1.2, -0.5):
+            model.mel_head.bias.data[model.stop_mel_token] = stop_bias
+            for kwargs in (dict(do_sample=False), dict(do_sample=False, repetition_penalty=10.0)):
+                model.enable_fused_sampling(False)
+                model.enable_static_kv_cache(True)
+                expected = generate(**kwargs)
+                for sync_interval in (1, 5):
+                    with self.subTest(stop_bias=stop_bias, sync_interval=sync_interval, **kwargs):
+                        model.enable_fused_sampling(sync_interval=sync_interval)
+                        self.assertTrue(torch.equal(generate(**kwargs), expected))
+
+    def test_unfusable_processor_falls_back_to_generate(self):
+        # a processor from the model's generation config that MelTokenSampler cannot fuse
+        model = self.model
+        model.inference_model.generation_config.no_repeat_ngram_size = 2
+        model.enable_static_kv_cache(True)
+        expected = self._generate(do_sample=False)
+        model.enable_fused_sampling()
+        self.assertTrue(torch.equal(self._generate(do_sample=False), expected))
+        self.assertIsNone(model.sampling_decoder.last_stats)
+
+
+if __name__ == "__main__":
+    unittest.main()
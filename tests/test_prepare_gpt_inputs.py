@@ -0,0 +1,96 @@
+import sys
+import unittest
+from pathlib import Path
+
+import torch
+import torch.nn.functional as F
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from indextts.gpt.model_v2 import UnifiedVoice
+
+DIM = 64
+
+
+def prepare_gpt_inputs_loop(model, conditional_latents, text_inputs):
+    """The previous per-row implementation of ``UnifiedVoice.prepare_gpt_inputs``, kept as the reference."""
+    b, L = text_inputs.shape[:2]
+    device = text_inputs.device
+    single_cond = conditional_latents.ndim == 3 and conditional_latents.shape[0] == 1
+    batched_mel_emb = []
+    attention_masks = []
+    target_len = conditional_latents.shape[1] + L + 2
+    for i in range(b):
+        valid_mask = (text_inputs[i] != model.stop_text_token) & (text_inputs[i] != model.start_text_token)
+        text_input = text_inputs[i][valid_mask]
+        text_input = F.pad(text_input, (1, 0), value=model.start_text_token)
+        text_input = F.pad(text_input, (0, 1), value=model.stop_text_token)
+        text_input_pos = torch.arange(0, text_input.size(-1), device=device)
+        text_emb = model.text_embedding(text_input) + model.text_pos_embedding.emb(text_input_pos)
+        conds_text_emb = [
+            conditional_latents.squeeze(0) if single_cond else conditional_latents[i],
+            text_emb,
+        ]
+        attention_mask = torch.ones(target_len + 1, dtype=torch.long, device=device)
+        padding = L + 2 - text_input.size(-1)
+        if padding > 0:
+            pad = torch.zeros((padding, conditional_latents.size(-1)), dtype=text_emb.dtype, device=device)
+            conds_text_emb.insert(0, pad)
+            attention_mask[:padding] = 0
+        batched_mel_emb.append(torch.cat(conds_text_emb))
+        attention_masks.append(attention_mask)
+    batched_mel_emb = torch.stack(batched_mel_emb, dim=0)
+    attention_mask = torch.stack(attention_masks, dim=0)
+    fake_inputs = torch.ones((b, batched_mel_emb.shape[1] + 1), dtype=torch.long, device=device)
+    fake_inputs[:, -1] = model.start_mel_token
+    return fake_inputs, batched_mel_emb, attention_mask
+
+
+def build_model(dim):
+    torch.manual_seed(0)
+    conformer = dict(output_size=64, linear_units=128, attention_heads=2, num_blocks=1,
+                     input_layer="conv2d2", perceiver_mult=2)
+    model = UnifiedVoice(layers=1, model_dim=dim, heads=8, max_text_tokens=120, max_mel_tokens=100,
+                         number_text_tokens=12000, number_mel_codes=8194, start_text_token=0, stop_text_token=1,
+                         start_mel_token=8192, stop_mel_token=8193, condition_type="conformer_perceiver",
+                         condition_module=conformer, emo_condition_module=dict(conformer))
+    return model.eval()
+
+
+def text_batch(model, b, L, generator):
+    """Right-padded rows of different lengths, some with stray start/stop tokens inside."""
+    text = torch.randint(2, 12000, (b, L), generator=generator, dtype=torch.int32)
+    for i in range(b):
+        n = int(torch.randint(1, L + 1, (1,), generator=generator))
+        text[i, n:] = model.stop_text_token
+        if i % 3 == 1 and n > 2:
+            text[i, int(torch.randint(0, n, (1,), generator=generator))] = model.start_text_token
+    return text
+
+
+class PrepareGptInputsTest(unittest.TestCase):
+    """The tensorized ``prepare_gpt_inputs`` must be bit-identical to the per-row reference."""
+
+    def test_matches_loop(self):
+        model = build_model(DIM)
+        generator = torch.Generator().manual_seed(0)
+        with torch.no_grad():
+            for b in (1, 2, 5, 16, 32):
+                for L in (1, 7, 60, 120):
+                    text = text_batch(model, b, L, generator)
+                    for conds in (torch.randn(1, 34, DIM, generator=generator),
+                                  torch.randn(b, 34, DIM, generator=generator)):
+                        for dtype in (torch.float32, torch.float16):
+                            with self.subTest(batch=b, text_len=L, cond_rows=conds.shape[0], dtype=dtype):
+                                expected = prepare_gpt_inputs_loop(model, conds.to(dtype), text)
+                                actual = model.prepare_gpt_inputs(conds.to(dtype), text)
+                                for e, a in zip(expected, actual):
+                                    self.assertEqual(e.dtype, a.dtype)
+                                    self.assertEqual(e.shape, a.shape)
+                                    self.assertTrue(torch.equal(e, a))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import unittest
+import sys
+from pathlib import Path
+
+import torch
+from torch.nn.utils.rnn import pad_sequence
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from indextts.utils.common import code_lengths, remove_long_silence
+
+STOP = 8193
+SILENT = 52
+
+
+def remove_long_silence_loop(codes, stop_mel_token, silent_token=52, max_consecutive=30):
+    """The previous token-by-token ``IndexTTS.remove_long_silence``, kept as the reference."""
+    code_lens = []
+    codes_list = []
+    device = codes.device
+    isfix = False
+    for i in range(0, codes.shape[0]):
+        code = codes[i]
+        if not torch.any(code == stop_mel_token).item():
+            len_ = code.size(0)
+        else:
+            stop_mel_idx = (code == stop_mel_token).nonzero(as_tuple=False)
+            len_ = stop_mel_idx[0].item() if len(stop_mel_idx) > 0 else code.size(0)
+        count = torch.sum(code == silent_token).item()
+        if count > max_consecutive:
+            ncode_idx = []
+            n = 0
+            for k in range(len_):
+                if code[k] != silent_token:
+                    ncode_idx.append(k)
+                    n = 0
+                elif code[k] == silent_token and n < 10:
+                    ncode_idx.append(k)
+                    n += 1
+            len_ = len(ncode_idx)
+            codes_list.append(code[ncode_idx])
+            isfix = True
+        else:
+            codes_list.append(code[:len_])
+        code_lens.append(len_)
+    if isfix:
+        if len(codes_list) > 1:
+            codes = pad_sequence(codes_list, batch_first=True, padding_value=stop_mel_token)
+        else:
+            codes = codes_list[0].unsqueeze(0)
+    max_len = max(code_lens)
+    if max_len < codes.shape[1]:
+        codes = codes[:, :max_len]
+    code_lens = torch.tensor(code_lens, dtype=torch.long, device=device)
+    return codes, code_lens
+
+
+def _random_codes(generator, batch_size, T, silence_prob):
+    codes = torch.randint(0, 8192, (batch_size, T), generator=generator)
+    # silent tokens come in runs of random length
+    for i in range(batch_size):
+        k = 0
+        while k < T:
+            if torch.rand(1, generator=generator).item() < silence_prob:
+                run = int(torch.randint(1, 40, (1,), generator=generator))
+                codes[i, k:k + run] = SILENT
+                k += run
+            else:
+                k += 1
+        if torch.rand(1, generator=generator).item() < 0.7:
+            stop = int(torch.randint(0, T, (1,), generator=generator))
+            codes[i, stop] = STOP
+            # generate() pads finished rows with the stop token, but stray tokens may follow it as well
+            if torch.rand(1, generator=generator).item() < 0.5:
+                codes[i, stop + 1:] = STOP
+    return codes
+
+
+class TestRemoveLongSilence(unittest.TestCase):
+    def assert_same(self, codes, **kwargs):
+        expected = remove_long_silence_loop(codes, STOP, **kwargs)
+        actual = remove_long_silence(codes, STOP, **kwargs)
+        for e, a in zip(expected, actual):
+            self.assertEqual(e.dtype, a.dtype)
+            self.assertEqual(e.shape, a.shape)
+            self.assertTrue(torch.equal(e, a), f"{codes.tolist()}\n{e.tolist()}\n{a.tolist()}")
+
+    def test_matches_loop_on_random_batches(self):
+        generator = torch.Generator().manual_seed(0)
+        for batch_size in (1, 2, 3, 8):
+            for T in (1, 5, 64, 300):
+                for silence_prob in (0.0, 0.05, 0.3):
+                    for _ in range(3):
+                        codes = _random_codes(generator, batch_size, T, silence_prob)
+                        self.assert_same(codes)
+                        self.assert_same(codes, max_consecutive=5)
+
+    def test_edge_cases(self):
+        cases = [
+            [[SILENT] * 40],  # one long run at the start, no stop token
+            [[SILENT] * 40 + [STOP]],
+            [[STOP] + [SILENT] * 40],  # the silence after the stop token still counts, but is cut away
+            [[1, 2, 3, STOP, 5], [SILENT] * 35 + [7, STOP, 9, 9, 9]],  # untouched row is padded with the stop token
+            [[1] + [SILENT] * 11 + [2] + [SILENT] * 10 + [3] + [SILENT] * 12, [4, 5, 6] + [STOP] * 33],
+        ]
+        for rows in cases:
+            width = max(len(r) for r in rows)
+            codes = torch.tensor([r + [STOP] * (width - len(r)) for r in rows])
+            self.assert_same(codes)
+            self.assert_same(codes.to(torch.int32))
+
+    def test_code_lengths(self):
+        codes = torch.tensor([[1, 2, STOP, 3], [1, 2, 3, 4], [STOP, STOP, 1, 2]])
+        self.assertEqual(code_lengths(codes, STOP).tolist(), [2, 4, 0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import sys
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from indextts.utils.request_coalescer import RequestCoalescer, locked_stream
+
+
+class LockedStreamTest(unittest.TestCase):
+    """The lock is taken and released by the producer thread, whichever threads step the stream."""
+
+    def test_steps_on_different_threads(self):
+        lock = threading.RLock()
+        stream = locked_stream(lambda: iter(range(4)), lock)
+        pools = [ThreadPoolExecutor(1), ThreadPoolExecutor(1)]
+        items = [pools[i % 2].submit(next, stream).result() for i in range(4)]
+        with self.assertRaises(StopIteration):
+            pools[0].submit(next, stream).result()
+        self.assertEqual(items, [0, 1, 2, 3])
+        self.assertTrue(lock.acquire(timeout=1))
+        lock.release()
+        for pool in pools:
+            pool.shutdown()
+
+    def test_abandoned_stream_releases_lock(self):
+        lock = threading.RLock()
+        produced = []
+
+        def produce():
+            for i in range(100):
+                produced.append(i)
+                yield i
+
+        stream = locked_stream(produce, lock)
+        self.assertEqual(next(stream), 0)
+        stream.close()  # client disconnect
+        self.assertTrue(lock.acquire(timeout=5))
+        lock.release()
+        self.assertLess(len(produced), 100)
+
+    def test_producer_error_reaches_consumer(self):
+        lock = threading.RLock()
+
+        def produce():
+            yield 1
+            raise ValueError("bad prompt")
+
+        stream = locked_stream(produce, lock)
+        self.assertEqual(next(stream), 1)
+        with self.assertRaises(ValueError):
+            next(stream)
+        self.assertTrue(lock.acquire(timeout=1))
+        lock.release()
+
+
+class RequestCoalescerTest(unittest.TestCase):
+    """Every future resolves, and one bad request in a batch does not fail the others."""
+
+    def _submit(self, coalescer, payloads):
+        return [coalescer.submit("voice", payload) for payload in payloads]
+
+    def test_bad_request_retried_alone(self):
+        calls = []
+
+        def run_batch(payloads):
+            calls.append(len(payloads))
+            if any(p["text"] == "bad" for p in payloads):
+                raise ValueError("bad text")
+            return [p["text"].upper() for p in payloads]
+
+        coalescer = RequestCoalescer(run_batch, window_ms=200)
+        futures = self._submit(coalescer, [{"text": "a"}, {"text": "bad"}, {"text": "c"}])
+        self.assertEqual(futures[0].result(timeout=5), "A")
+        with self.assertRaises(ValueError):
+            futures[1].result(timeout=5)
+        self.assertEqual(futures[2].result(timeout=5), "C")
+        self.assertEqual(calls, [3, 1, 1, 1])
+
+    def test_short_results_fail_every_future(self):
+        def run_batch(payloads):
+            return [p["text"] for p in payloads[:1]]
+
+        coalescer = RequestCoalescer(run_batch, window_ms=200)
+        futures = self._submit(coalescer, [{"text": "a"}, {"text": "b"}])
+        # the batch is retried one by one, and each single run returns its one result
+        self.assertEqual([f.result(timeout=5) for f in futures], ["a", "b"])
+
+        coalescer = RequestCoalescer(lambda payloads: [], window_ms=200)
+        futures = self._submit(coalescer, [{"text": "a"}, {"text": "b"}])
+        for future in futures:
+            with self.assertRaises(RuntimeError):
+                future.result(timeout=5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import json
+import sys
+import tempfile
+import types
+import unittest
+from pathlib import Path
+
+import torch
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from indextts.infer_v2_pipeline import IndexTTS2Pipeline
+from indextts.utils.segment_cache import SegmentAudioCache
+from src.core.engine_client import EngineHttpClient
+
+
+class _Pipeline(IndexTTS2Pipeline):
+    """The segment bookkeeping of ``IndexTTS2Pipeline`` over stand-in stages: a segment's "audio" is drawn from
+    the global RNG when its GPT batch runs, so it depends on the seed and on the rows generated before it."""
+
+    def __init__(self, segment_cache=None):
+        tts = types.SimpleNamespace(stop_mel_token=8193, model_version="test", low_vram=False,
+                                    s2mel=types.SimpleNamespace(models={"cfm": object()}))
+        super().__init__(tts, segment_cache=segment_cache)
+        self.gpt_batches = []
+
+    def split_segments(self, text, max_text_tokens_per_segment=120):
+        return [[ord(c) for c in line] for line in text.split("|")]
+
+    def _conditioning(self, request):
+        return {"spk_cond_emb": self.spk_cond_emb}
+
+    def generate_codes(self, conds, segments, sampling, **generation_kwargs):
+        self.gpt_batches.append(len(segments))
+        return [{"wav": torch.randint(-1000, 1000, (1, 8)).float()} for _ in segments]
+
+    def decode_batch(self, items, s2mel_batch_size=None):
+        return [generated["wav"] for _, generated, _ in items]
+
+    def _finish(self, wavs, output_path=None):
+        return torch.cat(wavs, dim=1)
+
+
+class SegmentCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.prompt = Path(tmp.name) / "voice.wav"
+        self.prompt.write_bytes(b"voice")
+        self.cache_dir = Path(tmp.name) / "segments"
+        _Pipeline.spk_cond_emb = torch.zeros(1)
+
+    def _request(self, text, seed=None):
+        request = {"spk_audio_prompt": str(self.prompt), "text": text, "do_sample": True, "num_beams": 1}
+        if seed is not None:
+            request["seed"] = seed
+        return request
+
+    def test_seeded_requests_not_batched_together(self):
+        requests = [self._request("a|b"), self._request("c|d", seed=1), self._request("e", seed=2)]
+        pipeline = _Pipeline(SegmentAudioCache(str(self.cache_dir)))
+        results = pipeline.infer_batch(requests)
+        # the unseeded request is one GPT batch, each seeded request another
+        self.assertEqual(pipeline.gpt_batches, [2, 2, 1])
+        for request, result in zip(requests[1:], results[1:]):
+            alone = _Pipeline().infer_batch([request])[0]
+            self.assertTrue(torch.equal(result, alone))
+        # what was cached under a seed is what that seed gives on its own
+        self.assertEqual(len(pipeline.segment_cache), 3)
+        cached = _Pipeline(SegmentAudioCache(str(self.cache_dir)))
+        self.assertTrue(torch.equal(cached.infer_batch([requests[1]])[0], results[1]))
+        self.assertEqual(cached.gpt_batches, [])
+
+    def _line_seeds(self, lines):
+        """The seeds ``EngineHttpClient`` sends for the lines of a batch render with ``batch_seed`` 0."""
+        client = EngineHttpClient("http://127.0.0.1:7860", seed=0)
+        sent = []
+
+        def request(method, path, body=None, headers=None):
+            sent.append(json.loads(body))
+            return 200, {}, b""
+
+        client._request = request
+        for line in lines:
+            client.synthesize({"text": line, "seed": None})
+        return [payload["seed"] for payload in sent]
+
+    def test_second_render_hits_cache(self):
+        lines = ["first line", "second line", "third line"]
+        pipeline = _Pipeline(SegmentAudioCache(str(self.cache_dir)))
+        first = pipeline.infer_batch([self._request(t, seed) for t, seed in zip(lines, self._line_seeds(lines))])
+        self.assertEqual(pipeline.gpt_batches, [1, 1, 1])
+
+        # the script is edited: a line is inserted, the others keep their text and therefore their seed
+        edited = lines[:1] + ["new line"] + lines[1:]
+        pipeline = _Pipeline(SegmentAudioCache(str(self.cache_dir)))
+        second = pipeline.infer_batch([self._request(t, seed) for t, seed in zip(edited, self._line_seeds(edited))])
+        self.assertEqual(pipeline.gpt_batches, [1])
+        self.assertEqual(pipeline.segment_cache.hits, 3)
+        for before, after in zip(first, second[:1] + second[2:]):
+            self.assertTrue(torch.equal(before, after))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,6 +7,13 @@ import time
 import subprocess
 import importlib.util
 import shutil
+import uuid
+
+from indextts.utils.startup_profiler import StartupProfiler
+
+# read before argparse so that every import below is timed
+profiler = StartupProfiler.from_argv()
+_imports_stage = profiler.start_stage("imports")
 
 # Ensure critical packages are installed (especially for qwen-tts which might be missing)
 def ensure_package(module_name, package_name=None):
@@ -61,16 +68,11 @@ def ensure_package(module_name, package_name=None):
         except subprocess.CalledProcessError as e:
             print(f"Failed to install {package_name}: {e}")
 
-# Check qwen-tts at startup
-ensure_package("qwen_tts", "qwen-tts")
-
 import warnings
 
 warnings.filterwarnings("ignore", category=FutureWarning)
 warnings.filterwarnings("ignore", category=UserWarning)
 
-import pandas as pd
-
 current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(current_dir)
 sys.path.append(os.path.join(current_dir, "indextts"))
@@ -90,8 +92,39 @@ parser.add_argument("--cuda_kernel", action="store_true", default=False, help="U
 parser.add_argument("--device", type=str, default=None, help="Device to use (e.g., 'cuda:0', 'cpu', 'mps', 'xpu'). If not specified, auto-detect.")
 parser.add_argument("--gui_seg_tokens", type=int, default=120, help="GUI: Max tokens per generation segment")
 parser.add_argument("--low_vram", action="store_true", default=False, help="Enable low VRAM mode (forces FP16 on CUDA, reduces reference audio length)")
+parser.add_argument("--voice_cache_dir", type=str, default="voice_profiles", help="Directory of persisted speaker-conditioning profiles")
+parser.add_argument("--voice_cache_size", type=int, default=16, help="Number of speaker profiles kept in memory")
+parser.add_argument("--emo_cache_size", type=int, default=32, help="Number of emotion references kept in memory")
+parser.add_argument("--coalesce_window_ms", type=float, default=0, help="Batch same-voice unseeded requests arriving within this window (0 disables coalescing)")
+parser.add_argument("--max_batch_size", type=int, default=4, help="Max requests per coalesced batch and max rows per GPT batch")
+parser.add_argument("--continuous_batching", action="store_true", default=False, help="Batched requests with num_beams=1: refill GPT batch slots as rows stop, across speakers, instead of fixed batches")
+parser.add_argument("--segment_cache_dir", type=str, default="segment_cache", help="Directory of cached segment audio")
+parser.add_argument("--segment_cache_mb", type=float, default=0, help="Size limit of the segment audio cache in MB (0 disables it); only requests with a fixed seed or without sampling are cached")
+parser.add_argument("--static_kv_cache", action="store_true", default=False, help="Decode GPT tokens with a preallocated in-place KV cache (flat per-token latency on long segments)")
+parser.add_argument("--prefix_kv_cache", type=int, default=0, help="Reuse the GPT KV of up to N speaker/emotion/speed conditioning prefixes across segments (0 disables; implies --static_kv_cache)")
+parser.add_argument("--speculative_layers", type=int, default=0, help="Self-speculative GPT decoding for single-row segments: the first N GPT layers draft codes that the full model verifies (0 disables; implies --static_kv_cache)")
+parser.add_argument("--speculate_k", type=int, default=4, help="Codes drafted per verification pass with --speculative_layers")
+parser.add_argument("--lean_beam_search", action="store_true", default=False, help="Run num_beams > 1 GPT decoding with the purpose-built beam search (in-place beam reordering, fused repetition penalty; implies --static_kv_cache)")
+parser.add_argument("--fused_sampling", action="store_true", default=False, help="Run num_beams=1 GPT decoding with the fused mel-token sampler (repetition penalty, temperature, top-k, top-p in one step; implies --static_kv_cache)")
+parser.add_argument("--reuse_prompt_kv", action="store_true", default=False, help="Batched requests: compute the GPT latent of each segment from the prompt KV kept after generation instead of a second GPT pass over conditioning + text (implies --static_kv_cache)")
+parser.add_argument("--s2mel_solver", type=str, default="euler", choices=["euler", "heun", "midpoint", "dpm"], help="ODE solver of the s2mel flow matching (heun/midpoint: 2 DiT passes per step; dpm: 2nd-order multistep, 1 pass per step)")
+parser.add_argument("--s2mel_schedule", type=str, default="uniform", choices=["uniform", "sway"], help="Time schedule of the s2mel ODE steps (sway: more steps near the noise end)")
+parser.add_argument("--s2mel_cfg", type=str, default="full", choices=["full", "early", "middle"], help="Steps of the s2mel ODE that run classifier-free guidance (early: t <= 0.5, middle: 0.25 <= t <= 0.75; unguided steps run the DiT on half the batch)")
+parser.add_argument("--s2mel_cfg_mode", type=str, default="reuse", choices=["reuse", "skip"], help="Unguided s2mel steps with --s2mel_cfg early/middle: reuse the last guidance delta, or drop guidance")
+parser.add_argument("--diffusion_steps", type=int, default=25, help="Number of s2mel ODE steps for pipeline requests (benchmark fewer steps with tests/benchmark_cfm_solvers.py)")
+parser.add_argument("--s2mel_batch_size", type=int, default=1, help="Batched requests: solve up to this many segments of one speaker in one s2mel batch, padded to the longest (benchmark with tests/benchmark_s2mel_batching.py)")
+parser.add_argument("--gpt_quant", type=str, default=None, choices=["int8", "int4"], help="Weight-only quantization of the GPT blocks for CPU serving; loads <model_dir>/quantized/gpt_<mode>.pth if present (build it with: python -m indextts.gpt.quantize)")
+parser.add_argument("--snapshot", type=str, default=None, help="Start IndexTTS2 from an inference snapshot directory (build it with: python -m indextts.utils.snapshot)")
+parser.add_argument("--lazy", action="store_true", default=False, help="Open the port first and load models in the background; /api/ready reports when they are loaded")
+parser.add_argument("--profile-startup", dest="profile_startup", nargs="?", const="startup_profile.json", default=None, metavar="PATH", help="Write a per-import and per-stage startup timing tree to PATH")
+parser.add_argument("--residency_budget_gb", type=float, default=0, help="Device memory budget for resident models; idle models beyond it are moved to CPU (0 keeps one model on the device)")
 cmd_args = parser.parse_args()
 
+# Check qwen-tts at startup (lazy mode checks on first Qwen3-TTS use)
+if not cmd_args.lazy:
+    with profiler.stage("ensure_package qwen_tts"):
+        ensure_package("qwen_tts", "qwen-tts")
+
 # 支持通过环境变量传递设备信息（用于启动器）
 if cmd_args.device is None and 'INDEXTTS_DEVICE' in os.environ:
     cmd_args.device = os.environ['INDEXTTS_DEVICE']
@@ -114,57 +147,84 @@ for file in [
         sys.exit(1)
 
 import gradio as gr
-from indextts.infer_v2 import IndexTTS2
-from indextts.qwen3 import Qwen3TTS
+from omegaconf import OmegaConf
+from indextts.utils.voice_profile import VoiceProfileStore
+from indextts.utils.emo_cache import EmotionCache
+from indextts.utils.segment_cache import SegmentAudioCache
+from indextts.utils.request_coalescer import RequestCoalescer, locked_stream
+from indextts.infer_v2_pipeline import IndexTTS2Pipeline
+from indextts.utils.residency import ModelResidencyManager
+from indextts.utils.snapshot import load_snapshot, snapshot_is_current
 import torch
-import gc
 from tools.i18n.i18n import I18nAuto
 import gradio_client.utils as _gcu
+profiler.end_stage(_imports_stage)
 
 # Global model management
 qwen3_instance = None
 indextts_instance = None
+# held while a model is in use; the residency manager never moves a model whose lock is taken
+tts_lock = threading.RLock()
+qwen3_lock = threading.RLock()
+
+def create_indextts():
+    instance = None
+    if cmd_args.snapshot:
+        if snapshot_is_current(cmd_args.snapshot, cmd_args.model_dir, use_fp16=cmd_args.fp16, low_vram=cmd_args.low_vram):
+            print(f"Loading IndexTTS2 from snapshot {cmd_args.snapshot}...")
+            instance = load_snapshot(cmd_args.snapshot, device=cmd_args.device)
+        else:
+            print(f">> Snapshot {cmd_args.snapshot} is missing or out of date, loading checkpoints instead")
+    if instance is None:
+        # imported here so that lazy mode opens the port before transformers and the model code are imported
+        from indextts.infer_v2 import IndexTTS2
+        print("Loading IndexTTS2...")
+        instance = IndexTTS2(model_dir=cmd_args.model_dir,
+                             cfg_path=os.path.join(cmd_args.model_dir, "config.yaml"),
+                             use_fp16=cmd_args.fp16,
+                             use_deepspeed=cmd_args.deepspeed,
+                             use_cuda_kernel=cmd_args.cuda_kernel,
+                             device=cmd_args.device,
+                             low_vram=cmd_args.low_vram,
+                             )
+    if cmd_args.prefix_kv_cache > 0:
+        instance.gpt.enable_prefix_kv_cache(cmd_args.prefix_kv_cache)
+    elif cmd_args.static_kv_cache or cmd_args.reuse_prompt_kv:
+        instance.gpt.enable_static_kv_cache()
+    if cmd_args.gpt_quant:
+        from indextts.gpt.quantize import apply_gpt_quantization
+        apply_gpt_quantization(instance.gpt, cmd_args.gpt_quant, cmd_args.model_dir)
+    if cmd_args.speculative_layers > 0:
+        instance.gpt.enable_speculative_decoding(cmd_args.speculative_layers, cmd_args.speculate_k)
+    if cmd_args.lean_beam_search:
+        instance.gpt.enable_lean_beam_search()
+    if cmd_args.fused_sampling:
+        instance.gpt.enable_fused_sampling()
+    instance.s2mel.models['cfm'].set_solver(cmd_args.s2mel_solver, cmd_args.s2mel_schedule)
+    instance.s2mel.models['cfm'].set_cfg_schedule(cmd_args.s2mel_cfg, cmd_args.s2mel_cfg_mode)
+    return instance
+
+def create_qwen3():
+    ensure_package("qwen_tts", "qwen-tts")
+    from indextts.qwen3 import Qwen3TTS
+    print("Loading Qwen3-TTS...")
+    qwen = Qwen3TTS(os.path.join(cmd_args.model_dir, "hub", "Qwen3-TTS-12Hz-1.7B-VoiceDesign"), device=cmd_args.device or "cuda")
+    qwen.load_model()
+    return qwen
 
 def load_indextts():
-    global indextts_instance, tts, qwen3_instance
-    if indextts_instance is None:
-        if qwen3_instance is not None:
-            print("Unloading Qwen3-TTS to free VRAM...")
-            try:
-                qwen3_instance.unload_model()
-            except Exception as e:
-                print(f"Error unloading Qwen3: {e}")
-            qwen3_instance = None
-            
-        print("Loading IndexTTS2...")
-        indextts_instance = IndexTTS2(model_dir=cmd_args.model_dir,
-                        cfg_path=os.path.join(cmd_args.model_dir, "config.yaml"),
-                        use_fp16=cmd_args.fp16,
-                        use_deepspeed=cmd_args.deepspeed,
-                        use_cuda_kernel=cmd_args.cuda_kernel,
-                        device=cmd_args.device,
-                        low_vram=cmd_args.low_vram,
-                        )
+    global indextts_instance, tts
+    wait_for_models()
+    # promotes IndexTTS2 back to the device, demoting Qwen3-TTS to CPU if needed
+    indextts_instance = residency.acquire("indextts")
     # Always ensure global tts is synced with indextts_instance
     tts = indextts_instance
     return indextts_instance
 
 def load_qwen3():
-    global qwen3_instance, indextts_instance, tts
-    if qwen3_instance is None:
-        # Unload IndexTTS if loaded
-        if indextts_instance is not None:
-            print("Unloading IndexTTS2 to free VRAM...")
-            del indextts_instance
-            indextts_instance = None
-            tts = None
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
-            gc.collect()
-            
-        print("Loading Qwen3-TTS...")
-        qwen3_instance = Qwen3TTS(os.path.join(cmd_args.model_dir, "hub", "Qwen3-TTS-12Hz-1.7B-VoiceDesign"), device=cmd_args.device or "cuda")
-        
+    global qwen3_instance
+    wait_for_models()
+    qwen3_instance = residency.acquire("qwen3")
     return qwen3_instance
 
 _orig_json_schema_to_python_type = getattr(_gcu, "_json_schema_to_python_type", None)
@@ -177,15 +237,52 @@ if _orig_json_schema_to_python_type:
 
 i18n = I18nAuto(language="Auto")
 MODE = 'local'
-tts = IndexTTS2(model_dir=cmd_args.model_dir,
-                cfg_path=os.path.join(cmd_args.model_dir, "config.yaml"),
-                use_fp16=cmd_args.fp16,
-                use_deepspeed=cmd_args.deepspeed,
-                use_cuda_kernel=cmd_args.cuda_kernel,
-                device=cmd_args.device,
-                low_vram=cmd_args.low_vram,
-                )
-indextts_instance = tts
+# config.yaml is all the UI needs, so the UI can be built while the models are still loading
+model_cfg = OmegaConf.load(os.path.join(cmd_args.model_dir, "config.yaml"))
+tts = None
+residency = None
+models_ready = threading.Event()
+model_state = {"status": "loading", "error": None, "seconds": None}
+
+def init_models():
+    global tts, indextts_instance, residency
+    start = time.perf_counter()
+    try:
+        with profiler.stage("load IndexTTS2"):
+            tts = create_indextts()
+        indextts_instance = tts
+        manager = ModelResidencyManager(device=tts.device, budget_gb=cmd_args.residency_budget_gb)
+        # the emotion cache patches the engine it is installed on: undo that when the engine is released
+        manager.register("indextts", create_indextts, lock=tts_lock, instance=tts,
+                         unload=lambda instance: emo_cache.uninstall(instance))
+        manager.register("qwen3", create_qwen3, lock=qwen3_lock, unload=lambda qwen: qwen.unload_model())
+        residency = manager
+        model_state["status"] = "ready"
+    except Exception as e:
+        model_state.update(status="error", error=str(e))
+        raise
+    finally:
+        model_state["seconds"] = round(time.perf_counter() - start, 2)
+        models_ready.set()
+        if cmd_args.lazy:
+            profiler.finish("models loaded")
+    print(f">> Models ready in {model_state['seconds']}s")
+
+def wait_for_models():
+    models_ready.wait()
+    if model_state["status"] != "ready":
+        raise RuntimeError(f"模型加载失败: {model_state['error']}")
+
+if cmd_args.lazy:
+    threading.Thread(target=init_models, name="model-loader", daemon=True).start()
+else:
+    init_models()
+voice_store = VoiceProfileStore(cache_dir=cmd_args.voice_cache_dir, max_entries=cmd_args.voice_cache_size)
+emo_cache = EmotionCache(max_entries=cmd_args.emo_cache_size)
+segment_cache = None
+if cmd_args.segment_cache_mb > 0:
+    segment_cache = SegmentAudioCache(cache_dir=cmd_args.segment_cache_dir,
+                                      max_bytes=int(cmd_args.segment_cache_mb * (1 << 20)))
 # 支持的语言列表
 LANGUAGES = {
     "中文": "zh_CN",
@@ -236,23 +333,74 @@ def get_example_cases(include_experimental = False):
     # exclude emotion control mode 3 (emotion from text description)
     return [x for x in example_cases if x[1] != EMO_CHOICES_ALL[3]]
 
-def gen_single(emo_control_method,prompt, text,
-               emo_ref_path, emo_weight,
-               vec1, vec2, vec3, vec4, vec5, vec6, vec7, vec8,
-               emo_text,emo_random,
-               speaking_speed,
-               max_text_tokens_per_segment=120,
-                *args, progress=gr.Progress()):
-    # Ensure IndexTTS model is loaded
+def infer_with_caches(request):
+    """Prime the speaker/emotion slots of IndexTTS2 from the persistent caches, then run infer(). Call with tts_lock held."""
     current_tts = load_indextts()
-    
-    output_path = None
-    if not output_path:
-        output_path = os.path.join("outputs", f"spk_{int(time.time())}.wav")
-    # set gradio progress
-    current_tts.gr_progress = progress
+    if segment_cache is not None and (request.get("seed") is not None or not request.get("do_sample", True)):
+        # unchanged segments are read back from the segment cache instead of synthesized again
+        return get_pipeline(current_tts).infer(**request)
+    seed = request.pop("seed", None)
+    if seed is not None:
+        torch.manual_seed(seed)
+    prompt = request["spk_audio_prompt"]
+    # infer() falls back to the speaker prompt unless a reference audio drives the emotion
+    emo_source = request["emo_audio_prompt"]
+    if emo_source is None or request["emo_vector"] is not None or request["use_emo_text"]:
+        emo_source = prompt
+    try:
+        voice_key = voice_store.attach(current_tts, prompt, verbose=cmd_args.verbose)
+        emo_cache.install(current_tts)
+        emo_cache.register_voice(current_tts, voice_key)
+        emo_cache.attach(current_tts, emo_source, verbose=cmd_args.verbose)
+    except Exception as e:
+        # fall back to the model's own conditioning path
+        print(f">> Voice profile unavailable for {prompt}: {e}")
+    return current_tts.infer(**request)
+
+pipeline = None
+
+def get_pipeline(current_tts):
+    global pipeline
+    if pipeline is None or pipeline.tts is not current_tts:
+        pipeline = IndexTTS2Pipeline(current_tts, voice_store=voice_store, emo_cache=emo_cache,
+                                     segment_cache=segment_cache, continuous_batching=cmd_args.continuous_batching,
+                                     reuse_prompt_kv=cmd_args.reuse_prompt_kv,
+                                     diffusion_steps=cmd_args.diffusion_steps,
+                                     s2mel_batch_size=cmd_args.s2mel_batch_size)
+    return pipeline
+
+def run_gen_batch(requests):
+    with tts_lock:
+        current_tts = load_indextts()
+        if len(requests) == 1:
+            return [infer_with_caches(requests[0])]
+        return get_pipeline(current_tts).infer_batch(requests, max_batch_size=cmd_args.max_batch_size)
+
+coalescer = None
+if cmd_args.coalesce_window_ms > 0:
+    coalescer = RequestCoalescer(run_gen_batch, window_ms=cmd_args.coalesce_window_ms,
+                                 max_batch_size=cmd_args.max_batch_size)
+
+def run_request(request, kwargs):
+    """
+    Run one synthesis request. Unseeded requests go through the coalescer when it is on, batched with requests
+    for the same voice and sampling settings. Seeded requests always run on their own: a shared GPT batch draws
+    all its rows from one RNG stream, so it cannot honor a seed per request.
+    """
+    seed = request.get("seed")
+    if coalescer is not None and seed is None:
+        return coalescer(("gen_single", request["spk_audio_prompt"], tuple(sorted(kwargs.items())), seed), request)
+    with tts_lock:
+        return infer_with_caches(request)
+
+def build_request(current_tts, emo_control_method, prompt, text,
+                  emo_ref_path, emo_weight, vec, emo_text, emo_random,
+                  speaking_speed, max_text_tokens_per_segment, args, output_path=None):
+    """Translate the UI inputs into `infer()` keyword arguments; also returns the sampling kwargs."""
     do_sample, top_p, top_k, temperature, \
-        length_penalty, num_beams, repetition_penalty, max_mel_tokens = args
+        length_penalty, num_beams, repetition_penalty, max_mel_tokens = args[:8]
+    # the optional seed follows the sampling settings; empty or negative draws a new take every time
+    seed = args[8] if len(args) > 8 else None
     kwargs = {
         "do_sample": bool(do_sample),
         "top_p": float(top_p),
@@ -272,7 +420,6 @@ def gen_single(emo_control_method,prompt, text,
     if emo_control_method == 1:  # emotion from reference audio
         pass
     if emo_control_method == 2:  # emotion from custom vectors
-        vec = [vec1, vec2, vec3, vec4, vec5, vec6, vec7, vec8]
         vec = current_tts.normalize_emo_vec(vec, apply_bias=True)
     else:
         # don't use the emotion vector inputs for the other modes
@@ -283,22 +430,222 @@ def gen_single(emo_control_method,prompt, text,
         emo_text = None
 
     print(f"Emo control mode:{emo_control_method},weight:{emo_weight},vec:{vec}")
-    output = current_tts.infer(spk_audio_prompt=prompt, text=text,
-                       output_path=output_path,
-                       emo_audio_prompt=emo_ref_path, emo_alpha=emo_weight,
-                       emo_vector=vec,
-                       use_emo_text=(emo_control_method==3), emo_text=emo_text,use_random=emo_random,
-                       speaking_speed=float(speaking_speed),
-                       verbose=cmd_args.verbose,
-                       max_text_tokens_per_segment=int(max_text_tokens_per_segment),
-                       **kwargs)
+    request = dict(spk_audio_prompt=prompt, text=text,
+                   output_path=output_path,
+                   emo_audio_prompt=emo_ref_path, emo_alpha=emo_weight,
+                   emo_vector=vec,
+                   use_emo_text=(emo_control_method==3), emo_text=emo_text,use_random=emo_random,
+                   speaking_speed=float(speaking_speed),
+                   verbose=cmd_args.verbose,
+                   max_text_tokens_per_segment=int(max_text_tokens_per_segment),
+                   **kwargs)
+    if seed is not None and int(seed) >= 0:
+        # also makes the request cacheable in the segment cache
+        request["seed"] = int(seed)
+    return request, kwargs
+
+def gen_single(emo_control_method,prompt, text,
+               emo_ref_path, emo_weight,
+               vec1, vec2, vec3, vec4, vec5, vec6, vec7, vec8,
+               emo_text,emo_random,
+               speaking_speed,
+               max_text_tokens_per_segment=120,
+                *args, progress=gr.Progress()):
+    # Ensure IndexTTS model is loaded
+    current_tts = load_indextts()
+    
+    output_path = None
+    if not output_path:
+        if coalescer is not None:
+            # concurrent requests may finish within the same second
+            output_path = os.path.join("outputs", f"spk_{int(time.time())}_{uuid.uuid4().hex[:8]}.wav")
+        else:
+            output_path = os.path.join("outputs", f"spk_{int(time.time())}.wav")
+    # set gradio progress
+    if coalescer is None:
+        current_tts.gr_progress = progress
+    request, kwargs = build_request(current_tts, emo_control_method, prompt, text,
+                                    emo_ref_path, emo_weight,
+                                    [vec1, vec2, vec3, vec4, vec5, vec6, vec7, vec8],
+                                    emo_text, emo_random, speaking_speed, max_text_tokens_per_segment,
+                                    args, output_path=output_path)
+    start_time = time.perf_counter()
+    output = run_request(request, kwargs)
+    print(f">> gen_single: {time.perf_counter() - start_time:.2f}s, voice cache {voice_store.stats()}, emotion cache {emo_cache.stats()}"
+          + (f", segment cache {segment_cache.stats()}" if segment_cache is not None else ""))
     return gr.update(value=output,visible=True)
 
+def gen_stream(emo_control_method,prompt, text,
+               emo_ref_path, emo_weight,
+               vec1, vec2, vec3, vec4, vec5, vec6, vec7, vec8,
+               emo_text,emo_random,
+               speaking_speed,
+               max_text_tokens_per_segment=120,
+                *args):
+    """Same inputs as gen_single, but yields each segment's audio as soon as it is synthesized."""
+    def produce():
+        current_tts = load_indextts()
+        request, _ = build_request(current_tts, emo_control_method, prompt, text,
+                                   emo_ref_path, emo_weight,
+                                   [vec1, vec2, vec3, vec4, vec5, vec6, vec7, vec8],
+                                   emo_text, emo_random, speaking_speed, max_text_tokens_per_segment, args)
+        request.pop("output_path")
+        stream_pipeline = get_pipeline(current_tts)
+        yield from stream_pipeline.infer_stream(**request)
+        print(f">> gen_stream: {stream_pipeline.last_stream_metrics}")
+
+    yield from locked_stream(produce, tts_lock)
+
+# ---- binary HTTP API -------------------------------------------------------
+# JSON in, audio bytes out: no gradio_client round-trips and no polling of outputs/.
+import base64
+import hashlib
+import io
+import struct
+from typing import List, Optional
+
+import soundfile as sf
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel
+
+API_UPLOAD_DIR = os.path.join("prompts", ".api_uploads")
+AUDIO_MEDIA_TYPES = {"wav": "audio/wav", "flac": "audio/flac"}
+
+
+class SynthesisRequest(BaseModel):
+    text: str
+    # either a path on the engine machine (Local mode) or the audio itself (Remote mode)
+    spk_audio_prompt: Optional[str] = None
+    spk_audio_base64: Optional[str] = None
+    emo_control_method: int = 0
+    emo_audio_prompt: Optional[str] = None
+    emo_audio_base64: Optional[str] = None
+    emo_weight: float = 0.65
+    emo_vector: List[float] = [0.0] * 8
+    emo_text: Optional[str] = None
+    emo_random: bool = False
+    speaking_speed: float = 1.0
+    max_text_tokens_per_segment: int = 120
+    do_sample: bool = True
+    top_p: float = 0.8
+    top_k: int = 30
+    temperature: float = 0.8
+    length_penalty: float = 0.0
+    num_beams: int = 3
+    repetition_penalty: float = 10.0
+    max_mel_tokens: int = 1500
+    # part of the segment-cache key; also seeds the sampler
+    seed: Optional[int] = None
+    format: str = "wav"
+
+
+def _resolve_api_audio(path, data_b64):
+    if data_b64:
+        data = base64.b64decode(data_b64)
+        os.makedirs(API_UPLOAD_DIR, exist_ok=True)
+        # content-addressed, so the voice/emotion caches see the same file for the same audio
+        path = os.path.join(API_UPLOAD_DIR, hashlib.sha1(data).hexdigest() + ".wav")
+        if not os.path.isfile(path):
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+        return path
+    if path and not os.path.isfile(path):
+        raise HTTPException(status_code=400, detail=f"audio file not found: {path}")
+    return path
+
+
+def _api_request(req: SynthesisRequest, current_tts):
+    spk_audio_prompt = _resolve_api_audio(req.spk_audio_prompt, req.spk_audio_base64)
+    if not spk_audio_prompt:
+        raise HTTPException(status_code=400, detail="spk_audio_prompt or spk_audio_base64 is required")
+    if req.format not in AUDIO_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"unsupported format: {req.format}")
+    emo_audio_prompt = _resolve_api_audio(req.emo_audio_prompt, req.emo_audio_base64)
+    args = (req.do_sample, req.top_p, req.top_k, req.temperature,
+            req.length_penalty, req.num_beams, req.repetition_penalty, req.max_mel_tokens, req.seed)
+    return build_request(current_tts, req.emo_control_method, spk_audio_prompt, req.text,
+                         emo_audio_prompt, req.emo_weight, list(req.emo_vector), req.emo_text,
+                         req.emo_random, req.speaking_speed, req.max_text_tokens_per_segment, args)
+
+
+def _encode_audio(sampling_rate, wav_data, fmt):
+    buf = io.BytesIO()
+    sf.write(buf, wav_data, sampling_rate, format=fmt.upper(), subtype="PCM_16")
+    return buf.getvalue()
+
+
+def _wav_stream_header(sampling_rate, channels=1, bits=16):
+    # sizes are unknown while streaming; 0xFFFFFFFF is accepted by common players and decoders
+    byte_rate = sampling_rate * channels * bits // 8
+    return (b"RIFF" + struct.pack("<I", 0xFFFFFFFF) + b"WAVE"
+            + b"fmt " + struct.pack("<IHHIIHH", 16, 1, channels, sampling_rate, byte_rate, channels * bits // 8, bits)
+            + b"data" + struct.pack("<I", 0xFFFFFFFF))
+
+
+api_app = FastAPI(title="IndexTTS2 engine API")
+
+
+@api_app.get("/api/health")
+def api_health():
+    return {"status": "ok", "ready": model_state["status"] == "ready", "models": model_state,
+            "model_version": getattr(tts, "model_version", None) if tts is not None else None,
+            "residency": residency.stats() if residency is not None else None,
+            "segment_cache": segment_cache.stats() if segment_cache is not None else None,
+            "prefix_kv_cache": _prefix_kv_stats()}
+
+
+def _prefix_kv_stats():
+    prefix_cache = getattr(getattr(getattr(tts, "gpt", None), "inference_model", None), "prefix_cache", None)
+    return prefix_cache.stats() if prefix_cache is not None else None
+
+
+@api_app.get("/api/ready")
+def api_ready():
+    # 200 once the models are loaded; 503 while loading (lazy mode) or after a failed load
+    if model_state["status"] != "ready":
+        return JSONResponse(status_code=503, content=model_state)
+    return model_state
+
+
+@api_app.post("/api/tts")
+def api_tts(req: SynthesisRequest):
+    start_time = time.perf_counter()
+    current_tts = load_indextts()
+    request, kwargs = _api_request(req, current_tts)
+    sampling_rate, wav_data = run_request(request, kwargs)
+    content = _encode_audio(sampling_rate, wav_data, req.format)
+    elapsed = time.perf_counter() - start_time
+    return Response(content=content, media_type=AUDIO_MEDIA_TYPES[req.format],
+                    headers={"X-Audio-Duration": f"{len(wav_data) / sampling_rate:.3f}",
+                             "X-Inference-Time": f"{elapsed:.3f}"})
+
+
+@api_app.post("/api/tts/stream")
+def api_tts_stream(req: SynthesisRequest):
+    current_tts = load_indextts()
+    request, _ = _api_request(req, current_tts)
+    request.pop("output_path")
+
+    def chunks():
+        stream_pipeline = get_pipeline(load_indextts())
+        header_sent = False
+        for sampling_rate, chunk in stream_pipeline.infer_stream(**request):
+            if not header_sent:
+                yield _wav_stream_header(sampling_rate)
+                header_sent = True
+            yield chunk.tobytes()
+        print(f">> api stream: {stream_pipeline.last_stream_metrics}")
+
+    return StreamingResponse(locked_stream(chunks, tts_lock), media_type="audio/wav")
+
+
 def generate_new_voice(voice_desc, text_content, language):
     if not voice_desc or not text_content:
         return None, "请输入描述和文本"
         
-    qwen = None
+    qwen3_lock.acquire()
     try:
         qwen = load_qwen3()
         
@@ -326,9 +673,8 @@ def generate_new_voice(voice_desc, text_content, language):
         traceback.print_exc()
         return None, f"生成出错: {str(e)}"
     finally:
-        if qwen:
-            print("Generation complete, unloading Qwen3-TTS to free VRAM...")
-            qwen.unload_model()
+        # Qwen3-TTS stays loaded; it is moved to CPU when IndexTTS2 needs the device again
+        qwen3_lock.release()
 
 def update_prompt_audio():
     update_button = gr.update(interactive=True)
@@ -381,9 +727,12 @@ with gr.Blocks(title="K哥配音软件") as demo:
             if prompt_list:
                 default = prompt_list[0]
             with gr.Column():
-                input_text_single = gr.TextArea(label=i18n("文本"),key="input_text_single", placeholder=i18n("请输入目标文本"), info=f"{i18n('当前模型版本')}{tts.model_version or '1.0'}")
+                input_text_single = gr.TextArea(label=i18n("文本"),key="input_text_single", placeholder=i18n("请输入目标文本"), info=f"{i18n('当前模型版本')}{model_cfg.get('version') or '1.0'}")
                 gen_button = gr.Button(i18n("生成语音"), key="gen_button",interactive=True)
-            output_audio = gr.Audio(label=i18n("生成结果"), visible=True,key="output_audio")
+                stream_button = gr.Button(i18n("流式生成"), key="stream_button",interactive=True)
+            with gr.Column():
+                output_audio = gr.Audio(label=i18n("生成结果"), visible=True,key="output_audio")
+                stream_audio = gr.Audio(label=i18n("流式结果"), streaming=True, autoplay=True, key="stream_audio")
 
         experimental_checkbox = gr.Checkbox(label=i18n("显示实验功能"), value=False)
 
@@ -450,16 +799,18 @@ with gr.Blocks(title="K哥配音软件") as demo:
                     with gr.Row():
                         repetition_penalty = gr.Number(label="repetition_penalty", precision=None, value=10.0, minimum=0.1, maximum=20.0, step=0.1)
                         length_penalty = gr.Number(label="length_penalty", precision=None, value=0.0, minimum=-2.0, maximum=2.0, step=0.1)
-                    max_mel_tokens = gr.Slider(label="max_mel_tokens", value=1500, minimum=50, maximum=tts.cfg.gpt.max_mel_tokens, step=10, info=i18n("生成Token最大数量，过小导致音频被截断"), key="max_mel_tokens")
+                    max_mel_tokens = gr.Slider(label="max_mel_tokens", value=1500, minimum=50, maximum=model_cfg.gpt.max_mel_tokens, step=10, info=i18n("生成Token最大数量，过小导致音频被截断"), key="max_mel_tokens")
+                    seed = gr.Number(label="seed", value=-1, precision=0, minimum=-1, key="seed",
+                                     info=i18n("固定种子可复现结果，并让重新生成时未修改的分句命中分段缓存；-1 为每次随机"))
                     # with gr.Row():
                     #     typical_sampling = gr.Checkbox(label="typical_sampling", value=False, info="不建议使用")
                     #     typical_mass = gr.Slider(label="typical_mass", value=0.9, minimum=0.0, maximum=1.0, step=0.1)
                 with gr.Column(scale=2):
                     gr.Markdown(f'**{i18n("分句设置")}** _{i18n("参数会影响音频质量和生成速度")}_')
                     with gr.Row():
-                        initial_value = max(20, min(tts.cfg.gpt.max_text_tokens, cmd_args.gui_seg_tokens))
+                        initial_value = max(20, min(model_cfg.gpt.max_text_tokens, cmd_args.gui_seg_tokens))
                         max_text_tokens_per_segment = gr.Slider(
-                            label=i18n("分句最大Token数"), value=initial_value, minimum=20, maximum=tts.cfg.gpt.max_text_tokens, step=2, key="max_text_tokens_per_segment",
+                            label=i18n("分句最大Token数"), value=initial_value, minimum=20, maximum=model_cfg.gpt.max_text_tokens, step=2, key="max_text_tokens_per_segment",
                             info=i18n("建议80~200之间，值越大，分句越长；值越小，分句越碎；过小过大都可能导致音频质量不高"),
                         )
                     with gr.Row():
@@ -474,6 +825,7 @@ with gr.Blocks(title="K哥配音软件") as demo:
                 do_sample, top_p, top_k, temperature,
                 length_penalty, num_beams, repetition_penalty, max_mel_tokens,
                 # typical_sampling, typical_mass,
+                seed,
             ]
 
         # we must use `gr.Dataset` to support dynamic UI rewrites, since `gr.Examples`
@@ -527,6 +879,9 @@ with gr.Blocks(title="K哥配音软件") as demo:
     )
 
     def on_input_text_change(text, max_text_tokens_per_segment):
+        if not models_ready.is_set():
+            # lazy mode: the tokenizer is not loaded yet, the preview fills in on the next edit
+            return {segments_preview: gr.update()}
         if indextts_instance is None:
              load_indextts()
         if text and len(text) > 0:
@@ -542,6 +897,7 @@ with gr.Blocks(title="K哥配音软件") as demo:
                 segments_preview: gr.update(value=data, visible=True, type="array"),
             }
         else:
+            import pandas as pd
             df = pd.DataFrame([], columns=[i18n("序号"), i18n("分句内容"), i18n("Token数")])
             return {
                 segments_preview: gr.update(value=df),
@@ -628,10 +984,30 @@ with gr.Blocks(title="K哥配音软件") as demo:
                              max_text_tokens_per_segment,
                              *advanced_params,
                      ],
-                     outputs=[output_audio])
+                     outputs=[output_audio],
+                     concurrency_limit=cmd_args.max_batch_size if coalescer is not None else "default")
+
+    stream_button.click(gen_stream,
+                        inputs=[emo_control_method,prompt_audio, input_text_single, emo_upload, emo_weight,
+                                vec1, vec2, vec3, vec4, vec5, vec6, vec7, vec8,
+                                emo_text,emo_random,
+                                speaking_speed,
+                                max_text_tokens_per_segment,
+                                *advanced_params,
+                        ],
+                        outputs=[stream_audio],
+                        api_name="gen_stream")
 
 
 
 if __name__ == "__main__":
+    import uvicorn
     demo.queue(20)
-    demo.launch(server_name=cmd_args.host, server_port=cmd_args.port)
+    # serve the Gradio UI and the binary /api/* routes from the same port
+    app = gr.mount_gradio_app(api_app, demo, path="/")
+    print(f">> Running on http://{cmd_args.host}:{cmd_args.port} (binary API at /api/tts)")
+    if cmd_args.lazy:
+        profiler.write("port opening, models loading in background")
+    else:
+        profiler.finish("port opening")
+    uvicorn.run(app, host=cmd_args.host, port=cmd_args.port, timeout_keep_alive=60)